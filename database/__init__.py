@@ -23,11 +23,16 @@
 #
 #########################################################################
 
+import collections
 import copy
 import re
 import os
 import datetime
 import functools
+import gzip
+import json
+import operator
+import queue
 import time
 import threading
 
@@ -51,7 +56,7 @@ class Database(SmartPlugin):
     """
 
     ALLOW_MULTIINSTANCE = True
-    PLUGIN_VERSION = '1.6.13'
+    PLUGIN_VERSION = '1.6.14'
 
     # SQL queries: {item} = item table name, {log} = log table name
     # time, item_id, val_str, val_num, val_bool, changed
@@ -66,9 +71,41 @@ class Database(SmartPlugin):
         '4': ["CREATE INDEX {log}_{item}_id_changed ON {log} (item_id, changed);",
               "DROP INDEX {log}_{item}_id_changed;"],
         '5': ["CREATE UNIQUE INDEX {item}_id ON {item} (id);", "DROP INDEX {item}_id;"],
-        '6': ["CREATE INDEX {item}_name ON {item} (name);", "DROP INDEX {item}_name;"]
+        '6': ["CREATE INDEX {item}_name ON {item} (name);", "DROP INDEX {item}_name;"],
+        '7': [
+            "CREATE TABLE {rollup_hour} (item_id INTEGER, time BIGINT, val_min REAL, val_max REAL, val_sum REAL, val_count BIGINT, val_integrate REAL, val_on REAL, duration BIGINT);",
+            "DROP TABLE {rollup_hour};"],
+        '8': ["CREATE UNIQUE INDEX {rollup_hour}_id_time ON {rollup_hour} (item_id, time);", "DROP INDEX {rollup_hour}_id_time;"],
+        '9': [
+            "CREATE TABLE {rollup_day} (item_id INTEGER, time BIGINT, val_min REAL, val_max REAL, val_sum REAL, val_count BIGINT, val_integrate REAL, val_on REAL, duration BIGINT);",
+            "DROP TABLE {rollup_day};"],
+        '10': ["CREATE UNIQUE INDEX {rollup_day}_id_time ON {rollup_day} (item_id, time);", "DROP INDEX {rollup_day}_id_time;"]
     }
 
+    # Periods (in ms) of the rollup tables, coarsest period first
+    _rollup_periods = {'day': 24 * 3600 * 1000, 'hour': 3600 * 1000}
+
+    # Functions of _series and _single, that can be calculated from the rollup tables
+    _rollup_funcs = ['avg', 'integrate', 'min', 'max', 'on', 'sum', 'countall']
+
+    # Functions of _series and _single, that can be calculated from partial aggregates (merged with buffered values)
+    _partial_funcs = _rollup_funcs + ['count']
+
+    # Comparison operators of the count function
+    _compare_ops = {'<': operator.lt, '>': operator.gt, '=': operator.eq, '!=': operator.ne, '<>': operator.ne}
+
+    # Indexes checked by the index advisor: name -> (table, columns, unique, optional)
+    _advised_indexes = {
+        '{log}_{item}_id_time': ('{log}', 'item_id, time', True, False),
+        '{log}_{item}_id_changed': ('{log}', 'item_id, changed', False, False),
+        '{log}_{item}_id_time_cover': ('{log}', 'item_id, time, duration, val_num, val_bool', False, True),
+        '{rollup_hour}_id_time': ('{rollup_hour}', 'item_id, time', True, False),
+        '{rollup_day}_id_time': ('{rollup_day}', 'item_id, time', True, False),
+    }
+
+    # Upper bounds (in ms) of the buckets of the query latency histograms
+    _latency_buckets = [1, 5, 10, 50, 100, 500, 1000, 5000]
+
 
     def __init__(self, sh, *args, **kwargs):
         """
@@ -112,24 +149,67 @@ class Database(SmartPlugin):
 
         self._webdata = {}
 
-        self._replace = {table: table if self._prefix == "" else self._prefix + table for table in ["log", "item"]}
+        self._replace = {table: table if self._prefix == "" else self._prefix + table for table in ["log", "item", "rollup_hour", "rollup_day"]}
         self._replace['item_columns'] = ", ".join(COL_ITEM)
         self._replace['log_columns'] = ", ".join(COL_LOG)
-        self._buffer = {}
+        self._buffer = {}                       # buffer (deque) of tuples (time, duration, value) for each item
+        self._buffer_maxlen = self.get_parameter_value('buffer_maxlen')
+        self._buffer_overflow = self.get_parameter_value('buffer_overflow')
+        self._buffer_hwm = {}                   # high-water mark of the buffer for each item
+        self._buffer_dropped = 0                # number of tuples dropped due to buffer overflow
+        self._buffer_pending = 0                # number of tuples in all buffers, that are not yet dumped
+        self._buffer_inflight = {}              # tuples taken out of the buffer by the running dump, until they are committed
+        self._dump_threshold = self.get_parameter_value('dump_threshold')
+        self._writer_event = threading.Event()  # triggers a dump by the writer thread
+        self._writer_thread = None
+        self._spill = self.get_parameter_value('spill_to_disk')
+        self._spill_path = f"{os.getcwd()}/var/plugin_data/{self.get_shortname()}/spill{'_' + self.get_instance_name() if self.get_instance_name() else ''}.jsonl"
         self._buffer_lock = threading.Lock()
         self._dump_lock = threading.Lock()
 
+        self._bulk_dump = self.get_parameter_value('bulk_dump')
+        self._upsert_mode = self._get_upsert_mode()
+        self._upsert_chunk_size = 100           # max. number of log records written by one UPSERT query
+        self._upsert_queries = {}               # cache of UPSERT queries by number of log records
+        self._dump_stats = {'last_dump': None, 'items': 0, 'tuples': 0, 'duration': 0.0, 'rate': 0.0}
+
+        self._rollup = self.get_parameter_value('rollup')
+        if self._rollup and self._upsert_mode is None:
+            self.logger.warning("Rollup tables are not supported with this database, rollup is disabled")
+            self._rollup = False
+        self._rollup_watermark = {}             # end of the last complete bucket for each rollup table
+        self._rollup_dirty = {name: {} for name in self._rollup_periods}  # buckets to recalculate {bucket: set(ids)}
+        self._rollup_backfill_buckets = 168     # max. number of buckets calculated from existing data per dump
+        self._rollup_build_chunk = 500          # max. number of database IDs per rollup calculation query
+
+        self._series_cache_size = self.get_parameter_value('series_cache_size')
+        self._series_cache_ttl = self.get_parameter_value('series_cache_ttl')
+        self._series_cache = collections.OrderedDict()  # results of series requests by sid (LRU order)
+        self._series_cache_lock = threading.Lock()
+        self._series_cache_versions = {}                # number of writes by item path, to detect writes during a read
+        self._series_cache_stats = {'hits': 0, 'misses': 0, 'invalidations': 0, 'evictions': 0}
+
+        self._dump_chunk_size = 10000           # number of log records read at once for a file dump
+
         self.skipping_dump = False
         self._remove_older_skipped = False
         self.lock_remove_older = False
 
         self.orphanlist = []                    # list with item names of orphant database entries
         self._orphan_logcount = {}              # dict to store the number of log records for an orphan
+        self._item_ids = {}                     # item path -> database id (loaded by _load_item_ids)
+        self._item_names = {}                   # database id -> item path
+        self._item_ids_loaded = False
+        self._item_ids_lock = threading.Lock()
         self.remove_orphan = False              # set to True to remove orphans during remove_older
         self.delete_orphan_chunk_size = 20000   # Delete x log entries for orphan items at a time
         self._handled_items = []                # items that have a 'database' attribute set
         self._items_with_maxage = []            # items that have a 'database_maxage' attribute set
         self._maxage_worklist = []              # work copy of self._items_with_maxage
+        self._maxage_delete_rate = self.get_parameter_value('maxage_delete_rate')
+        self._maxage_run_time = self._removeold_cycle / 2  # max. duration (in seconds) of a remove_older run
+        self._maxage_worklist_path = f"{os.getcwd()}/var/plugin_data/{self.get_shortname()}/maxage_worklist{'_' + self.get_instance_name() if self.get_instance_name() else ''}.json"
+        self._maxage_stats = {'last_run': None, 'items': 0, 'deleted': 0, 'deleted_total': 0, 'duration': 0.0, 'remaining': 0}
         self._item_logcount = {}                # dict to store the number of log records for an item
         self._items_total_entries = 0           # total number of log entries
         self._items_still_counting = False      # total number of log entries
@@ -159,6 +239,16 @@ class Database(SmartPlugin):
             self._init_complete = False
             return
 
+        # Setup pool of connections for read-only queries
+        self._read_connections = self.get_parameter_value('read_connections')
+        self._db_read_pool = None
+        self._lock_wait_stats = {}              # lock wait times by query type
+        self._latency_stats = {}                # latency histograms by query template
+        if self._read_connections > 0:
+            self._db_read_pool = queue.Queue()
+            for i in range(self._read_connections):
+                self._db_read_pool.put(lib.db.Database(("" if self._prefix == ""  else self._prefix.capitalize()) + "DatabaseRead", self.driver, self._connect))
+
         self._db_initialized = False
         self._db_maint_initialized = False
         if not self._initialize_db():
@@ -179,8 +269,11 @@ class Database(SmartPlugin):
         self.logger.debug("Run method called")
         self._initialize_db()
         self.build_orphanlist(True)
-        self._start_schedulers()
+        self._rollup_init()
+        self._load_maxage_worklist()
+        # the writer thread started by _start_schedulers() runs while the plugin is alive
         self.alive = True
+        self._start_schedulers()
 
 
     def stop(self):
@@ -190,9 +283,11 @@ class Database(SmartPlugin):
         self.logger.debug("Stop method called")
         self.alive = False
         self._stop_schedulers()
+        self._stop_writer()
         self._dump(True)
         self._db.close()
         self._db_maint.close()
+        self._close_read_pool()
 
 
     def parse_item(self, item):
@@ -311,39 +406,44 @@ class Database(SmartPlugin):
             if end - start < 0:
                 self.logger.warning("Negative duration: start: {0}, end {1}, prevChange: {2}, lastChange: {3}, item: {4}".format(start , end, item.prev_change(), item.last_change(), item ))
 
-            # Determine, if DB buffer has a valid "last" value:
-            if len(self._buffer[item]) == 0 or self._buffer[item][-1][1] is not None:
-                last = None
-            else:
-                last = self._buffer[item][-1]
+            # The buffer of the item is modified while holding the buffer lock, so the dumper can not swap
+            # the buffer out between reading and rewriting the last value. All operations are O(1).
+            with self._buffer_lock:
+                buffer = self._buffer[item]
 
-            if debug_item:
-                self.logger.warning(f"Debug: last {last}, len buffer_item {len(self._buffer[item])}, buffer_item {self._buffer[item]}")
+                # Determine, if DB buffer has a valid "last" value:
+                if len(buffer) == 0 or buffer[-1][1] is not None:
+                    last = None
+                else:
+                    last = buffer[-1]
 
-            # Update the DB buffer:
-            if last:
-                # Step 1a): Alter current value with updated duration:
                 if debug_item:
-                    self.logger.warning(f"Debug 1a): Rewriting valid last value, start: {last[0]}, duration: {end - start}, value: {last[2]} to item '{item}'.")
-                self._buffer[item][-1] = (last[0], end - start, last[2])
-            else:
-		# Step 1b): Append new value with none duration
+                    self.logger.warning(f"Debug: last {last}, len buffer_item {len(buffer)}, buffer_item {buffer}")
 
-                #If item is configured to be initialized via database init (see database: init in item.yaml), do not update previous value if the latter qual to the regular initial_value.
-                # This is because configuring database: init aims at avoiding the regular item initial value to appear inside the DB:
-                if self.get_iattr_value(item.conf, 'database').lower() == 'init' and item.property.prev_change_by =='Init:Initial_Value':
+                # Update the DB buffer:
+                if last:
+                    # Step 1a): Alter current value with updated duration:
                     if debug_item:
-                        self.logger.warning(f"Debug 1b): Do not append previous value as it was set by Initial_Value")
+                        self.logger.warning(f"Debug 1a): Rewriting valid last value, start: {last[0]}, duration: {end - start}, value: {last[2]} to item '{item}'.")
+                    buffer[-1] = (last[0], end - start, last[2])
                 else:
-                    if debug_item:
-                        self.logger.warning(f"Debug 1b): Appending prev_value: start: {start}, duration: {end-start}, prev_value: {item.prev_value()} to item '{item}'")
-                    self._buffer[item].append((start, end - start, item.prev_value()))
+                    # Step 1b): Append new value with none duration
+
+                    #If item is configured to be initialized via database init (see database: init in item.yaml), do not update previous value if the latter qual to the regular initial_value.
+                    # This is because configuring database: init aims at avoiding the regular item initial value to appear inside the DB:
+                    if self.get_iattr_value(item.conf, 'database').lower() == 'init' and item.property.prev_change_by =='Init:Initial_Value':
+                        if debug_item:
+                            self.logger.warning(f"Debug 1b): Do not append previous value as it was set by Initial_Value")
+                    else:
+                        if debug_item:
+                            self.logger.warning(f"Debug 1b): Appending prev_value: start: {start}, duration: {end-start}, prev_value: {item.prev_value()} to item '{item}'")
+                        self._buffer_append(item, buffer, (start, end - start, item.prev_value()))
 
-            # Step 2: Add current value with duration "none" to DB buffer. This entry is "none" because the duration cannot be determined yet as it's duration has not finished
-            if debug_item:
-                self.logger.warning(f"Debug 2): Appending current value: start {end}, value {item()} to item '{item}'")
+                # Step 2: Add current value with duration "none" to DB buffer. This entry is "none" because the duration cannot be determined yet as it's duration has not finished
+                if debug_item:
+                    self.logger.warning(f"Debug 2): Appending current value: start {end}, value {item()} to item '{item}'")
 
-            self._buffer[item].append((end, None, item()))
+                self._buffer_append(item, buffer, (end, None, item()))
         else:
             self.logger.debug("Not writing item '{}' value because database_acl = {}".format(item,  acl))
 
@@ -354,20 +454,58 @@ class Database(SmartPlugin):
         """
         if self.count_logentries:
             self.scheduler_add('Count logs', self._count_logentries, cycle=6*3600, prio=6)
-        self.scheduler_add('Buffer dump', self._dump, cycle=self._dump_cycle, prio=5)
+        self._start_writer()
         if len(self._items_with_maxage) > 0:
             # self.scheduler_add('Remove old', self.remove_older_than_maxage, cycle=91, prio=6)
             self.scheduler_add('Remove old', self.remove_older_than_maxage, cycle=self._removeold_cycle, prio=7)
         return
 
 
+    def _start_writer(self):
+        """
+        Start the background writer thread, that dumps the buffer to the database
+        """
+        self._writer_thread = threading.Thread(target=self._writer, name=self.get_fullname() + '.writer', daemon=True)
+        self._writer_thread.start()
+        return
+
+
+    def _stop_writer(self):
+        """
+        Stop the background writer thread
+        """
+        if self._writer_thread is not None:
+            self._writer_event.set()
+            self._writer_thread.join(timeout=60)
+            self._writer_thread = None
+        return
+
+
+    def _writer(self):
+        """
+        Background writer thread
+
+        Dumps the buffer every dump cycle or as soon as the number of pending values reaches dump_threshold
+        """
+        self.logger.debug("Writer thread started")
+        while self.alive:
+            self._writer_event.wait(timeout=self._dump_cycle)
+            self._writer_event.clear()
+            if not self.alive:
+                break
+            try:
+                self._dump()
+            except Exception as e:
+                self.logger.exception(f"Writer thread: Exception during dump: {e}")
+        self.logger.debug("Writer thread stopped")
+
+
     def _stop_schedulers(self):
         """
         Stop jobs that maintain buffer and database
         """
         if len(self._items_with_maxage) > 0:
             self.scheduler_remove('Remove old')
-        self.scheduler_remove('Buffer dump')
         if self.count_logentries:
             self.scheduler_remove('Count logs')
         return
@@ -430,6 +568,16 @@ class Database(SmartPlugin):
             item_path = str(item.property.path)
         except:
             item_path = item
+
+        id = self._item_ids.get(item_path)
+        if id is not None:
+            return id
+        if self._item_ids_loaded:
+            # the map contains all items of the item table, the item does not exist in the database
+            if not create:
+                return None
+            return self.insertItem(item.property.path, cur)
+
         try:
             id = self.readItem(item_path, cur=cur)
         except Exception as e:
@@ -530,10 +678,14 @@ class Database(SmartPlugin):
 
 
     def dump(self, dumpfile, id=None, time=None, time_start=None, time_end=None, changed=None, changed_start=None,
-             changed_end=None, cur=None):
+             changed_end=None, cur=None, compress=False, resume_id=None, resume_time=None):
         """
         Creates a database dump for given criterias in csv format
 
+        The log records are read in chunks (keyset pagination on item_id and time) and written to the
+        file incrementally, so the memory usage does not depend on the size of the log table and the
+        database lock is only held for the reading of one chunk.
+
         This is a public function of the plugin
 
         :param dumpfile: Name of the file to dump to
@@ -545,48 +697,105 @@ class Database(SmartPlugin):
         :param changed_start: Restrict dump to given start time of changes (optional)
         :param changed_end: Restrict dump to given end time of changes (optional)
         :param cur: A database cursor object if available (optional)
+        :param compress: If True, the dump is written gzip compressed (optional)
+        :param resume_id: Resume an interrupted dump at this item_id, the dump is appended to the file (optional)
+        :param resume_time: Resume an interrupted dump after this time of the item resume_id (optional)
+
+        :return: (item_id, time) of the last dumped log record
         """
         self.logger.info("Starting file dump to {} ...".format(dumpfile))
 
         item_ids = self.readItems(cur=cur) if id is None else [self.readItem(id, cur=cur)]
+        item_ids = sorted([item for item in item_ids if item is not None], key=lambda item: item[COL_ITEM_ID])
+        if resume_id is not None:
+            item_ids = [item for item in item_ids if item[COL_ITEM_ID] >= int(resume_id)]
+
+        condition, params = self._slice_condition(None, time=time, time_start=time_start, time_end=time_end,
+                                                  changed=changed, changed_start=changed_start, changed_end=changed_end)
+        query = "SELECT {log_columns} FROM {log} WHERE " + condition.strip().rstrip(';') + \
+                " AND time > :time_after ORDER BY time ASC LIMIT :limit;"
+        params['limit'] = self._dump_chunk_size
 
         s = ';'
         h = ['item_id', 'item_name', 'time', 'duration', 'val_str', 'val_num', 'val_bool', 'changed', 'time_date',
              'changed_date']
-        f = open(dumpfile, 'w')
-        f.write(s.join(h) + "\n")
-        for item in item_ids:
-            self.logger.debug("... dumping item {}/{}".format(item[1], item[0]))
-
-            rows = self.readLogs(item[0], time=time, time_start=time_start, time_end=time_end, changed=changed,
-                                 changed_start=changed_start, changed_end=changed_end, cur=cur)
-
-            for row in rows:
-                cols = []
-                for key in [COL_ITEM_ID, COL_ITEM_NAME]:
-                    cols.append(item[key])
-                for key in [COL_LOG_TIME, COL_LOG_DURATION, COL_LOG_VAL_STR, COL_LOG_VAL_NUM, COL_LOG_VAL_BOOL,
-                            COL_LOG_CHANGED]:
-                    cols.append(row[key])
-                for key in [COL_ITEM_ID, COL_LOG_CHANGED]:
-                    cols.append('' if row[key] is None else datetime.datetime.fromtimestamp(row[key] / 1000.0))
-                cols = map(lambda col: '' if col is None else col, cols)
-                cols = map(lambda col: str(col) if not '"' in str(col) else col.replace('"', '\\"'), cols)
-                f.write(s.join(cols) + "\n")
-        f.close()
-        self.logger.info("File dump completed ({} items) ...".format(len(item_ids)))
-        return
+        last = (resume_id, resume_time)
+        rowcount = 0
+        with self._open_dumpfile(dumpfile, compress, append=resume_id is not None) as f:
+            if resume_id is None:
+                f.write(s.join(h) + "\n")
+            for item in item_ids:
+                self.logger.debug("... dumping item {}/{}".format(item[1], item[0]))
+
+                params['id'] = item[COL_ITEM_ID]
+                params['time_after'] = -1
+                if resume_id is not None and resume_time is not None and item[COL_ITEM_ID] == int(resume_id):
+                    params['time_after'] = int(resume_time)
+
+                while True:
+                    rows = self._fetchall(query, params, cur=cur)
+                    if not rows:
+                        break
+                    lines = []
+                    for row in rows:
+                        cols = []
+                        for key in [COL_ITEM_ID, COL_ITEM_NAME]:
+                            cols.append(item[key])
+                        for key in [COL_LOG_TIME, COL_LOG_DURATION, COL_LOG_VAL_STR, COL_LOG_VAL_NUM, COL_LOG_VAL_BOOL,
+                                    COL_LOG_CHANGED]:
+                            cols.append(row[key])
+                        for key in [COL_ITEM_ID, COL_LOG_CHANGED]:
+                            cols.append('' if row[key] is None else datetime.datetime.fromtimestamp(row[key] / 1000.0))
+                        cols = map(lambda col: '' if col is None else col, cols)
+                        cols = map(lambda col: str(col) if not '"' in str(col) else col.replace('"', '\\"'), cols)
+                        lines.append(s.join(cols) + "\n")
+                    f.write(''.join(lines))
+                    rowcount += len(rows)
+                    params['time_after'] = rows[-1][COL_LOG_TIME]
+                    last = (item[COL_ITEM_ID], params['time_after'])
+                    if len(rows) < self._dump_chunk_size:
+                        break
+
+        self.logger.info("File dump completed ({} items, {} log records, last item_id/time = {}/{}) ...".format(len(item_ids), rowcount, last[0], last[1]))
+        return last
+
+
+    def _open_dumpfile(self, dumpfile, compress=False, append=False):
+        """
+        Open a file for a dump
+
+        :param dumpfile: Name of the file to dump to
+        :param compress: If True (or if the filename ends with '.gz'), the file is gzip compressed
+        :param append: If True, the dump is appended to an existing file
+
+        :return: file object
+        """
+        mode = 'at' if append else 'wt'
+        if compress or dumpfile.endswith('.gz'):
+            return gzip.open(dumpfile, mode, encoding='utf-8')
+        return open(dumpfile, mode, encoding='utf-8')
+
 
+    def sqlite_dump(self, dumpfile, compress=False):
+        """
+        Creates a SQL dump of a sqlite3 database
+
+        The dump is written line by line while it is generated by the database driver.
+
+        This is a public function of the plugin
 
-    def sqlite_dump(self, dumpfile):
+        :param dumpfile: Name of the file to dump to
+        :param compress: If True, the dump is written gzip compressed (optional)
 
+        :return: True, if the dump has been written
+        """
         if self.driver.lower() != 'sqlite3':
             self.logger.warning("SQL dump is only possible for sqlite3 databases")
             return False
 
         self.logger.info(f"Starting SQL file dump of the sqlite3 database to {dumpfile} ...")
 
-        with open(dumpfile, 'w') as f:
+        with self._open_dumpfile(dumpfile, compress) as f:
             for line in self._db._conn.iterdump():
                 f.write(f"{line}\n")
 
@@ -610,6 +819,7 @@ class Database(SmartPlugin):
         self._execute(self._prepare("INSERT INTO {item}(id, name) VALUES(:id, :name);"),
                       {'id': 1 if id[0] == None else id[0] + 1, 'name': name}, cur=cur)
         id = self._fetchone("SELECT id FROM {item} where name = :name;", {'name': name}, cur=cur)
+        self._item_ids_add(name, int(id[0]))
         return int(id[0])
 
 
@@ -691,6 +901,7 @@ class Database(SmartPlugin):
         params = {'id': id}
         self.deleteLog(id, cur=cur)
         self._execute(self._prepare("DELETE FROM {item} WHERE id = :id;"), params, cur=cur)
+        self._item_ids_remove(id)
 
 
     def insertLog(self, id, time, duration=0, val=None, it=None, changed=None, cur=None):
@@ -715,6 +926,40 @@ class Database(SmartPlugin):
         return
 
 
+    def upsertLogs(self, rows, changed=None, cur=None):
+        """
+        Create or update database log records for a list of values
+
+        The records are written with multi row INSERT statements, which update existing records
+        with the same item_id and time (UPSERT). If the database driver does not support UPSERT,
+        the records are written one by one.
+
+        This is a public function of the plugin
+
+        :param rows: list of tuples (id, time, duration, val, it) with the values to write
+        :param changed: Time of change
+        :param cur: A database cursor object if available (optional)
+        """
+        if self._upsert_mode is None:
+            for id, time, duration, val, it in rows:
+                if len(self.readLog(id, time, cur)):
+                    self.updateLog(id, time, duration, val, it, changed, cur)
+                else:
+                    self.insertLog(id, time, duration, val, it, changed, cur)
+            return
+
+        for chunk_start in range(0, len(rows), self._upsert_chunk_size):
+            chunk = rows[chunk_start:chunk_start + self._upsert_chunk_size]
+            params = {}
+            for index, (id, time, duration, val, it) in enumerate(chunk):
+                suffix = self._param_suffix(index)
+                params.update({'id_' + suffix: id, 'time_' + suffix: time, 'duration_' + suffix: duration,
+                               'changed_' + suffix: changed})
+                params.update({key + '_' + suffix: value for key, value in self._item_value_tuple(it, val).items()})
+            self._execute(self._upsert_log_query(len(chunk)), params, cur=cur)
+        return
+
+
     def updateLog(self, id, time, duration=0, val=None, it=None, changed=None, cur=None):
         """
         Update database log record for given database ID
@@ -773,7 +1018,8 @@ class Database(SmartPlugin):
         """
         condition, params = self._slice_condition(id, time=time, time_start=time_start, time_end=time_end,
                                                   changed=changed, changed_start=changed_start, changed_end=changed_end)
-        return self._fetchall("SELECT {log_columns} FROM {log} WHERE " + condition, params, cur=cur)
+        return self._fetchall("SELECT {log_columns} FROM {log} WHERE " + condition, params, cur=cur, read=True,
+                              template='readLogs')
 
 
     def readOldestLog(self, id, cur=None):
@@ -852,13 +1098,13 @@ class Database(SmartPlugin):
         """
         params = {'id': id, 'time_start': time_start, 'time_end': time_end}
         if time_start is None and time_end is None:
-            result = self._fetchall("SELECT count(*) FROM {log} WHERE item_id = :id;", params, cur=cur)
+            result = self._fetchall("SELECT count(*) FROM {log} WHERE item_id = :id;", params, cur=cur, read=True, template='readLogCount')
         elif time_start is None:
-            result = self._fetchall("SELECT count(*) FROM {log} WHERE item_id = :id AND time <= :time_end;", params, cur=cur)
+            result = self._fetchall("SELECT count(*) FROM {log} WHERE item_id = :id AND time <= :time_end;", params, cur=cur, read=True, template='readLogCount')
         elif time_end is None:
-            result = self._fetchall("SELECT count(*) FROM {log} WHERE item_id = :id AND time >= :time_start;", params, cur=cur)
+            result = self._fetchall("SELECT count(*) FROM {log} WHERE item_id = :id AND time >= :time_start;", params, cur=cur, read=True, template='readLogCount')
         else:
-            result = self._fetchall("SELECT count(*) FROM {log} WHERE item_id = :id AND time >= :time_start AND time <= :time_end;", params, cur=cur)
+            result = self._fetchall("SELECT count(*) FROM {log} WHERE item_id = :id AND time >= :time_start AND time <= :time_end;", params, cur=cur, read=True, template='readLogCount')
         if result == []:
             return 0
         if result is None:
@@ -890,7 +1136,9 @@ class Database(SmartPlugin):
         condition, params = self._slice_condition(id, time=time, time_start=time_start, time_end=time_end,
                                                   changed=changed, changed_start=changed_start, changed_end=changed_end)
         try:
-            self._execute(self._prepare("DELETE FROM {log} WHERE " + condition), params, cur=cur)
+            self._execute(self._prepare("DELETE FROM {log} WHERE " + condition), params, cur=cur, template='deleteLog')
+            if time_start is None and changed is None and changed_start is None and changed_end is None:
+                self._rollup_delete(id, time=time, time_end=time_end, cur=cur)
             if with_commit:
                 self._db.commit()
         except Exception as e:
@@ -905,6 +1153,74 @@ class Database(SmartPlugin):
         return
 
 
+    def _load_item_ids(self, rows, replace=False):
+        """
+        Load the map of item paths and database ids from the given item records
+
+        Without replace, the records are merged into the map: Items inserted by a not yet committed
+        transaction of the main connection are not visible to other connections and must not get lost.
+
+        :param rows: item records as returned by readItems()
+        :param replace: if True, the map is replaced by the given records
+        """
+        item_ids = {row[COL_ITEM_NAME]: int(row[COL_ITEM_ID]) for row in rows}
+        with self._item_ids_lock:
+            if not replace:
+                item_ids = {**self._item_ids, **item_ids}
+            self._item_ids = item_ids
+            self._item_names = {id: name for name, id in item_ids.items()}
+            self._item_ids_loaded = True
+        self.logger.debug(f"_load_item_ids: Loaded {len(item_ids)} item ids")
+
+
+    def _reload_item_ids(self):
+        """
+        Reload the map of item paths and database ids from the item table
+
+        Used after a rollback, which may have discarded items inserted within the transaction.
+        Called while holding the database lock, therefore an own cursor is used.
+        """
+        cur = None
+        try:
+            cur = self._db.cursor()
+            rows = self.readItems(cur=cur)
+            if rows is not None:
+                self._load_item_ids(rows, replace=True)
+        except Exception as e:
+            self.logger.warning(f"_reload_item_ids: Reloading item ids failed, falling back to database lookups: {e}")
+            with self._item_ids_lock:
+                self._item_ids = {}
+                self._item_names = {}
+                self._item_ids_loaded = False
+        finally:
+            if cur is not None:
+                cur.close()
+
+
+    def _item_ids_add(self, name, id):
+        """
+        Add an item to the map of item paths and database ids
+
+        :param name: path of the item
+        :param id: database id of the item
+        """
+        with self._item_ids_lock:
+            self._item_ids[name] = id
+            self._item_names[id] = name
+
+
+    def _item_ids_remove(self, id):
+        """
+        Remove an item from the map of item paths and database ids
+
+        :param id: database id of the item
+        """
+        with self._item_ids_lock:
+            name = self._item_names.pop(int(id), None)
+            if name is not None and self._item_ids.get(name) == int(id):
+                del self._item_ids[name]
+
+
     def build_orphanlist(self, log_activity=False):
         """
         Create a list of database entries which have no corresponding item in the item tree
@@ -927,6 +1243,8 @@ class Database(SmartPlugin):
 
             try:
                 return_list = self.readItems(cur=cur)
+                if return_list is not None:
+                    self._load_item_ids(return_list)
                 if return_list:
                     for item in return_list:
                         if item[COL_ITEM_NAME] not in items:
@@ -994,6 +1312,7 @@ class Database(SmartPlugin):
             log_info(f'reassigned orphaned id {orphan_id} to new id {to}')
             cur.close()
             self._db_maint.commit()
+            self._item_ids_remove(orphan_id)
             log_debug('rebuilding orphan list')
             self.build_orphanlist()
         except Exception as e:
@@ -1018,6 +1337,7 @@ class Database(SmartPlugin):
             self.logger.info(f"_delete_orphan: Deleted item entry for {item_path}")
             cur.close()
             self._db_maint.commit()
+            self._item_ids_remove(item_id)
             return True
 
         cur = self._db_maint.cursor()
@@ -1113,6 +1433,10 @@ class Database(SmartPlugin):
         init = not update
         if sid is None:
             sid = item + '|' + func + '|' + str(start) + '|' + str(end) + '|' + str(count)
+        result = self._series_cache_get(sid, start, update)
+        if result is not None:
+            return result
+        version = self._series_cache_version(item)
         func, expression = self._expression(func)
         queries = {
             'avg': 'MIN(time), ' + self._precision_query('AVG(val_num * duration) / AVG(duration)'),
@@ -1126,7 +1450,7 @@ class Database(SmartPlugin):
             'countall': 'MIN(time), COUNT(*)',
             'min': 'MIN(time), MIN(val_num)',
             'max': 'MIN(time), MAX(val_num)',
-            'on': 'MIN(time), ' + self._precision_query('SUM(val_bool * duration) / SUM(duration)'),
+            'on': 'MIN(time), ' + self._precision_query('SUM(val_bool * duration) * 1.0 / SUM(duration)'),
             'on.order': 'ORDER BY time ASC',
             'sum': 'MIN(time), SUM(val_num)',
             'raw': 'time, val_num',
@@ -1138,9 +1462,15 @@ class Database(SmartPlugin):
 
         order = '' if func + '.order' not in queries else queries[func + '.order']
         group = 'GROUP BY ROUND(time / :step)' if func + '.group' not in queries else queries[func + '.group']
-        logs = self._fetch_log(item, queries[func], start, end, step=step, count=count, group=group, order=order)
+        logs = self._fetch_rollup(item, func, start, end, step=step, count=count, expression=expression)
+        if logs is None:
+            logs = self._fetch_log(item, queries[func], start, end, step=step, count=count, group=group, order=order)
         tuples = logs['tuples']
 
+        # Merge values, that are not yet dumped to the database
+        if func == 'raw' and tuples is not None:
+            tuples = self._merge_buffered(logs, tuples)
+
         # Append tuples by addition values (not for func differentiate)
         if func != 'differentiate':
 
@@ -1173,6 +1503,7 @@ class Database(SmartPlugin):
         self.logger.dbgmed(f"_series: {sid=}, {step=}, update={result['update']}, delta={int(logs['step'] / 1000)}, now={self.shtime.now()}")
         #self.logger.debug("_series: result={}".format(result))
 
+        self._series_cache_put(sid, item, start, update, result, logs, version)
         return result
 
 
@@ -1195,7 +1526,7 @@ class Database(SmartPlugin):
             'min': 'MIN(val_num)',
             'max': 'MAX(val_num)',
             'diff': 'MAX(val_num) - MIN(val_num)',
-            'on': self._precision_query('SUM(val_bool * duration) / SUM(duration)'),
+            'on': self._precision_query('SUM(val_bool * duration) * 1.0 / SUM(duration)'),
             'sum': 'SUM(val_num)',
             'raw': 'val_num',
             'raw.order': 'ORDER BY time DESC',
@@ -1205,12 +1536,199 @@ class Database(SmartPlugin):
             self.logger.warning("Unknown export function: {0}".format(func))
             return
         order = '' if func + '.order' not in queries else queries[func + '.order']
-        logs = self._fetch_log(item, queries[func], start, end, order=order)
+        logs = self._fetch_rollup(item, func, start, end, count=0, group=False, expression=expression)
+        if logs is None:
+            logs = self._fetch_log(item, queries[func], start, end, order=order, template='single')
+        if func == 'raw':
+            # the latest not yet dumped value is newer than all values in the database
+            buffered = self._merge_buffered(logs, [])
+            if buffered:
+                return buffered[-1][1]
         if logs['tuples'] is None:
             return
         return logs['tuples'][0][0]
 
 
+    # ------------------------------------------------------
+    #    Cache for series results
+    # ------------------------------------------------------
+
+    def _merge_buffered(self, logs, tuples):
+        """
+        Merge the not yet written values of an item into a raw series read from the database
+
+        Values from the time of the first not yet written value on are taken from memory. Like the
+        query of _fetch_log, the last value before the start of the range is included.
+
+        :param logs: data structure returned by _fetch_log
+        :param tuples: list of (time, value) read from the database
+        :return: list of (time, value), sorted by time
+        """
+        buffered = self._buffer_snapshot(logs['item'])
+        if not buffered:
+            return tuples
+        tail_start = buffered[0][0]
+        floor = max((t[0] for t in buffered if t[0] < logs['istart']), default=None)
+        values = {t[0]: t[1] for t in tuples if t[0] < tail_start and floor is None}
+        for t in buffered:
+            if (logs['istart'] if floor is None else floor) <= t[0] <= logs['iend']:
+                try:
+                    values[t[0]] = float(t[2])
+                except (TypeError, ValueError):
+                    pass
+        return sorted(values.items())
+
+
+    def _series_cache_get(self, sid, start, update):
+        """
+        Get a cached result for a series request
+
+        :param sid: series id
+        :param start: start of the requested series (end of the previous result for update requests)
+        :param update: True, if the request is an update request
+
+        :return: copy of the cached result or None, if no valid result is cached
+        """
+        if self._series_cache_size <= 0:
+            return None
+        with self._series_cache_lock:
+            entry = self._series_cache.get(sid)
+            if entry is not None and entry['expires'] < time.time():
+                del self._series_cache[sid]
+                entry = None
+            if entry is not None:
+                if not update:
+                    result = entry['result']
+                elif entry['tail'] is not None and entry['tail'][0] == start:
+                    result = entry['tail'][1]
+                else:
+                    result = None
+                if result is not None:
+                    self._series_cache.move_to_end(sid)
+                    self._series_cache_stats['hits'] += 1
+                    return self._series_result_copy(result)
+            self._series_cache_stats['misses'] += 1
+        return None
+
+
+    def _series_cache_version(self, item):
+        """
+        Get the number of writes of an item, that affected the series cache
+
+        :param item: path of the item
+        :return: version or None, if the cache is disabled
+        """
+        if self._series_cache_size <= 0:
+            return None
+        with self._series_cache_lock:
+            return self._series_cache_versions.get(item, 0)
+
+
+    def _series_cache_put(self, sid, item, start, update, result, logs, version=None):
+        """
+        Store the result of a series request in the cache
+
+        The result of an update request only contains the values since the end of the previous result.
+        These values are appended to the cached series, which is then valid for following requests.
+        If values of the item were written while the result was read, the result is not cached.
+
+        :param sid: series id
+        :param item: path of the item
+        :param start: start of the requested series
+        :param update: True, if the request is an update request
+        :param result: result of the series request
+        :param logs: data structure returned by _fetch_log
+        :param version: version of the item (see _series_cache_version) before the result was read
+        """
+        if self._series_cache_size <= 0:
+            return
+        with self._series_cache_lock:
+            if version is not None and version != self._series_cache_versions.get(item, 0):
+                return
+            if not update:
+                entry = {'item': item, 'start': start, 'tail': None, 'result': self._series_result_copy(result),
+                         'istart': logs['istart']}
+                self._series_cache[sid] = entry
+            else:
+                entry = self._series_cache.get(sid)
+                if entry is None or entry['iend'] != start:
+                    return
+                cached = entry['result']
+                series = cached['series'] + list(result['series'])
+                istart = self._parse_ts(entry['start'])
+                cached['series'] = [t for t in series if t[0] >= istart]
+                entry['istart'] = istart
+                cached['params'] = dict(result['params'])
+                cached['update'] = result['update']
+                entry['tail'] = (start, self._series_result_copy(result))
+            entry['iend'] = logs['iend']
+            entry['expires'] = time.time() + self._series_cache_ttl
+            self._series_cache.move_to_end(sid)
+            while len(self._series_cache) > self._series_cache_size:
+                self._series_cache.popitem(last=False)
+                self._series_cache_stats['evictions'] += 1
+        return
+
+
+    def _series_cache_invalidate(self, item, tuples):
+        """
+        Remove cached series of an item, that are affected by written log records
+
+        A written log record only changes a cached series, if the value changes within the cached range:
+        an open record starting within the range or a record ending within the range. Rewriting the open
+        record of the previous value with its final duration (done by nearly every dump) does not change
+        the series, if the value lasted until the end of the cached range.
+
+        called by _dump()
+
+        :param item: path of the item
+        :param tuples: written tuples (time, duration, value)
+        """
+        if self._series_cache_size <= 0 or not tuples:
+            return
+        with self._series_cache_lock:
+            self._series_cache_versions[item] = self._series_cache_versions.get(item, 0) + 1
+            sids = [sid for sid, entry in self._series_cache.items()
+                    if entry['item'] == item and self._series_cache_affected(entry['istart'], entry['iend'], tuples)]
+            for sid in sids:
+                del self._series_cache[sid]
+                self._series_cache_stats['invalidations'] += 1
+        return
+
+
+    def _series_cache_affected(self, istart, iend, tuples):
+        """
+        Check, if written tuples change the values of a cached series within the range istart to iend
+
+        :param istart: start of the cached range
+        :param iend: end of the cached range
+        :param tuples: written tuples (time, duration, value)
+        :return: True, if the cached series has to be invalidated
+        """
+        for t in tuples:
+            if t[0] >= iend:
+                continue
+            if t[1] is None:
+                if t[0] >= istart:
+                    return True
+            elif istart <= t[0] + t[1] < iend:
+                return True
+        return False
+
+
+    def _series_result_copy(self, result):
+        """
+        Copy a series result, the websocket plugin modifies the returned data structure
+
+        :param result: result of a series request
+        :return: copy of the result
+        """
+        result = dict(result)
+        result['series'] = list(result['series'])
+        result['params'] = dict(result['params'])
+        return result
+
+
     def _expression(self, func):
         expression = {'params': {'op': '!=', 'value': '0'}, 'finalizer': None}
         if ':' in func:
@@ -1242,29 +1760,15 @@ class Database(SmartPlugin):
         return query
 
 
-    def _fetch_log(self, item, columns, start, end, step=None, count=100, group='', order=''):
-        _item = self.items.return_item(item)
-
-        istart = self._parse_ts(start)
-        iend = self._parse_ts(end)
-        inow = self._parse_ts('now')
-        id = self.id(_item, create=False)
-
-        if inow > iend:
-            inow = iend
-
-        if step is None:
-            if count != 0:
-                step = int((iend - istart) / int(count))
-            else:
-                step = iend - istart
-
-        if self._buffer[_item] != []:
-            self._dump(items=[_item])
+    def _duration_expression(self):
+        """
+        Get the SQL expression for the duration of log records, limited to the range :time_start - :time_end
 
-        params = {'id': id, 'time_start': istart, 'time_end': iend, 'inow': inow, 'step': step}
-        duration_now = "COALESCE(duration, :inow - time)"
+        The expression contains the placeholder duration_now, which has to be replaced by the
+        duration of the current value.
 
+        :return: SQL expression
+        """
         # Duration calculation (S=Start, E=End):
         duration = (
             "("
@@ -1280,10 +1784,22 @@ class Database(SmartPlugin):
             "COALESCE(duration_now / duration_now * (:time_end - time) * (time + duration_now >= :time_end), 0)"
             ")"
         )
+        return duration
+
+
+    def _fetch_log_query(self, columns, group='', order=''):
+        """
+        Build the query used by _fetch_log
+
+        :param columns: columns to select (the field duration is replaced by the calculated duration)
+        :param group: GROUP BY clause
+        :param order: ORDER BY clause
 
+        :return: query
+        """
         # Replace duration fields with calculated durations from previous
         # generated expressions to include all three cases.
-        columns = columns.replace('duration', duration)
+        columns = columns.replace('duration', self._duration_expression())
 
         # Create base query including the replaced columns
         query = (
@@ -1297,9 +1813,29 @@ class Database(SmartPlugin):
 
         # Replace duration_now with value from start time til current time to
         # get a duration value referring to the current timestamp - if required.
-        query = query.replace('duration_now', duration_now)
+        return query.replace('duration_now', "COALESCE(duration, :inow - time)")
+
+
+    def _fetch_log(self, item, columns, start, end, step=None, count=100, group='', order='', template='series'):
+        _item = self.items.return_item(item)
+
+        istart = self._parse_ts(start)
+        iend = self._parse_ts(end)
+        inow = self._parse_ts('now')
+        id = self.id(_item, create=False)
+
+        if inow > iend:
+            inow = iend
+
+        if step is None:
+            if count != 0:
+                step = int((iend - istart) / int(count))
+            else:
+                step = iend - istart
 
-        logs = self._fetchall(query, params)
+        params = {'id': id, 'time_start': istart, 'time_end': iend, 'inow': inow, 'step': step}
+        query = self._fetch_log_query(columns, group, order)
+        logs = self._fetchall(query, params, read=True, template=template)
 
         return {
             'tuples': logs,
@@ -1311,40 +1847,436 @@ class Database(SmartPlugin):
         }
 
 
-    def _parse_ts(self, dts):
+    # ------------------------------------------------------
+    #    Rollup tables (pre-aggregated data for the visu)
+    # ------------------------------------------------------
+
+    def _fetch_rollup(self, item, func, start, end, step=None, count=100, group=True, expression=None):
         """
-        Parse a duration-timestamp in the form '1w 2y 3h 1d 39i 15s' and return the duration in seconds as
-        an integer value
+        Fetch aggregated values of an item from partial aggregates
 
-        :return:
+        Complete buckets within the requested range are read from the coarsest rollup table that
+        satisfies the requested step. Only the edges of the range are read from the log table.
+        Values, that are not yet written to the database (buffered or currently dumped), are aggregated
+        from memory and merged, so a read never has to wait for (or force) a dump.
+
+        :param item: path of the item
+        :param func: aggregation function (one of self._partial_funcs, diff only if group is False)
+        :param start: start of the range
+        :param end: end of the range
+        :param step: step (in ms) of the series (optional)
+        :param count: number of values of the series, if no step is given
+        :param group: if False, a single value for the whole range is returned (used by _single)
+        :param expression: expression returned by _expression (used by func count)
+
+        :return: dict in the format returned by _fetch_log or None, if neither the rollup tables
+                 nor buffered values have to be used
         """
-        ts = self._timestamp(self.shtime.now())
-        try:
-            return min(ts, int(dts))    # rts, if dts is an integer value, return now, if dts is a timestamp in th future
-        except:
-            pass
+        if func not in self._partial_funcs and (group or func != 'diff'):
+            return None
 
-        duration = 0
-        if isinstance(dts, str):
-            if dts == 'now':
-                duration = 0
+        _item = self.items.return_item(item)
+
+        istart = self._parse_ts(start)
+        iend = self._parse_ts(end)
+        inow = self._parse_ts('now')
+
+        if inow > iend:
+            inow = iend
+
+        if step is None:
+            if count != 0:
+                step = int((iend - istart) / int(count))
             else:
-                for frame in dts.split(' '):
-                    if frame != 'now':
-                        duration += self._parse_single(frame)
+                step = iend - istart
 
-        if duration < 0:
-            duration = 0
+        # values from tail_start on are read from memory, older values from the database
+        buffered = [t for t in self._buffer_snapshot(_item) if t[0] <= iend]
+        tail_start = buffered[0][0] if buffered else None
+        limit = tail_start if tail_start is not None else iend + 1
+
+        # select the coarsest rollup table that satisfies the requested step
+        name = None
+        rollup_start = rollup_end = None
+        if self._rollup and func in self._rollup_funcs:
+            name = next((name for name, period in self._rollup_periods.items() if not group or step >= period), None)
+        if name is not None:
+            period = self._rollup_periods[name]
+            rollup_start = -(-istart // period) * period
+            rollup_end = min(iend - iend % period, self._rollup_watermark.get(name, 0), limit - limit % period)
+            if rollup_end <= rollup_start:
+                name = None
+        if name is None and not buffered:
+            return None
 
-        ts = ts - int(duration)
-        return ts
+        id = self.id(_item, create=False)
+        if id is None and not buffered:
+            return None
+
+        group_key = 'ROUND(time / :step)' if group else '0'
+        group_by = 'GROUP BY ROUND(time / :step)' if group else ''
+        match = 'SUM(CASE WHEN val_num{op}{value} THEN 1 ELSE 0 END)'.format(**expression['params']) if func == 'count' else '0'
+        log_columns = (group_key + ", MIN(time), SUM(val_num * duration), SUM(duration), MIN(val_num), MAX(val_num), "
+                       "SUM(val_num), COUNT(*), SUM(val_bool * duration), " + match).replace('duration', self._duration_expression())
+
+        partials = []
+        if id is not None and (tail_start is None or tail_start >= istart):
+            # 1. Head of the range (or the whole range without rollup table), read from log table
+            time_end = rollup_start if name is not None else iend
+            params = {'id': id, 'time_start': istart, 'time_end': time_end, 'time_limit': min(time_end, limit) if name is not None else limit,
+                      'inow': inow, 'step': step}
+            query = (
+                    "SELECT " + log_columns + " FROM {log} WHERE "
+                                              "item_id = :id AND "
+                                              "time >= (SELECT COALESCE(MAX(time), 0) FROM {log} WHERE item_id = :id AND time < :time_start) AND "
+                                              "time < :time_limit AND "
+                                              "time + duration_now > (SELECT COALESCE(MAX(time), 0) FROM {log} WHERE item_id = :id AND time < :time_start) "
+                                              "" + group_by
+            )
+            partials += self._fetchall(query.replace('duration_now', "COALESCE(duration, :inow - time)"), params, read=True,
+                                       template='rollup') or []
+
+        if id is not None and name is not None:
+            # 2. Complete buckets, read from rollup table
+            params = {'id': id, 'time_start': rollup_start, 'time_end': rollup_end, 'step': step}
+            query = (
+                    "SELECT " + group_key + ", MIN(time), SUM(val_integrate), SUM(duration), MIN(val_min), MAX(val_max), "
+                                            "SUM(val_sum), SUM(val_count), SUM(val_on), 0 FROM {rollup_" + name + "} WHERE "
+                                            "item_id = :id AND time >= :time_start AND time < :time_end " + group_by
+            )
+            partials += self._fetchall(query, params, read=True, template='rollup') or []
+
+            # 3. Tail of the range, read from log table
+            params = {'id': id, 'time_start': rollup_end, 'time_end': iend, 'time_limit': limit, 'inow': inow, 'step': step}
+            query = "SELECT " + log_columns + " FROM {log} WHERE item_id = :id AND time >= :time_start AND time < :time_limit " + group_by
+            partials += self._fetchall(query.replace('duration_now', "COALESCE(duration, :inow - time)"), params, read=True,
+                                       template='rollup') or []
+
+        # 4. Values, that are not yet written to the database
+        if buffered:
+            partials += self._buffer_partials(_item, buffered, istart, iend, inow, step if group else None, expression)
+
+        # merge partial aggregates of head, rollup, tail and buffer
+        merged = {}
+        for row in partials:
+            if row[1] is None:
+                continue
+            entry = merged.get(row[0])
+            if entry is None:
+                merged[row[0]] = list(row[1:])
+                continue
+            for index, value in enumerate(row[1:]):
+                if value is None:
+                    continue
+                if entry[index] is None:
+                    entry[index] = value
+                elif index in [0, 3]:
+                    entry[index] = min(entry[index], value)
+                elif index == 4:
+                    entry[index] = max(entry[index], value)
+                else:
+                    entry[index] = entry[index] + value
 
+        if group:
+            tuples = [(entry[0], self._rollup_value(func, entry)) for entry in sorted(merged.values())]
+        else:
+            tuples = [(self._rollup_value(func, entry),) for entry in merged.values()] or [(None,)]
 
-    def _parse_single(self, frame):
+        self.logger.debug(f"_fetch_rollup: {item=}, {func=}, rollup={name}, rollup range={rollup_start}-{rollup_end}, {len(partials)} partial rows, {len(buffered)} buffered")
+        return {
+            'tuples': tuples,
+            'item': _item,
+            'istart': istart,
+            'iend': iend,
+            'step': step,
+            'count': count
+        }
+
+
+    def _buffer_partials(self, item, buffered, istart, iend, inow, step, expression):
         """
-        Parse one frame of a duration-timestamp to a duration (in seconds)
+        Calculate partial aggregates of not yet written tuples, like the log table queries of _fetch_rollup do
+
+        :param item: item the tuples belong to
+        :param buffered: tuples (time, duration, value), sorted by time
+        :param istart: start of the range
+        :param iend: end of the range
+        :param inow: current time (limited to the end of the range)
+        :param step: step of the series or None, if a single value for the whole range is calculated
+        :param expression: expression returned by _expression (used by func count)
+
+        :return: list of partial aggregates (key, time, integrate, duration, min, max, sum, count, on, match)
+        """
+        # like the log table query, include the last value before the start of the range
+        floor = max((t[0] for t in buffered if t[0] < istart), default=0)
+        it = item.type()
+        compare = self._compare_ops.get(expression['params']['op']) if expression else None
+        partials = []
+        for t in buffered:
+            duration_now = t[1] if t[1] is not None else inow - t[0]
+            if t[0] < floor or t[0] > iend or t[0] + duration_now <= floor:
+                continue
+            # calculated the same way as by the expression of _duration_expression()
+            duration = 0
+            if t[1] is not None:
+                if t[0] >= istart and t[0] + t[1] <= iend:
+                    duration += t[1]
+                if t[1] and t[0] < istart and t[0] + t[1] >= istart:
+                    duration += t[0] + t[1] - istart
+            if duration_now and t[0] + duration_now >= iend:
+                duration += iend - t[0]
+            values = self._item_value_tuple(it, t[2])
+            val_num = values['val_num']
+            if val_num is None:
+                integrate = match = None
+            else:
+                integrate = val_num * duration
+                match = int(compare(val_num, float(expression['params']['value']))) if compare else 0
+            partials.append((self._bucket_key(t[0], step), t[0], integrate, duration, val_num, val_num, val_num, 1,
+                             values['val_bool'] * duration, match))
+        return partials
+
+
+    def _bucket_key(self, ts, step):
+        """
+        Calculate the key of the bucket of a timestamp the same way as the database does for 'ROUND(time / :step)'
+
+        :param ts: timestamp (in ms)
+        :param step: step of the series or None, if all values belong to one bucket
+
+        :return: key of the bucket
+        """
+        if step is None:
+            return 0
+        if self.driver.lower() == 'sqlite3' and isinstance(step, int):
+            # sqlite uses integer division for integer values
+            return ts // step
+        return int(ts / step + 0.5)
+
+
+    def _rollup_value(self, func, entry):
+        """
+        Calculate the value of an aggregation function from merged partial aggregates
+
+        :param func: aggregation function
+        :param entry: list (time, integrate, duration, min, max, sum, count, on, match) of partial aggregates
+        :return: value
+        """
+        time_min, integrate, duration, val_min, val_max, val_sum, val_count, val_on, val_match = entry
+        if func == 'avg':
+            value = integrate / duration if integrate is not None and duration else None
+        elif func == 'on':
+            value = val_on / duration if val_on is not None and duration else None
+        elif func == 'integrate':
+            return integrate
+        elif func == 'min':
+            return val_min
+        elif func == 'max':
+            return val_max
+        elif func == 'sum':
+            return val_sum
+        elif func == 'count':
+            return val_match
+        elif func == 'diff':
+            return val_max - val_min if val_max is not None and val_min is not None else None
+        else:
+            return val_count
+        if value is not None and self._precision >= 0:
+            value = round(value, self._precision)
+        return value
+
+
+    def _rollup_init(self):
+        """
+        Determine the watermarks (end of the last complete bucket) of the rollup tables
+
+        called by run() once on start
+        """
+        if not self._rollup:
+            return
+        for name, period in self._rollup_periods.items():
+            latest = self._fetchone("SELECT MAX(time) FROM {rollup_" + name + "};")
+            if latest is not None and latest[0] is not None:
+                # recalculate the latest bucket, it might have been incomplete
+                self._rollup_watermark[name] = int(latest[0])
+            else:
+                oldest = self._fetchone("SELECT MIN(time) FROM {log};")
+                if oldest is None or oldest[0] is None:
+                    oldest = self._timestamp(self.shtime.now())
+                else:
+                    oldest = int(oldest[0])
+                self._rollup_watermark[name] = oldest - oldest % period
+                self.logger.info(f"Rollup table {name}: building rollup data starting at {self._datetime(self._rollup_watermark[name])}")
+        return
+
+
+    def _rollup_update(self, cur):
+        """
+        Update the rollup tables
+
+        Recalculates the buckets with changed log records and adds the buckets that have been
+        completed since the last update. If the rollup tables are filled for existing log data,
+        only a limited number of buckets is calculated per call.
+
+        called by _dump()
+
+        :param cur: A database cursor object
+        """
+        now = self._timestamp(self.shtime.now())
+        for name, period in self._rollup_periods.items():
+            dirty, self._rollup_dirty[name] = self._rollup_dirty[name], {}
+            for bucket, ids in dirty.items():
+                self._rollup_build(name, bucket, bucket + period, now, ids=ids, cur=cur)
+
+            watermark = self._rollup_watermark.get(name)
+            target = now - now % period
+            if watermark is not None and watermark < target:
+                end = min(target, watermark + self._rollup_backfill_buckets * period)
+                self._rollup_build(name, watermark, end, now, cur=cur)
+                self._rollup_watermark[name] = end
+        return
+
+
+    def _rollup_build(self, name, time_start, time_end, inow, ids=None, cur=None):
+        """
+        Calculate the buckets of a rollup table for the given time range from the log table
+
+        The calculation is done for the given or all known database IDs, so that the log table is read
+        via the (item_id, time) index instead of a full scan.
+
+        :param name: name of the rollup period ('hour', 'day')
+        :param time_start: start of the first bucket
+        :param time_end: end of the last bucket
+        :param inow: current timestamp (used as end of values with open duration)
+        :param ids: restrict calculation to the given database IDs (optional)
+        :param cur: A database cursor object if available (optional)
+        """
+        if ids is None:
+            ids = self._rollup_item_ids(cur=cur)
+        ids = sorted(int(id) for id in ids)
+        params = {'time_start': time_start, 'time_end': time_end, 'inow': inow}
+        for i in range(0, len(ids), self._rollup_build_chunk):
+            self._execute(self._rollup_build_query(name, ids[i:i + self._rollup_build_chunk]), params, cur=cur)
+        return
+
+
+    def _rollup_build_query(self, name, ids):
+        """
+        Build the query calculating the buckets of a rollup table for the given database IDs
+
+        :param name: name of the rollup period ('hour', 'day')
+        :param ids: list of database IDs
+        :return: query
+        """
+        period = str(self._rollup_periods[name])
+        if self._upsert_mode == 'mysql':
+            bucket = "(time DIV " + period + ") * " + period
+        else:
+            bucket = "(time / " + period + ") * " + period
+        duration = "COALESCE(duration, :inow - time)"
+        return (
+                "INSERT INTO {rollup_" + name + "}(item_id, time, val_min, val_max, val_sum, val_count, val_integrate, val_on, duration) "
+                "SELECT item_id, " + bucket + ", MIN(val_num), MAX(val_num), SUM(val_num), COUNT(*), "
+                "SUM(val_num * " + duration + "), SUM(val_bool * " + duration + "), SUM(" + duration + ") "
+                "FROM {log} WHERE item_id IN (" + ", ".join(str(id) for id in ids) + ") "
+                "AND time >= :time_start AND time < :time_end GROUP BY item_id, " + bucket +
+                self._upsert_clause(['val_min', 'val_max', 'val_sum', 'val_count', 'val_integrate', 'val_on', 'duration'])
+        )
+
+
+    def _rollup_item_ids(self, cur=None):
+        """
+        Return the database IDs of all items (including orphans) for building the rollup tables
+
+        :param cur: A database cursor object if available (optional)
+        :return: list of database IDs
+        """
+        with self._item_ids_lock:
+            if self._item_ids_loaded:
+                return list(self._item_names)
+        rows = self.readItems(cur=cur)
+        return [int(row[COL_ITEM_ID]) for row in rows or []]
+
+
+    def _rollup_mark(self, id, tuples):
+        """
+        Mark rollup buckets, which contain the given (re)written log records, for recalculation
+
+        :param id: Database ID of the item
+        :param tuples: list of log tuples (time, duration, value)
+        """
+        if not self._rollup:
+            return
+        for name, period in self._rollup_periods.items():
+            watermark = self._rollup_watermark.get(name)
+            if watermark is None:
+                continue
+            for t in tuples:
+                if t[0] < watermark:
+                    self._rollup_dirty[name].setdefault(t[0] - t[0] % period, set()).add(id)
+        return
+
+
+    def _rollup_delete(self, id, time=None, time_end=None, cur=None):
+        """
+        Adjust the rollup tables after log records of an item have been deleted
+
+        :param id: Database ID of the item
+        :param time: time of a single deleted log record (optional)
+        :param time_end: log records before this time have been deleted (optional)
+        :param cur: A database cursor object if available (optional)
+        """
+        if not self._rollup:
+            return
+        if time is not None:
+            self._rollup_mark(id, [(int(float(time)),)])
+            return
+        for name, period in self._rollup_periods.items():
+            if time_end is not None:
+                time_end = int(float(time_end))
+                bucket = time_end - time_end % period
+                self._execute(self._prepare("DELETE FROM {rollup_" + name + "} WHERE item_id = :id AND time < :time_end;"),
+                              {'id': id, 'time_end': bucket}, cur=cur)
+                self._rollup_mark(id, [(bucket,)])
+            else:
+                self._execute(self._prepare("DELETE FROM {rollup_" + name + "} WHERE item_id = :id;"), {'id': id}, cur=cur)
+        return
+
+
+    def _parse_ts(self, dts):
+        """
+        Parse a duration-timestamp in the form '1w 2y 3h 1d 39i 15s' and return the duration in seconds as
+        an integer value
 
-        :param frame:
+        :return:
+        """
+        ts = self._timestamp(self.shtime.now())
+        try:
+            return min(ts, int(dts))    # rts, if dts is an integer value, return now, if dts is a timestamp in th future
+        except:
+            pass
+
+        duration = 0
+        if isinstance(dts, str):
+            if dts == 'now':
+                duration = 0
+            else:
+                for frame in dts.split(' '):
+                    if frame != 'now':
+                        duration += self._parse_single(frame)
+
+        if duration < 0:
+            duration = 0
+
+        ts = ts - int(duration)
+        return ts
+
+
+    def _parse_single(self, frame):
+        """
+        Parse one frame of a duration-timestamp to a duration (in seconds)
+
+        :param frame:
         :return:
         """
         second = 1000
@@ -1387,6 +2319,10 @@ class Database(SmartPlugin):
 
         This method is periodically called by the sheduler of SmartHomeNG
 
+        All buffered tuples are written within one transaction. If the bulk write fails,
+        the dump falls back to writing item by item, so a single faulty item does not
+        block the dump of the other items.
+
         :param finalize:
         :param items:
         :return:
@@ -1412,127 +2348,442 @@ class Database(SmartPlugin):
             items = list(self._buffer.keys())
             self._buffer_lock.release()
 
+        dump_start = time.time()
+
+        # Take the buffered tuples of all items out of the buffer
+        worklist = []
         for item in items:
             tuples = self._buffer_remove(item)
-
             if len(tuples) or finalize:
+                worklist.append((item, tuples))
 
-                # Test connectivity
-                if self._db.verify(5) == 0:
-                    self._buffer_insert(item, tuples)
-                    self.logger.error("Connection not recovered, skipping dump");
-                    self._dump_lock.release()
-                    return
+        if len(worklist) == 0:
+            self.logger.debug('Dump completed (nothing to dump)')
+            self._dump_lock.release()
+            return
 
-                # Can't lock, restore data
-                if not self._db.lock(300):
-                    self._buffer_insert(item, tuples)
-                    if finalize:
-                        self.logger.error(
-                            "Can't dump {} items due to fail to acquire lock!".format(len(self._buffer)))
-                    else:
-                        self.logger.error(
-                            "Can't dump {} items due to fail to acquire lock - will try on next dump".format(
-                                len(self._buffer)))
-                    self._dump_lock.release()
-                    return
+        # Test connectivity
+        if self._db.verify(5) == 0:
+            if self._spill:
+                self._spill_worklist(worklist)
+            else:
+                self._buffer_restore(worklist)
+            self.logger.error("Connection not recovered, skipping dump");
+            self._dump_lock.release()
+            return
+
+        # Restore values spilled to disk while the database was not available
+        if self._spill and os.path.exists(self._spill_path):
+            worklist = self._unspill_worklist(worklist)
+
+        # Can't lock, restore data
+        wait_start = time.time()
+        if not self._db.lock(300):
+            self._buffer_restore(worklist)
+            if finalize:
+                self.logger.error(
+                    "Can't dump {} items due to fail to acquire lock!".format(len(self._buffer)))
+            else:
+                self.logger.error(
+                    "Can't dump {} items due to fail to acquire lock - will try on next dump".format(
+                        len(self._buffer)))
+            self._dump_lock.release()
+            return
+        self._record_lock_wait('dump', time.time() - wait_start)
 
-#                if self.has_iattr(item.conf, 'database_acl'):
-#                    acl = self.get_iattr_value(item.conf, 'database_acl').lower()
-#                    self.logger.info("_dump: Dumping item '{}', database_acl = {}".format(item, acl))
+        try:
+            changed = self._timestamp(self.shtime.now())
+            worklist = [(item, tuples, self._dump_prepare(item, tuples, changed, finalize)) for item, tuples in worklist]
+
+            if self._bulk_dump and self._upsert_mode is not None:
+                dumped = self._dump_bulk(worklist, changed)
+            else:
+                dumped = None
+            if dumped is None:
+                dumped = self._dump_single(worklist, changed)
+            if self._rollup:
+                self._dump_rollup()
+        finally:
+            self._buffer_release([entry[0] for entry in worklist])
+            self._db.release()
+
+        self._update_dump_stats(len(worklist), dumped, time.time() - dump_start)
+        self._dump_lock.release()
 
+
+    def _dump_prepare(self, item, tuples, changed, finalize):
+        """
+        Prepare the dump of an item and determine the data for the update of the item record
+
+        When finalizing, the current value of the item is appended to the tuples.
+
+        :param item: item to dump
+        :param tuples: buffered tuples of the item
+        :param changed: timestamp of the dump
+        :param finalize: True, if the dump is done on plugin shutdown
+
+        :return: tuple (time, value, changed) for the update of the item record
+        """
+        # Get current values of item
+        start = self._timestamp(item.last_change())
+        end = changed
+        val = item()
+        try:
+            self._webdata[item.property.path].update({'value': val})
+            self._webdata[item.property.path].update({'type': item.property.type})
+            self._webdata[item.property.path].update({'buffer_hwm': self._buffer_hwm.get(item, 0)})
+        except Exception as e:
+            self.logger.warning("Problem webdata value update {}: {}".format(item.property.path, e))
+
+        # When finalizing (e.g. plugin shutdown) add current value to item and log
+        if finalize:
+
+            # When plugin is shutdown, by default, every registered item is rewritten into the DB no matter
+            # if it has been changed or not. This behavior is not wanted for items that are rarely updated
+            # because these database entries would lead indicate item updates that in reality aren't really there.
+            # Therefore, if item attribute database_write_on_shutdown is set to False, no double entries are written
+            # to the database and only the last entry is updated.
+
+            #self.logger.debug(f"DEBUG _dump: Finalizing item {item} with value {val}")
+            if self.get_iattr_value(item.conf, 'database_write_on_shutdown') == False:
+                self.logger.debug(f"DEBUG _dump: Blocking rewrite to DB for item {item} with value {val}")
+
+                #if item.property.path == 'xyz':
+                #    self.logger.warning(f"DEBUG _dump: update debug item with start {start}, val {val}, changed {changed}")
+
+                return (start, val, changed)
+
+            # Perform item update and rewrite current value to database:
+            tuples.append((start, end - start, val))
+            return (end, val, changed)
+
+        # only perform DB item update for regular dumps (not at plugin shutdown)
+        return (start, val, changed)
+
+
+    def _dump_bulk(self, worklist, changed):
+        """
+        Write the tuples of all items of the worklist within one transaction
+
+        :param worklist: list of (item, tuples, update) entries
+        :param changed: timestamp of the dump
+
+        :return: number of written tuples or None, if the bulk write failed
+        """
+        cur = None
+        try:
+            cur = self._db.cursor()
+            rows = []
+            ids = []
+            for item, tuples, _update in worklist:
+                id = self.id(item, cur=cur)
+                self.logger.debug('Dumping {}/{} with {} values'.format(item.property.path, id, len(tuples)))
+                it = item.type()
+                rows.extend((id, t[0], t[1], t[2], it) for t in tuples)
+                ids.append(id)
+                self.updateItem(id, _update[0], None, _update[1], it, _update[2], cur)
+
+            self.upsertLogs(rows, changed, cur=cur)
+            cur.close()
+            cur = None
+
+            self._db.commit()
+            self._buffer_release([item for item, _tuples, _update in worklist])
+            # invalidate after the commit, otherwise a concurrent reader may cache the old values again
+            for id, (item, tuples, _update) in zip(ids, worklist):
+                self._rollup_mark(id, tuples)
+                self._series_cache_invalidate(item.property.path, tuples)
+        except Exception as e:
+            self.logger.warning(f"Problem with bulk dump of {len(worklist)} items, falling back to dumping item by item: {e}")
+            try:
+                self._db.rollback()
+            except Exception as er:
+                self.logger.warning("Error rolling back: {}".format(er))
+            self._reload_item_ids()
+            return None
+        finally:
+            if cur is not None:
+                cur.close()
+        return len(rows)
+
+
+    def _dump_single(self, worklist, changed):
+        """
+        Write the tuples of the items of the worklist with one transaction per item
+
+        :param worklist: list of (item, tuples, update) entries
+        :param changed: timestamp of the dump
+
+        :return: number of written tuples
+        """
+        dumped = 0
+        for item, tuples, _update in worklist:
+            cur = None
+            try:
+                cur = self._db.cursor()
+                id = self.id(item, cur=cur)
+
+                # Dump tuples
+                self.logger.debug('Dumping {}/{} with {} values'.format(item.property.path, id, len(tuples)))
+
+                for t in tuples:
+                    if len(self.readLog(id, t[0], cur)):
+                        self.updateLog(id, t[0], t[1], t[2], item.type(), changed, cur)
+                    else:
+                        self.insertLog(id, t[0], t[1], t[2], item.type(), changed, cur)
+
+                self.updateItem(id, _update[0], None, _update[1], item.type(), _update[2], cur)
+                cur.close()
                 cur = None
+
+                self._db.commit()
+                self._buffer_release([item])
+                self._rollup_mark(id, tuples)
+                self._series_cache_invalidate(item.property.path, tuples)
+                dumped += len(tuples)
+            except Exception as e:
+                self.logger.warning("Problem dumping {}: {}".format(item.property.path, e))
                 try:
-                    changed = self._timestamp(self.shtime.now())
+                    self._db.rollback()
+                    self._buffer_release([item])
+                except Exception as er:
+                    self._buffer_insert(item, tuples)
+                    self.logger.warning("Error rolling back: {}".format(er))
+                self._reload_item_ids()
+            finally:
+                if cur is not None:
+                    cur.close()
+        return dumped
 
-                    # Get current values of item
-                    start = self._timestamp(item.last_change())
-                    end = changed
-                    val = item()
-                    try:
-                        self._webdata[item.property.path].update({'value': val})
-                        self._webdata[item.property.path].update({'type': item.property.type})
-                    except Exception as e:
-                        self.logger.warning("Problem webdata value update {}: {}".format(item.property.path, e))
 
-                    # When finalizing (e.g. plugin shutdown) add current value to item and log
-                    if finalize:
+    def _dump_rollup(self):
+        """
+        Update the rollup tables within an own transaction
+
+        called by _dump() while holding the database lock
+        """
+        cur = None
+        try:
+            cur = self._db.cursor()
+            self._rollup_update(cur)
+            cur.close()
+            cur = None
+            self._db.commit()
+        except Exception as e:
+            self.logger.warning(f"Problem updating rollup tables: {e}")
+            try:
+                self._db.rollback()
+            except Exception as er:
+                self.logger.warning("Error rolling back: {}".format(er))
+        finally:
+            if cur is not None:
+                cur.close()
 
-                        # When plugin is shutdown, by default, every registered item is rewritten into the DB no matter
-                        # if it has been changed or not. This behavior is not wanted for items that are rarely updated
-                        # because these database entries would lead indicate item updates that in reality aren't really there.
-                        # Therefore, if item attribute database_write_on_shutdown is set to False, no double entries are written
-                        # to the database and only the last entry is updated.
 
-                        #self.logger.debug(f"DEBUG _dump: Finalizing item {item} with value {val}")
-                        if self.get_iattr_value(item.conf, 'database_write_on_shutdown') == False:
-                            self.logger.debug(f"DEBUG _dump: Blocking rewrite to DB for item {item} with value {val}")
+    def _spill_worklist(self, worklist):
+        """
+        Write the tuples of a worklist to the local spill file (if the database is not available)
 
-                            #if item.property.path == 'xyz':
-                            #    self.logger.warning(f"DEBUG _dump: update debug item with start {start}, val {val}, changed {changed}")
+        The tuples are either written completely to the spill file or kept in the buffer: if writing fails,
+        the partially written lines are truncated, so the tuples are not replayed twice.
 
-                            _update = (start, val, changed)
+        :param worklist: list of (item, tuples) entries
+        """
+        try:
+            lines = "".join(json.dumps([item.property.path, tuples]) + "\n" for item, tuples in worklist if tuples)
+            os.makedirs(os.path.dirname(self._spill_path), exist_ok=True)
+            with open(self._spill_path, 'a') as f:
+                size = f.tell()
+                try:
+                    f.write(lines)
+                    f.flush()
+                except Exception:
+                    f.truncate(size)
+                    raise
+            self._buffer_release([item for item, _tuples in worklist])
+            self.logger.warning(f"Database not available, spilled values of {len(worklist)} items to {self._spill_path}")
+        except Exception as e:
+            self.logger.error(f"Unable to spill values to '{self._spill_path}', values are kept in memory: {e}")
+            self._buffer_restore(worklist)
 
-                        else:
-                            # Perform item update and rewrite current value to database:
-                            _update = (end, val, changed)
 
-                            current = (start, end - start, val)
-                            tuples.append(current)
+    def _unspill_worklist(self, worklist):
+        """
+        Read the tuples from the local spill file and prepend them to the tuples of the worklist
 
-                    else:
-                        # only perform DB item update for regular dumps (not at plugin shutdown)
-                        _update = (start, val, changed)
+        :param worklist: list of (item, tuples) entries
+        :return: worklist including the spilled tuples
+        """
+        spilled = {}
+        try:
+            with open(self._spill_path, 'r') as f:
+                for line in f:
+                    path, tuples = json.loads(line)
+                    spilled.setdefault(path, []).extend(tuple(t) for t in tuples)
+            os.remove(self._spill_path)
+        except Exception as e:
+            self.logger.error(f"Unable to read spilled values from '{self._spill_path}': {e}")
+            return worklist
 
-                    cur = self._db.cursor()
-                    id = self.id(item, cur=cur)
+        worklist = [(item, spilled.pop(item.property.path, []) + tuples) for item, tuples in worklist]
+        for path, tuples in spilled.items():
+            item = self.items.return_item(path)
+            if item is not None and item in self._buffer:
+                worklist.append((item, tuples))
+        self.logger.info(f"Restored spilled values of {len(worklist)} items from {self._spill_path}")
+        return worklist
 
-                    # Dump tuples
-                    self.logger.debug('Dumping {}/{} with {} values'.format(item.property.path, id, len(tuples)))
 
-                    for t in tuples:
-                        if len(self.readLog(id, t[0], cur)):
-                            self.updateLog(id, t[0], t[1], t[2], item.type(), changed, cur)
-                        else:
-                            self.insertLog(id, t[0], t[1], t[2], item.type(), changed, cur)
+    def _update_dump_stats(self, items, tuples, duration):
+        """
+        Store the statistics of the last dump (shown in the web interface)
 
-                    self.updateItem(id, _update[0], None, _update[1], item.type(), _update[2], cur)
+        :param items: number of dumped items
+        :param tuples: number of dumped tuples
+        :param duration: duration of the dump in seconds
+        """
+        rate = tuples / duration if duration > 0 else 0
+        self._dump_stats = {'last_dump': self.shtime.now(), 'items': items, 'tuples': tuples,
+                            'duration': duration, 'rate': rate}
+        self.logger.debug(f'Dump completed: {tuples} values of {items} items in {duration:.3f} seconds ({rate:.0f} values/s)')
 
-                    cur.close()
-                    cur = None
 
-                    self._db.commit()
-                except Exception as e:
-                    self.logger.warning("Problem dumping {}: {}".format(item.property.path, e))
-                    try:
-                        self._db.rollback()
-                    except Exception as er:
-                        self._buffer_insert(item, tuples)
-                        self.logger.warning("Error rolling back: {}".format(er))
-                finally:
-                    if cur is not None:
-                        cur.close()
-                self._db.release()
-        self.logger.debug('Dump completed')
-        self._dump_lock.release()
+    def _buffer_restore(self, worklist):
+        """
+        Put the tuples of a worklist back into the buffer (e.g. if the database is not available)
+
+        :param worklist: list of (item, tuples) entries
+        """
+        for entry in worklist:
+            self._buffer_insert(entry[0], entry[1])
 
 
     def _buffer_insert(self, item, tuples):
-        self._buffer_lock.acquire()
-        if item in self._buffer:
-            self._buffer[item] = tuples + self._buffer[item]
-        else:
-            self._buffer[item] = tuples
-        self._buffer_lock.release()
+        """
+        Insert tuples in front of the buffer of an item (e.g. to restore tuples after a failed dump)
+
+        If the capacity of the buffer is exceeded, the configured overflow policy is applied and the
+        dropped tuples are counted.
+
+        :param item: item to insert the tuples for
+        :param tuples: list of tuples (time, duration, value)
+        :return: tuples
+        """
+        with self._buffer_lock:
+            entries = list(tuples) + list(self._buffer.get(item, ()))
+            dropped = max(0, len(entries) - self._buffer_maxlen) if self._buffer_maxlen else 0
+            if dropped:
+                self._buffer_dropped += dropped
+                if self._buffer_overflow == 'drop_newest':
+                    entries = entries[:self._buffer_maxlen]
+                else:
+                    entries = entries[dropped:]
+            buffer = self._new_buffer(entries)
+            self._buffer[item] = buffer
+            self._buffer_inflight.pop(item, None)
+            self._buffer_pending += len(tuples) - dropped
+            if len(buffer) > self._buffer_hwm.get(item, 0):
+                self._buffer_hwm[item] = len(buffer)
         return tuples
 
 
     def _buffer_remove(self, item):
-        self._buffer_lock.acquire()
-        tuples = self._buffer[item]
-        self._buffer[item] = self._buffer[item][len(tuples):]
-        self._buffer_lock.release()
-        return tuples
+        """
+        Take all tuples out of the buffer of an item
+
+        The buffer is swapped against an empty buffer, the list of tuples is created outside of the lock.
+        The tuples stay visible to readers (see _buffer_snapshot) until _buffer_release is called after
+        they are committed to the database.
+
+        :param item: item to remove the tuples for
+        :return: list of tuples (time, duration, value)
+        """
+        with self._buffer_lock:
+            buffer = self._buffer[item]
+            if len(buffer) == 0:
+                return []
+            self._buffer[item] = self._new_buffer()
+            self._buffer_inflight[item] = buffer
+            self._buffer_pending = max(0, self._buffer_pending - len(buffer))
+        return list(buffer)
+
+
+    def _buffer_release(self, items):
+        """
+        Remove the tuples of items taken out of the buffer by the dump from the view of the readers
+
+        called by _dump() after the tuples are committed to the database (or spilled to disk)
+
+        :param items: list of items
+        """
+        with self._buffer_lock:
+            for item in items:
+                self._buffer_inflight.pop(item, None)
+
+
+    def _buffer_snapshot(self, item):
+        """
+        Get a copy of the not yet committed tuples of an item
+
+        The tuples currently written by the dump are included. If the dump has taken the open tuple
+        of the last value, the buffer contains its completed version, which replaces it.
+
+        :param item: item to get the tuples for
+        :return: list of tuples (time, duration, value), sorted by time
+        """
+        with self._buffer_lock:
+            inflight = self._buffer_inflight.get(item)
+            buffer = list(self._buffer.get(item, ()))
+            if not inflight:
+                return buffer
+            tuples = list(inflight) + buffer
+        return sorted({t[0]: t for t in tuples}.values(), key=lambda t: t[0])
+
+
+    def _buffer_append(self, item, buffer, entry):
+        """
+        Append a tuple to the buffer of an item, respecting the capacity of the buffer
+
+        Has to be called while holding the buffer lock
+
+        :param item: item the buffer belongs to
+        :param buffer: buffer of the item
+        :param entry: tuple (time, duration, value)
+        """
+        if self._buffer_maxlen and len(buffer) >= self._buffer_maxlen:
+            self._buffer_dropped += 1
+            if self._buffer_overflow == 'drop_newest':
+                return
+            # deque with maxlen drops the oldest tuple on append
+        else:
+            self._buffer_pending += 1
+            if self._dump_threshold and self._buffer_pending >= self._dump_threshold:
+                self._writer_event.set()
+        buffer.append(entry)
+        if len(buffer) > self._buffer_hwm.get(item, 0):
+            self._buffer_hwm[item] = len(buffer)
+
+
+    def _new_buffer(self, tuples=()):
+        """
+        Create a buffer for the tuples of an item
+
+        :param tuples: initial content of the buffer
+        :return: buffer (deque)
+        """
+        return collections.deque(tuples, maxlen=self._buffer_maxlen or None)
+
+
+    def _buffer_highwater(self):
+        """
+        Get the item with the highest buffer high-water mark (for the web interface)
+
+        :return: tuple (item path, high-water mark) or None
+        """
+        if not self._buffer_hwm:
+            return None
+        item, hwm = max(self._buffer_hwm.items(), key=lambda entry: entry[1])
+        return item.property.path, hwm
 
 
     # ------------------------------------------
@@ -1543,6 +2794,11 @@ class Database(SmartPlugin):
         """
         Remove log entries older than maxage of an item
 
+        Log entries are deleted in batches of max_delete_logentries records, each batch within an own
+        short transaction. A run works on as many items as possible within the time limit of a run
+        (half of removeold_cycle) and respects the configured delete rate (maxage_delete_rate). The
+        remaining worklist is saved, so a restart of SmartHomeNG resumes where the deletion stopped.
+
         Called by scheduler
         """
         if self.lock_remove_older:
@@ -1581,80 +2837,187 @@ class Database(SmartPlugin):
                 self._maxage_worklist = [i for i in self._handled_items]
             self.logger.info(f"remove_older_: Worklist filled with {len(self._maxage_worklist)} items")
 
-        item = self._maxage_worklist.pop(0)
-        itempath = item.property.path
+        run_start = time.time()
+        deleted = 0
+        items = 0
+        while self._maxage_worklist and self.alive:
+            item = self._maxage_worklist[0]
+            finished, count = self._remove_older_item(item, run_start)
+            deleted += count
+            if not finished:
+                break
+            self._maxage_worklist.pop(0)
+            items += 1
+
+        run_duration = time.time() - run_start
+        self._maxage_stats['last_run'] = self.shtime.now()
+        self._maxage_stats['items'] = items
+        self._maxage_stats['deleted'] = deleted
+        self._maxage_stats['deleted_total'] += deleted
+        self._maxage_stats['duration'] = run_duration
+        self._maxage_stats['remaining'] = len(self._maxage_worklist)
+        if deleted:
+            self.logger.info(f"remove_older_: deleted {deleted} log entries of {items} items in {run_duration:.2f} seconds, {len(self._maxage_worklist)} items remaining in worklist")
+        self._save_maxage_worklist()
+        return
 
-        try:
-            item_id = self.id(item, create=False)
-        except:
-            if item_id is None:
-                self.logger.info(f"remove_older_: no id for item {itempath}")
-            else:
-                self.logger.critical(f"remove_older_: no id for item {itempath}")
-            return
+
+    def _remove_older_item(self, item, run_start):
+        """
+        Remove log entries older than maxage of one item in batches
+
+        :param item: item to remove the log entries for
+        :param run_start: start time of the current run (time.time())
+
+        :return: tuple (finished, deleted): finished is False, if the time limit of the run has been reached
+                 before all log entries of the item have been deleted
+        """
+        itempath = item.property.path
+        item_id = self.id(item, create=False)
+        if item_id is None:
+            self.logger.info(f"remove_older_: no id for item {itempath}")
+            return True, 0
 
         # it might well be that introducing database_maxage to a very old SmartHomeNG installation will try to start
-        # a deletion of thousands of logentries. This might take days with SQLite if so.
-        # so strategies might be
-        # a) delete only records for one day
-        # b) to just delete a limited number of log entries
+        # a deletion of thousands of logentries. Therefore the log entries are deleted in batches and the
+        # deletion continues on the next run, if the time limit of the run is reached.
         time_end = self.get_maxage_ts(item)
         timestamp_end = self._timestamp(time_end)
 
         # if delete would also remove the last logged value for the item then there might be no chance for
         # ``database: init`` to retrieve the latest value.
-        remaining = 1
         if self.get_iattr_value(item.conf, 'database').lower() == 'init':
             # find out if there are still log entries after deletion of the logs
             remaining = self.readLogCount(item_id, time_start=self._timestamp( time_end + datetime.timedelta(microseconds=1)))
-            # remaining can be larger than self._item_logcount[item_id], it depends on the rate of database updates
-            #self.logger.info(f"remove_older_: {itempath} has attribute init with {self._item_logcount[item_id]} log entries and will have {remaining} log entries after deletion")
+            if remaining <= 0:
+                # no log entries will be there after deletion, need to go back in time for the latest logentry
+                new_must_keep_timestamp = self.readLatestLog(item_id, timestamp_end)
+                if new_must_keep_timestamp is None:
+                    return True, 0
+                new_must_keep_time = self._datetime(new_must_keep_timestamp)
+                self.logger.info(f"remove_older_: {itempath} no remaining log entry between {time_end} and now, thus can not remove log entries older than maxage, latest log is {new_must_keep_time}")
+                time_end = new_must_keep_time + datetime.timedelta(microseconds=-1)
+                timestamp_end = self._timestamp( time_end )
+
+        deleted = 0
+        finished = False
+        while self.alive:
+            if time.time() - run_start > self._maxage_run_time:
+                break
+            batch_start = time.time()
+            count = self._delete_log_batch(item_id, timestamp_end, self.max_delete_logentries, deleted=deleted)
+            if count is None:
+                break
+            deleted += count
+            if count < self.max_delete_logentries:
+                finished = True
+            # throttle deletion to the configured rate
+            if self._maxage_delete_rate > 0:
+                time.sleep(max(0, count / self._maxage_delete_rate - (time.time() - batch_start)))
+            if finished:
+                break
+
+        if deleted:
+            time_end_str = time_end.strftime("%d.%m.%Y - %H:%M")
+            self.logger.info(f"remove_older_: {itempath} deleted {deleted} log entries until {time_end_str}")
 
-        if remaining <= 0:
-            # no log entries will be there after deletion, need to go back in time for the latest logentry
-            new_must_keep_timestamp = self.readLatestLog(item_id, timestamp_end)
-            if new_must_keep_timestamp is None:
-                return
-            new_must_keep_time = self._datetime(new_must_keep_timestamp)
-            self.logger.info(f"remove_older_: {itempath} no remaining log entry between {time_end} and now, thus can not remove log entries older than maxage, latest log is {new_must_keep_time}")
-            time_end = new_must_keep_time + datetime.timedelta(microseconds=-1)
-            timestamp_end = self._timestamp( time_end )
-
-        count_log_records_to_delete = self.readLogCount(item_id, time_end=self._timestamp( time_end))
-        count_log_records_to_delete_str = f"{count_log_records_to_delete:,}".replace(',','.')
-        max_delete_logentries_str = f"{self.max_delete_logentries:,}".replace(',','.')
-        time_end_str = time_end.strftime("%d.%m.%Y - %H:%M")
-        self.logger.debug(f"remove_older_: {itempath} remove older than {time_end_str} - {count_log_records_to_delete_str} records to delete")
-
-        # prevent to many deletions with strategy b)
-        # assumption is made that logentries are evenly distributed over time
-        # there will be actually be some more or less deletions than given in self.max_delete_logentries
-        # since only a linear approximation over time and counts is used, but it should do the trick
-        # to prevent from database lockups after setting database_maxage to old/ancient items
-        if count_log_records_to_delete > self.max_delete_logentries:
-            time_start_deletion = time.time()
+            # update the logCount for the item
+            logcount = self.readLogCount(item_id)
+            self._item_logcount[item_id] = logcount
+            self._webdata[itempath].update({'logcount': logcount})
+
+        return finished, deleted
+
+
+    def _delete_log_batch_query(self):
+        """
+        Get the query to delete a batch of the oldest log records of an item
+
+        :return: query
+        """
+        if self.driver.lower() == 'sqlite3':
+            # DELETE ... LIMIT is only available, if SQLite is compiled with SQLITE_ENABLE_UPDATE_DELETE_LIMIT
+            return "DELETE FROM {log} WHERE rowid IN (SELECT rowid FROM {log} WHERE item_id = :id AND time < :time_end ORDER BY time ASC LIMIT :limit);"
+        return "DELETE FROM {log} WHERE item_id = :id AND time < :time_end ORDER BY time ASC LIMIT :limit;"
+
+
+    def _delete_log_batch(self, id, time_end, limit, deleted=0):
+        """
+        Delete a batch of the oldest log records of an item within an own transaction
+
+        If the batch is the last one (less than limit records deleted) and log records have been deleted,
+        the rollup tables are adjusted within the same transaction.
+
+        :param id: Database ID of the item
+        :param time_end: only log records older than this time are deleted
+        :param limit: maximum number of log records to delete
+        :param deleted: number of log records deleted by previous batches of the same run
+
+        :return: number of deleted log records or None, if the deletion failed
+        """
+        query = self._delete_log_batch_query()
+
+        wait_start = time.time()
+        if not self._db.lock(300):
+            self.logger.error("remove_older_: Can't delete log entries due to fail to acquire lock")
+            return None
+        self._record_lock_wait('maintenance', time.time() - wait_start)
+        cur = None
+        try:
             cur = self._db.cursor()
-            self._execute(self._prepare("DELETE FROM {log} WHERE item_id = :id ORDER BY time ASC LIMIT :maxrecords;"), {'id': item_id, 'maxrecords': self.max_delete_logentries}, cur=cur)
+            self._execute(self._prepare(query), {'id': id, 'time_end': time_end, 'limit': limit}, cur=cur,
+                          template='maxage')
+            count = max(cur.rowcount, 0)
+            if count < limit and count + deleted > 0:
+                self._rollup_delete(id, time_end=time_end, cur=cur)
             cur.close()
-            time_used_for_deletion = time.time() - time_start_deletion
-            self.logger.info(f"remove_older_: {itempath} deleted {max_delete_logentries_str} of {count_log_records_to_delete_str} log entries - took {time_used_for_deletion:.2f} seconds, averaging {100*time_used_for_deletion/self.max_delete_logentries:.4f} seconds per 100 entries")
+            cur = None
+            self._db.commit()
+        except Exception as e:
+            self.logger.error(f"remove_older_: Exception deleting log entries for id {id}: {e}")
+            try:
+                self._db.rollback()
+            except Exception as er:
+                self.logger.warning("Error rolling back: {}".format(er))
+            return None
+        finally:
+            if cur is not None:
+                cur.close()
+            self._db.release()
+        return count
 
-            # Re-Add item to worklist, since there are more records to be deleted
-            self._maxage_worklist.append(item)
 
-        elif count_log_records_to_delete:
-            time_start_deletion = time.time()
-            self.deleteLog(item_id, time_end=timestamp_end, with_commit=False)
-            time_used_for_deletion = time.time() - time_start_deletion
-            time_end_str = time_end.strftime("%d.%m.%Y - %H:%M")
-            self.logger.info(f"remove_older_: {itempath} deleted {count_log_records_to_delete_str} log entries until {time_end_str} took {time_used_for_deletion:.2f} seconds, averaging {100*time_used_for_deletion/count_log_records_to_delete:.4f} seconds per 100 entries")
+    def _save_maxage_worklist(self):
+        """
+        Save the paths of the items in the maxage worklist, so a restart resumes the deletion
+        """
+        try:
+            os.makedirs(os.path.dirname(self._maxage_worklist_path), exist_ok=True)
+            with open(self._maxage_worklist_path, 'w') as f:
+                json.dump([item.property.path for item in self._maxage_worklist], f)
+        except OSError as e:
+            self.logger.debug(f"Unable to write maxage worklist to '{self._maxage_worklist_path}': {e}")
 
-        # update the logCount for the item
-        logcount = self.readLogCount(item_id)
-        self._item_logcount[item_id] = logcount
-        self._webdata[item.property.path].update({'logcount': logcount})
 
-        return
+    def _load_maxage_worklist(self):
+        """
+        Load the maxage worklist saved by a previous run
+
+        called by run() once on start
+        """
+        if not os.path.exists(self._maxage_worklist_path):
+            return
+        try:
+            with open(self._maxage_worklist_path, 'r') as f:
+                paths = json.load(f)
+        except Exception as e:
+            self.logger.debug(f"Unable to read maxage worklist from '{self._maxage_worklist_path}': {e}")
+            return
+        items = {item.property.path: item for item in self._handled_items}
+        self._maxage_worklist = [items[path] for path in paths if path in items]
+        if self._maxage_worklist:
+            self.logger.info(f"remove_older_: Resuming with {len(self._maxage_worklist)} items in worklist")
+
 
     def get_maxage_ts(self, item):
         """
@@ -1720,6 +3083,10 @@ class Database(SmartPlugin):
             if not self._db_initialized:
                 self._db.setup(
                     {i: [self._prepare(query[0]), self._prepare(query[1])] for i, query in self._setup.items()})
+                if self._db_read_pool is not None and self.driver.lower() == 'sqlite3':
+                    # WAL mode allows the read connections to read while the main connection writes
+                    journal_mode = self._db.fetchone("PRAGMA journal_mode=WAL;", {})
+                    self.logger.info(f"SQLite journal mode: {journal_mode[0] if journal_mode else None}")
                 self._db_initialized = True
         except Exception as e:
             if self.driver.lower() == 'sqlite3':
@@ -1761,12 +3128,76 @@ class Database(SmartPlugin):
         return True
 
 
+    def _upsert_log_query(self, count):
+        """
+        Build (and cache) the UPSERT query for the given number of log records
+
+        :param count: number of log records to write with the query
+        :return: query
+        """
+        query = self._upsert_queries.get(count)
+        if query is None:
+            values = ", ".join("(:id_{0}, :time_{0}, :val_str_{0}, :val_num_{0}, :val_bool_{0}, :duration_{0}, :changed_{0})".format(self._param_suffix(index)) for index in range(count))
+            query = "INSERT INTO {log}(item_id, time, val_str, val_num, val_bool, duration, changed) VALUES " + values
+            query = self._prepare(query + self._upsert_clause(['duration', 'val_str', 'val_num', 'val_bool', 'changed']))
+            self._upsert_queries[count] = query
+        return query
+
+
+    def _upsert_clause(self, columns):
+        """
+        Get the UPSERT clause for tables with a unique index on (item_id, time)
+
+        :param columns: columns to update, if a record with the same item_id and time exists
+        :return: UPSERT clause of the query
+        """
+        if self._upsert_mode == 'sqlite':
+            return " ON CONFLICT(item_id, time) DO UPDATE SET " + ", ".join(f"{col} = excluded.{col}" for col in columns) + ";"
+        return " ON DUPLICATE KEY UPDATE " + ", ".join(f"{col} = VALUES({col})" for col in columns) + ";"
+
+
+    def _param_suffix(self, index):
+        """
+        Get a suffix for named query parameters, that consists of letters only
+
+        Named parameters in queries may only contain lowercase letters and underscores.
+
+        :param index: index of the parameter
+        :return: suffix ('a', 'b', ... 'z', 'ba', 'bb', ...)
+        """
+        suffix = ''
+        while True:
+            suffix = chr(ord('a') + index % 26) + suffix
+            index = index // 26
+            if index == 0:
+                return suffix
+
+
+    def _get_upsert_mode(self):
+        """
+        Determine the UPSERT syntax supported by the database driver
+
+        :return: 'sqlite', 'mysql' or None, if UPSERT is not supported
+        """
+        driver = self.driver.lower()
+        if driver == 'sqlite3':
+            import sqlite3
+            # UPSERT is supported by SQLite since version 3.24.0
+            if sqlite3.sqlite_version_info >= (3, 24, 0):
+                return 'sqlite'
+            self.logger.info(f"SQLite version {sqlite3.sqlite_version} does not support UPSERT, using single inserts for dump")
+            return None
+        if driver in ['pymysql', 'mysqldb']:
+            return 'mysql'
+        return None
+
+
     def _prepare(self, query):
         return query.format(**self._replace)
 
 
-    def _execute(self, query, params, cur=None):
-        self._query(self._db.execute, query, params, cur)
+    def _execute(self, query, params, cur=None, template=None):
+        self._query(self._db.execute, query, params, cur, template=template)
 
 
     def _fetchone(self, query, params={}, cur=None):
@@ -1774,36 +3205,278 @@ class Database(SmartPlugin):
         return tuples
 
 
-    def _fetchall(self, query, params={}, cur=None):
-        tuples = self._query(self._db.fetchall, query, params, cur)
+    def _fetchall(self, query, params={}, cur=None, read=False, template=None):
+        tuples = self._query(self._db.fetchall, query, params, cur, read=read, template=template)
         return None if tuples is None else list(tuples)
 
 
-    def _query(self, func, query, params, cur=None):
+    def _query(self, func, query, params, cur=None, read=False, template=None):
         if not self._initialize_db():
             return None
+        db = None
         if cur is None:
-            if self._db.verify(5) == 0:
-                self.logger.error("Database: Connection not recovered")
-                return None
-            if not self._db.lock(300):
-                self.logger.error("Database: Can't query due to fail to acquire lock")
-                return None
+            if read:
+                # read-only queries use a connection of the read pool (if configured)
+                db = self._acquire_read_db()
+            if db is None:
+                if self._db.verify(5) == 0:
+                    self.logger.error("Database: Connection not recovered")
+                    return None
+                wait_start = time.time()
+                if not self._db.lock(300):
+                    self.logger.error("Database: Can't query due to fail to acquire lock")
+                    return None
+                self._record_lock_wait('read' if read else 'write', time.time() - wait_start)
+            else:
+                func = getattr(db, func.__name__)
         query = self._prepare(query)
         query_readable = re.sub(r':([a-z_]+)', r'{\1}', query).format(**params)
         tuples = None
         try:
+            query_start = time.time()
             tuples = func(self._prepare(query), params, cur=cur)
+            if template is not None:
+                self._record_latency(template, time.time() - query_start)
         except Exception as e:
             self.logger.error("Database: Error for query {}: {}".format(query_readable, e))
             raise e
         finally:
-            if cur is None:
+            if db is not None:
+                self._release_read_db(db)
+            elif cur is None:
                 self._db.release()
         self.logger.debug("Database: Fetch {}: {}".format(query_readable, tuples))
         return tuples
 
 
+    # ------------------------------------------
+    #    Read connection pool
+    # ------------------------------------------
+
+    def _acquire_read_db(self):
+        """
+        Get a connection of the read pool
+
+        :return: database object or None, if the read pool is not configured or not available
+        """
+        if self._db_read_pool is None:
+            return None
+        wait_start = time.time()
+        try:
+            db = self._db_read_pool.get(timeout=300)
+        except queue.Empty:
+            self.logger.error("Database: Can't get a connection of the read pool")
+            return None
+        self._record_lock_wait('read', time.time() - wait_start)
+        if not db.connected():
+            try:
+                db.connect()
+            except Exception as e:
+                self.logger.warning(f"Database: Connecting read connection failed, using main connection: {e}")
+                self._db_read_pool.put(db)
+                return None
+        return db
+
+
+    def _release_read_db(self, db):
+        """
+        Return a connection to the read pool
+
+        The transaction is ended, so the next query of the connection sees the current data
+        (MySQL keeps a snapshot until the end of a transaction).
+
+        :param db: database object
+        """
+        try:
+            db.commit()
+        except Exception as e:
+            self.logger.warning(f"Database: Ending transaction of read connection failed: {e}")
+        self._db_read_pool.put(db)
+
+
+    def _close_read_pool(self):
+        """
+        Close all connections of the read pool
+        """
+        if self._db_read_pool is None:
+            return
+        while True:
+            try:
+                db = self._db_read_pool.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                db.close()
+            except Exception:
+                pass
+
+
+    def _record_lock_wait(self, qtype, wait):
+        """
+        Record the time a query had to wait for the database lock (or a read connection)
+
+        :param qtype: type of query ('read', 'write', 'dump', 'maintenance')
+        :param wait: wait time in seconds
+        """
+        stats = self._lock_wait_stats.get(qtype)
+        if stats is None:
+            stats = self._lock_wait_stats[qtype] = {'count': 0, 'total': 0.0, 'max': 0.0}
+        stats['count'] += 1
+        stats['total'] += wait
+        if wait > stats['max']:
+            stats['max'] = wait
+
+
+    # ------------------------------------------
+    #    Query plans and index advisor
+    # ------------------------------------------
+
+    def _record_latency(self, template, duration):
+        """
+        Record the execution time of a query in the latency histogram of its query template
+
+        :param template: name of the query template
+        :param duration: execution time in seconds
+        """
+        stats = self._latency_stats.get(template)
+        if stats is None:
+            stats = self._latency_stats[template] = {'count': 0, 'total': 0.0, 'max': 0.0,
+                                                     'buckets': [0] * (len(self._latency_buckets) + 1)}
+        ms = duration * 1000
+        stats['count'] += 1
+        stats['total'] += ms
+        if ms > stats['max']:
+            stats['max'] = ms
+        for i, bound in enumerate(self._latency_buckets):
+            if ms <= bound:
+                stats['buckets'][i] += 1
+                break
+        else:
+            stats['buckets'][-1] += 1
+
+
+    def _query_templates(self):
+        """
+        Get the query templates used by _series, _single, readLogs, readLogCount and deleteLog with sample parameters
+
+        :return: dict of query template name -> (query, params)
+        """
+        now = self._timestamp(self.shtime.now())
+        params = {'id': 0, 'time_start': now - 24 * 3600 * 1000, 'time_end': now, 'inow': now, 'step': 3600 * 1000,
+                  'limit': self.max_delete_logentries}
+        condition, slice_params = self._slice_condition(0, time_start=params['time_start'], time_end=now)
+        rollup_query = ("SELECT MIN(time), MIN(val_min), MAX(val_max), SUM(val_sum), SUM(val_count) FROM {rollup_hour} "
+                        "WHERE item_id = :id AND time >= :time_start AND time < :time_end GROUP BY time")
+        return {
+            'series': (self._fetch_log_query('MIN(time), AVG(val_num * duration) / AVG(duration)',
+                                             'GROUP BY ROUND(time / :step)', 'ORDER BY time ASC'), params),
+            'series_raw': (self._fetch_log_query('time, val_num', '', 'ORDER BY time ASC'), params),
+            'single': (self._fetch_log_query('MAX(val_num)'), params),
+            'rollup': (rollup_query, params),
+            'readLogs': ("SELECT {log_columns} FROM {log} WHERE " + condition, slice_params),
+            'readLogCount': ("SELECT count(*) FROM {log} WHERE item_id = :id AND time >= :time_start AND time <= :time_end;", params),
+            'deleteLog': ("DELETE FROM {log} WHERE " + condition, slice_params),
+            'maxage': (self._delete_log_batch_query(), params),
+        }
+
+
+    def _is_full_scan(self, row):
+        """
+        Check, if a row of a query plan is a full scan of a table
+
+        :param row: row of the result of EXPLAIN (MySQL) or EXPLAIN QUERY PLAN (SQLite)
+
+        :return: True, if the row is a full table scan
+        """
+        if self.driver.lower() == 'sqlite3':
+            # SQLite: (id, parent, notused, detail) with detail like 'SCAN log', 'SCAN TABLE log' or
+            # 'SCAN log USING (COVERING) INDEX ...' - an index used for a scan still reads all rows
+            match = re.match(r'SCAN (TABLE )?(\w+)', str(row[-1]))
+            return match is not None and match.group(2) in self._replace.values()
+        # MySQL: access type ALL is a full table scan (column type is preceded by column partitions since 5.7)
+        return 'ALL' in (row[3], row[4])
+
+
+    def _existing_indexes(self):
+        """
+        Get the names of the indexes existing in the database
+
+        :return: set of index names
+        """
+        if self.driver.lower() == 'sqlite3':
+            rows = self._fetchall("SELECT name FROM sqlite_master WHERE type = 'index';") or []
+            return {row[0] for row in rows}
+        indexes = set()
+        for table in ['{log}', '{rollup_hour}', '{rollup_day}']:
+            rows = self._fetchall("SHOW INDEX FROM " + table + ";") or []
+            indexes.update(row[2] for row in rows)
+        return indexes
+
+
+    def explain_queries(self):
+        """
+        Analyse the query plans of the query templates and check the indexes of the log and rollup tables
+
+        This is a public function of the plugin
+
+        :return: dict with the lists 'plans' and 'indexes'
+        """
+        explain = 'EXPLAIN QUERY PLAN ' if self.driver.lower() == 'sqlite3' else 'EXPLAIN '
+        plans = []
+        for name, (query, params) in self._query_templates().items():
+            entry = {'name': name, 'query': self._prepare(query), 'plan': [], 'full_scan': False, 'error': None,
+                     'latency': self._latency_stats.get(name)}
+            try:
+                rows = self._fetchall(explain + query, params) or []
+                entry['plan'] = [' | '.join(str(col) for col in row) for row in rows]
+                entry['full_scan'] = any(self._is_full_scan(row) for row in rows)
+            except Exception as e:
+                entry['error'] = str(e)
+            if entry['full_scan']:
+                self.logger.warning(f"explain_queries: Query template '{name}' does a full table scan: {entry['plan']}")
+            plans.append(entry)
+
+        existing = self._existing_indexes()
+        indexes = []
+        for name, (table, columns, unique, optional) in self._advised_indexes.items():
+            indexes.append({'name': name, 'index': self._prepare(name), 'table': self._prepare(table),
+                            'columns': columns, 'unique': unique, 'optional': optional,
+                            'exists': self._prepare(name) in existing})
+        return {'plans': plans, 'indexes': indexes}
+
+
+    def create_index(self, name):
+        """
+        Create an index proposed by the index advisor
+
+        MySQL creates the index online (ALGORITHM=INPLACE, LOCK=NONE), SQLite locks the database
+        while the index is built.
+
+        This is a public function of the plugin
+
+        :param name: name of the index (as listed in the result of explain_queries, e.g. '{log}_{item}_id_time')
+
+        :return: True, if the index was created
+        """
+        if name not in self._advised_indexes:
+            self.logger.error(f"create_index: Unknown index {name}")
+            return False
+        table, columns, unique, optional = self._advised_indexes[name]
+        query = "CREATE " + ("UNIQUE " if unique else "") + "INDEX "
+        if self.driver.lower() == 'sqlite3':
+            query += "IF NOT EXISTS " + name + " ON " + table + " (" + columns + ");"
+        else:
+            query += name + " ON " + table + " (" + columns + ") ALGORITHM=INPLACE LOCK=NONE;"
+        self.logger.info(f"create_index: Creating index {self._prepare(name)} on {self._prepare(table)} ({columns})")
+        try:
+            self._execute(query, {})
+            self._db.commit()
+        except Exception as e:
+            self.logger.error(f"create_index: Creating index {self._prepare(name)} failed: {e}")
+            return False
+        return True
+
+
     # ------------------------------------------
     #    conversion routines
     # ------------------------------------------
@@ -0,0 +1,148 @@
+import collections
+import datetime
+import logging
+import sqlite3
+import threading
+import types
+import unittest
+
+from plugins.database import Database
+
+
+class Item:
+
+    def __init__(self, path):
+        self.property = types.SimpleNamespace(path=path)
+
+    def type(self):
+        return 'num'
+
+    def last_change(self):
+        # newer than all requested ranges, the current value is not appended to the series
+        return datetime.datetime(2100, 1, 1)
+
+
+class Items:
+
+    def __init__(self, item):
+        self.item = item
+
+    def return_item(self, path):
+        return self.item
+
+
+class Shtime:
+
+    def now(self):
+        return datetime.datetime.now()
+
+
+class Logger(logging.Logger):
+
+    def dbgmed(self, msg, *args, **kwargs):
+        pass
+
+
+class TestDatabaseBufferedReads(unittest.TestCase):
+
+    T0 = 1000000000000
+    MINUTE = 60000
+
+    # (time, value) of the values of the item, every value lasts until the next one
+    VALUES = [(0, 5), (7, 0), (19, 12), (23, 12), (41, 3), (58, 0), (64, 8), (90, 1), (131, 7), (150, 2),
+              (177, 0), (203, 9), (240, 4), (251, 6), (288, 11), (305, 0), (333, 3)]
+
+    FUNCS = ['avg', 'integrate', 'min', 'max', 'on', 'sum', 'countall', 'count', 'count>4', 'count<3']
+
+    def setUp(self):
+        self.item = Item('test.value')
+        self.db = sqlite3.connect(':memory:')
+        plugin = self.plugin()
+        for version in sorted(Database._setup, key=int):
+            self.db.execute(plugin._prepare(Database._setup[version][0]))
+
+    def plugin(self):
+        plugin = Database.__new__(Database)
+        plugin.driver = 'sqlite3'
+        plugin.logger = Logger('test')
+        plugin.shtime = Shtime()
+        plugin.items = Items(self.item)
+        plugin._replace = {table: table for table in ["log", "item", "rollup_hour", "rollup_day"]}
+        plugin._precision = 2
+        plugin._rollup = False
+        plugin._series_cache_size = 0
+        plugin._item_ids = {self.item.property.path: 1}
+        plugin._buffer = {self.item: collections.deque()}
+        plugin._buffer_inflight = {}
+        plugin._buffer_lock = threading.Lock()
+        plugin._fetchall = lambda query, params={}, cur=None, read=False, template=None: \
+            self.db.execute(plugin._prepare(query), params).fetchall()
+        return plugin
+
+    def tuples(self):
+        times = [self.T0 + t * self.MINUTE for t, _value in self.VALUES]
+        tuples = [(t, next_t - t, value) for t, next_t, (_t, value) in zip(times, times[1:], self.VALUES)]
+        tuples.append((times[-1], None, self.VALUES[-1][1]))
+        return tuples
+
+    def write(self, tuples):
+        self.db.executemany("INSERT INTO log (item_id, time, duration, val_num, val_bool, changed) VALUES (1, ?, ?, ?, ?, 0)",
+                            [(t[0], t[1], float(t[2]), int(bool(t[2])), ) for t in tuples])
+
+    def read(self, plugin, start, end):
+        result = {}
+        for func in self.FUNCS + ['raw']:
+            result[func] = plugin._series(func, start, end, count=20, item=self.item.property.path)['series']
+        for func in self.FUNCS + ['diff', 'raw']:
+            result['single ' + func] = plugin._single(func, start, end, item=self.item.property.path)
+        return result
+
+    def ranges(self):
+        return [(self.T0 + start * self.MINUTE, self.T0 + end * self.MINUTE) for start, end in
+                [(0, 360), (30, 300), (60, 200), (100, 140), (250, 400), (340, 400)]]
+
+    def expected(self):
+        plugin = self.plugin()
+        self.write(self.tuples())
+        expected = [self.read(plugin, start, end) for start, end in self.ranges()]
+        self.db.execute("DELETE FROM log")
+        return expected
+
+    def test_buffered_values_are_merged(self):
+        expected = self.expected()
+        tuples = self.tuples()
+        for split in [0, 1, 5, 9, 12, 16]:
+            with self.subTest(split=split):
+                self.db.execute("DELETE FROM log")
+                plugin = self.plugin()
+                # written by the previous dump: the last value is still open
+                self.write(tuples[:split] + [(tuples[split][0], None, tuples[split][2])])
+                plugin._buffer[self.item] = collections.deque(tuples[split:])
+                self.assertEqual(expected, [self.read(plugin, start, end) for start, end in self.ranges()])
+
+    def test_values_of_running_dump_are_merged(self):
+        expected = self.expected()
+        tuples = self.tuples()
+        for split, dumped in [(0, 4), (3, 10), (8, 16)]:
+            with self.subTest(split=split, dumped=dumped):
+                self.db.execute("DELETE FROM log")
+                plugin = self.plugin()
+                self.write(tuples[:split] + [(tuples[split][0], None, tuples[split][2])])
+                # taken out of the buffer by the dump (not yet committed), the last value was open at that time
+                plugin._buffer_inflight[self.item] = collections.deque(
+                    tuples[split:dumped] + [(tuples[dumped][0], None, tuples[dumped][2])])
+                plugin._buffer[self.item] = collections.deque(tuples[dumped:])
+                self.assertEqual(expected, [self.read(plugin, start, end) for start, end in self.ranges()])
+
+    def test_released_values_are_read_from_database(self):
+        plugin = self.plugin()
+        tuples = self.tuples()
+        plugin._buffer_inflight[self.item] = collections.deque(tuples)
+        self.assertEqual(tuples, plugin._buffer_snapshot(self.item))
+        self.write(tuples)
+        plugin._buffer_release([self.item])
+        self.assertEqual([], plugin._buffer_snapshot(self.item))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import sqlite3
+import unittest
+
+from plugins.database import Database
+
+
+class TestDatabaseRollup(unittest.TestCase):
+
+    def plugin(self):
+        plugin = Database.__new__(Database)
+        plugin._upsert_mode = 'sqlite'
+        plugin._replace = {table: table for table in ["log", "item", "rollup_hour", "rollup_day"]}
+        plugin._rollup_build_chunk = 2
+        return plugin
+
+    def database(self, plugin):
+        db = sqlite3.connect(':memory:')
+        for version in sorted(Database._setup, key=int):
+            db.execute(plugin._prepare(Database._setup[version][0]))
+        return db
+
+    def query_plan(self, db, query):
+        params = {'time_start': 0, 'time_end': 3600000, 'inow': 3600000}
+        return [str(row[-1]) for row in db.execute("EXPLAIN QUERY PLAN " + query, params)]
+
+    def test_rollup_build_query_uses_index(self):
+        plugin = self.plugin()
+        db = self.database(plugin)
+        for name in Database._rollup_periods:
+            for ids in ([1], [1, 2, 3]):
+                plan = self.query_plan(db, plugin._prepare(plugin._rollup_build_query(name, ids)))
+                self.assertTrue(any(detail.startswith('SEARCH') and 'log_item_id_time' in detail for detail in plan), plan)
+                self.assertFalse(any(detail.startswith('SCAN') and ' log' in detail for detail in plan), plan)
+
+    def test_rollup_build_all_items_in_chunks(self):
+        plugin = self.plugin()
+        queries = []
+        plugin._rollup_item_ids = lambda cur=None: [5, 3, 1]
+        plugin._execute = lambda query, params, cur=None, template=None: queries.append(query)
+        plugin._rollup_build('hour', 0, 3600000, 3600000)
+        self.assertEqual(2, len(queries))
+        self.assertIn("item_id IN (1, 3)", queries[0])
+        self.assertIn("item_id IN (5)", queries[1])
+
+    def test_rollup_build_without_items(self):
+        plugin = self.plugin()
+        queries = []
+        plugin._rollup_item_ids = lambda cur=None: []
+        plugin._execute = lambda query, params, cur=None, template=None: queries.append(query)
+        plugin._rollup_build('day', 0, 86400000, 86400000)
+        self.assertEqual([], queries)
+
+
+if __name__ == '__main__':
+    unittest.main()
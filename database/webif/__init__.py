@@ -63,7 +63,7 @@ class WebInterface(SmartPluginWebIf):
 
     @cherrypy.expose
     def index(self, reload=None, action=None, item_id=None, item_path=None, time_end=None, day=None, month=None, year=None,
-              time_orig=None, changed_orig=None):
+              time_orig=None, changed_orig=None, index_name=None):
         """
         Build index.html for cherrypy
 
@@ -122,6 +122,18 @@ class WebInterface(SmartPluginWebIf):
                                    log_array=reversed_arr, day=day, month=month, year=year,
                                    delete_triggered=delete_triggered)
 
+            if action in ["query_plans", "create_index"]:
+                index_created = None
+                if action == "create_index" and index_name is not None:
+                    index_created = self.plugin.create_index(index_name)
+                tmpl = self.tplenv.get_template('query_plans.html')
+                return tmpl.render(p=self.plugin,
+                                   webif_pagelength=pagelength,
+                                   tabcount=2, action=action, index_created=index_created,
+                                   analysis=self.plugin.explain_queries(),
+                                   latency_buckets=self.plugin._latency_buckets,
+                                   language=self.plugin.get_sh().get_defaultlanguage())
+
         tmpl = self.tplenv.get_template('index.html')
 
         return tmpl.render(p=self.plugin,
@@ -19,7 +19,11 @@
 #  along with SmartHomeNG. If not, see <http://www.gnu.org/licenses/>.
 #########################################################################
 
+import gzip
 import logging
+import os
+import queue
+import shutil
 import time
 import threading
 
@@ -30,7 +34,7 @@ shtime = Shtime.get_instance()
 class DataLog(SmartPlugin):
 
     ALLOW_MULTIINSTANCE = True
-    PLUGIN_VERSION = '1.5.2'
+    PLUGIN_VERSION = '1.5.3'
 
     filepatterns = {}
     logpatterns = {}
@@ -47,6 +51,7 @@ class DataLog(SmartPlugin):
         filepatterns = self.get_parameter_value('filepatterns')
         logpatterns = self.get_parameter_value('logpatterns')
         cycle = self.get_parameter_value('cycle')
+        self.compress = self.get_parameter_value('compress')
 
         newfilepatterns = {}
         if isinstance(filepatterns, str):
@@ -84,6 +89,9 @@ class DataLog(SmartPlugin):
         self._items = {}
         self._buffer = {}
         self._buffer_lock = threading.Lock()
+        self._handles = {}
+        self._queue = queue.Queue()
+        self._writer = None
 
         self.logger.info('DataLog: Initialized, logging to "{}"'.format(self.path))
         for log in self.filepatterns:
@@ -91,11 +99,18 @@ class DataLog(SmartPlugin):
 
     def run(self):
         self.alive = True
+        self._writer = threading.Thread(target=self._write_entries, name='plugins.' + self.get_fullname() + '.writer')
+        self._writer.start()
         self.scheduler_add('DataLog', self._dump, cycle=self.cycle)
 
     def stop(self):
         self.alive = False
+        self.scheduler_remove('DataLog')
         self._dump()
+        if self._writer is not None:
+            self._queue.put(None)
+            self._writer.join()
+            self._writer = None
 
     def parse_item(self, item):
         if self.has_iattr(item.conf, 'datalog'):
@@ -133,40 +148,99 @@ class DataLog(SmartPlugin):
         if caller != 'DataLog':
             pass
 
-        if item.property.path in self._items:
-            for log in self._items[item.property.path]:
-                self._buffer[log].append({ 'time' : shtime.now(), 'item' : item.property.path, 'value' : item() })
+        logs = self._items.get(item.property.path)
+        if logs:
+            entry = (shtime.now(), item.property.path, item())
+            for log in logs:
+                self._buffer[log].append(entry)
 
     def _dump(self):
-        data = {}
-        now = shtime.now()
-        handles = {}
-
+        """
+        Hand the buffered entries over to the writer thread
+        """
         for log in self._buffer:
-            self._buffer_lock.acquire()
-            self.logger.debug('Dumping log "{}" with {} entries ...'.format(log, len(self._buffer[log])))
-            entries = self._buffer[log]
-            self._buffer[log] = []
-            self._buffer_lock.release()
+            with self._buffer_lock:
+                entries = self._buffer[log]
+                self._buffer[log] = []
 
             if len(entries):
-                logpattern = self.logpatterns[log]
-
-                try:
-                    for entry in entries:
-                        filename = self.filepatterns[log].format(**{ 'log' : log, 'year' : entry['time'].year, 'month' : entry['time'].month, 'day' : entry['time'].day })
-
-                        if filename not in handles:
-                            handles[filename] = open(self.path + '/' + filename, 'a')
-
-                        data = entry
-                        data['stamp'] = data['time'].timestamp();
-                        handles[filename].write(logpattern.format(**data))
-
-                except Exception as e:
-                    self.logger.error('Error while writing to {}: {}'.format(filename, e))
-
-        for filename in handles:
-            handles[filename].close()
-
-            self.logger.debug('Dump done!')
+                self.logger.debug('Dumping log "{}" with {} entries ...'.format(log, len(entries)))
+                self._queue.put((log, entries))
+
+    def _write_entries(self):
+        """
+        Writer thread: Writes the entries handed over by _dump() to the log files
+        """
+        while True:
+            job = self._queue.get()
+            if job is None:
+                break
+            log, entries = job
+            try:
+                self._write_log(log, entries)
+            except Exception as e:
+                self.logger.error('Error while writing log "{}": {}'.format(log, e))
+
+        for log in list(self._handles):
+            self._close_handle(log, compress=False)
+        self.logger.debug('Writer stopped')
+
+    def _write_log(self, log, entries):
+        """
+        Format entries (tuples of time, item and value) and write them to the file of the log
+
+        Entries are written in runs of the same day, each run with one write call. If the filename of the log
+        changes (e.g. a new day began), the file of the previous day is closed.
+        """
+        logpattern = self.logpatterns[log].format
+        needs_stamp = '{stamp' in self.logpatterns[log]
+
+        start = 0
+        while start < len(entries):
+            day = entries[start][0].date()
+            end = start + 1
+            while end < len(entries) and entries[end][0].date() == day:
+                end += 1
+
+            filename = self.filepatterns[log].format(log=log, year=day.year, month=day.month, day=day.day)
+            handle = self._get_handle(log, filename)
+            if needs_stamp:
+                handle.write(''.join([logpattern(time=t, item=i, value=v, stamp=t.timestamp()) for t, i, v in entries[start:end]]))
+            else:
+                handle.write(''.join([logpattern(time=t, item=i, value=v) for t, i, v in entries[start:end]]))
+            start = end
+
+        self._handles[log][1].flush()
+        self.logger.debug('Dump of log "{}" done!'.format(log))
+
+    def _get_handle(self, log, filename):
+        """
+        Return the open file handle for the log, rotate it if the filename has changed
+        """
+        current = self._handles.get(log)
+        if current is not None:
+            if current[0] == filename:
+                return current[1]
+            self._close_handle(log, compress=self.compress)
+
+        handle = open(os.path.join(self.path, filename), 'a', buffering=65536)
+        self._handles[log] = (filename, handle)
+        return handle
+
+    def _close_handle(self, log, compress=False):
+        """
+        Close the file handle of the log and optionally compress the closed file
+        """
+        filename, handle = self._handles.pop(log)
+        handle.close()
+        if compress and filename not in [f for f, h in self._handles.values()]:
+            filepath = os.path.join(self.path, filename)
+            try:
+                # append as additional gzip member, if the file has been compressed before
+                with open(filepath, 'rb') as f_in, gzip.open(filepath + '.gz', 'ab') as f_out:
+                    shutil.copyfileobj(f_in, f_out)
+                os.remove(filepath)
+            except Exception as e:
+                self.logger.error('Error while compressing {}: {}'.format(filepath, e))
+            else:
+                self.logger.info('Compressed {}'.format(filepath))
@@ -31,13 +31,21 @@ import datetime
 import time
 import re
 import queue
-import pickle
+import json
+import sqlite3
+import threading
 import operator
 from dateutil.relativedelta import relativedelta
 from typing import Union
 from dataclasses import dataclass, InitVar
 from collections import deque
 
+try:
+    import numpy as np
+    NUMPY_ENABLED = True
+except ImportError:
+    NUMPY_ENABLED = False
+
 from lib.model.smartplugin import SmartPlugin
 from lib.item import Items
 from lib.item.item import Item
@@ -60,7 +68,7 @@ class DatabaseAddOn(SmartPlugin):
     Main class of the Plugin. Does all plugin specific stuff and provides the update functions for the items
     """
 
-    PLUGIN_VERSION = '1.2.9'
+    PLUGIN_VERSION = '1.2.10'
 
     def __init__(self, sh):
         """
@@ -78,14 +86,16 @@ class DatabaseAddOn(SmartPlugin):
         self.plugins = Plugins.get_instance()
 
         # define cache dicts
-        self.pickle_data_validity_time = 600        # seconds after which the data saved in pickle are not valid anymore
         self.current_values = {}                    # Dict to hold min and max value of current day / week / month / year for items
         self.previous_values = {}                   # Dict to hold value of end of last day / week / month / year for items
         self.item_cache = {}                        # Dict to hold item_id, oldest_log_ts and oldest_entry for items
+        self.item_cache_validity_time = 600         # seconds after which the item data saved in aggregate store are not valid anymore
+        self.cache_buckets = {}                     # Dict to hold start of period as timestamp in ms, to which the values in cache dicts belong
         self.value_list_raw_data = {}               # List to hold raw data
 
         # define variables for database, database connection, working queue and status
-        self.item_queue = queue.Queue()              # Queue containing all to be executed items
+        self.item_queue = queue.PriorityQueue()      # Queue containing all to be executed items as (priority, sequence, entry)
+        self.item_queue_seq = 0                      # sequence number of queue entries to keep order within same priority
         self.update_item_delay_deque = deque()       # Deque for delay working of updated item values
         self._db_plugin = None                       # object if database plugin
         self._db = None                              # object of database
@@ -93,11 +103,23 @@ class DatabaseAddOn(SmartPlugin):
         self.db_driver = None                        # driver of the used database
         self.db_instance = None                      # instance of the used database
         self.item_attribute_search_str = 'database'  # attribute, on which an item configured for database can be identified
-        self.last_connect_time = 0                   # mechanism for limiting db connection requests
+        self.last_connect_time = {}                  # mechanism for limiting db connection requests: database object -> time of last request
         self.alive = None                            # Is plugin alive?
-        self.active_queue_item: str = '-'            # String holding item path of currently executed item
+        self.active_queue_item: str = '-'            # String holding item path(s) of currently executed item(s)
+        self.workers = {}                            # Dict of worker name -> dict with state and statistics of worker
+        self.item_latency = {}                       # Dict of item path -> dict with wait and calculation time of last calculation
+        self._worker_data = threading.local()        # worker specific data like the database object of the worker
+        self._queue_lock = threading.Lock()          # lock for sequence number, busy and deferred database items
+        self._busy_database_items = set()            # database items, for which an entry is currently processed
+        self._deferred_entries = {}                  # Dict of database item -> list of queue entries waiting for the busy database item
         self.onchange_delay_time = 30                # delay time in seconds between change of database item start of reevaluation of db_addon item
         self.database_item_list = []                 # list of needed database items
+        self.planned_results = {}                    # Dict to hold query results prefetched by the query planner per item_id
+        self.planner_lookback = 24 * 60 * 60 * 1000  # time in ms before the earliest planned timestamp, which is prefetched for 'next' queries
+        self.planner_stats = {'groups': 0, 'queries': 0, 'hits': 0}  # statistics of the query planner
+        self._planner_lock = threading.Lock()        # lock for planned_results
+        self._planner_pending = set()                # sequence numbers of queued item lists, which are not yet planned
+        self._planner_done = threading.Condition(self._queue_lock)  # notifies workers waiting for the query planner
 
         # define default mysql settings
         self.default_connect_timeout = 60
@@ -111,10 +133,13 @@ class DatabaseAddOn(SmartPlugin):
         self.optimize_value_filter = self.get_parameter_value('optimize_value_filter')
         self.use_oldest_entry = self.get_parameter_value('use_oldest_entry')
         self.lock_db_for_query = self.get_parameter_value('lock_db_for_query')
+        self.worker_count = self.get_parameter_value('worker_count')
+        self.onchange_streaming = self.get_parameter_value('onchange_streaming')
 
         # path and filename for data storage
         data_storage_file = 'db_addon_data'
-        self.data_storage_path = f"{os.getcwd()}/var/plugin_data/{self.get_shortname()}/{data_storage_file}.pkl"
+        self.data_storage_path = f"{os.getcwd()}/var/plugin_data/{self.get_shortname()}/{data_storage_file}.db"
+        self._cache_store = AggregateStore(self.data_storage_path, self.logger)
 
         # get debug log options
         self.debug_log = DebugLogOptions(self.log_level)
@@ -132,6 +157,10 @@ class DatabaseAddOn(SmartPlugin):
 
         self.logger.debug("Run method called")
 
+        # reopen aggregate store, which is closed by stop()
+        if not self._cache_store.open():
+            self.logger.warning("Unable to open db_addon aggregate store. Cached values will not survive a restart.")
+
         # check existence of db-plugin, get parameters, and init connection to db
         if not self._check_db_existence():
             self.logger.error(f"Check of existence of database plugin incl connection check failed. Plugin not loaded")
@@ -171,8 +200,13 @@ class DatabaseAddOn(SmartPlugin):
         # set plugin to alive
         self.alive = True
 
+        # start additional workers with own database connection; the first worker uses the run thread
+        for i in range(1, self.worker_count):
+            db = lib.db.Database(f"DatabaseAddOn{i}", self.db_driver, self.connection_data)
+            threading.Thread(target=self.work_item_queue, args=(f"worker{i}", db), name=f"{self.get_fullname()}.worker{i}", daemon=True).start()
+
         # work item queue
-        self.work_item_queue()
+        self.work_item_queue('worker0', self._db)
 
     def stop(self):
         """
@@ -183,8 +217,12 @@ class DatabaseAddOn(SmartPlugin):
         self.alive = False
         self.scheduler_remove('cyclic')
         self.scheduler_remove('onchange_delay')
+        self._stop_workers()
         if self._db:
             self._db.close()
+        for worker in self.workers.values():
+            if worker['db'] is not self._db:
+                worker['db'].close()
         self.save_cache_data()
 
     def parse_item(self, item: Item):
@@ -716,8 +754,13 @@ class DatabaseAddOn(SmartPlugin):
         if self.alive and caller != self.get_shortname():
             # handle database items
             if item in self._database_items():
-                self.logger.debug(f" Updated Item {item.property.path} with value {item()} will be put to queue in approx. {self.onchange_delay_time}s resp. after startup.")
-                self.update_item_delay_deque.append([item, item(), int(time.time() + self.onchange_delay_time)])
+                self._clear_planned_results(item)
+                if self.onchange_streaming:
+                    self.logger.debug(f" Updated Item {item.property.path} with value {item()} will be put to queue.")
+                    self._put_queue_entry((item, item(), int(time.time() * 1000)))
+                else:
+                    self.logger.debug(f" Updated Item {item.property.path} with value {item()} will be put to queue in approx. {self.onchange_delay_time}s resp. after startup.")
+                    self.update_item_delay_deque.append([item, item(), int(time.time() + self.onchange_delay_time), int(time.time() * 1000)])
 
             # handle admin items
             elif self.has_iattr(item.conf, 'db_addon_admin'):
@@ -731,110 +774,95 @@ class DatabaseAddOn(SmartPlugin):
                     self._init_cache_dicts()
                     item(False, self.get_shortname())
 
-    def _save_pickle(self, data) -> None:
-        """Saves received data as pickle to given file"""
+    def init_cache_data(self):
+        """init cache dicts by reading the aggregate store; only values of the current periods are used"""
 
-        if data and len(data) > 0:
-            self.logger.debug(f"Start writing {data=} to '{self.data_storage_path}'")
-            os.makedirs(os.path.dirname(self.data_storage_path), exist_ok=True)
-            try:
-                with open(self.data_storage_path, "wb") as output:
-                    try:
-                        pickle.dump(data, output, pickle.HIGHEST_PROTOCOL)
-                        self.logger.debug(f"Successfully wrote data to '{self.data_storage_path}'")
-                    except Exception as e:
-                        self.logger.debug(f"Unable to write data to '{self.data_storage_path}': {e}")
-                        pass
-            except OSError as e:
-                self.logger.debug(f"Unable to write data to '{self.data_storage_path}': {e}")
-                pass
+        # init cache dicts
+        self._init_cache_dicts(clear_store=False)
 
-    def _read_pickle(self):
-        """read a pickle file to gather data"""
+        if not self._cache_store.open():
+            self.logger.info("Unable to open db_addon aggregate store. Start with empty cache.")
+            return
 
-        self.logger.debug(f"Start reading data from '{self.data_storage_path}'")
+        # read aggregates and set data
+        rows = self._cache_store.read_aggregates()
+        if rows is None:
+            self.logger.info("Unable to read db_addon data from aggregate store. Start with empty cache.")
+            return
 
-        if os.path.exists(self.data_storage_path):
-            with open(self.data_storage_path, 'rb') as data:
-                try:
-                    data = pickle.load(data)
-                    self.logger.debug(f"Successfully read data from {self.data_storage_path}")
-                    return data
-                except Exception as e:
-                    self.logger.debug(f"Unable to read data from {self.data_storage_path}: {e}")
-                    return None
-
-        self.logger.debug(f"Unable to read data from {self.data_storage_path}: 'File/Path not existing'")
-        return None
+        expired = 0
+        for database_item_path, timeframe, bucket, func, value in rows:
+            database_item = self.items.return_item(database_item_path)
+            if database_item is None or timeframe not in self.cache_buckets:
+                continue
+            if bucket != self.cache_buckets[timeframe]:
+                expired += 1
+                continue
+            if func == 'previous':
+                self.previous_values[timeframe][database_item] = value
+            else:
+                self.current_values[timeframe].setdefault(database_item, {})[func] = value
 
-    def init_cache_data(self):
-        """init cache dicts by reading pickle"""
-
-        def create_items_1(d):
-            n_d = {}
-            for item_str in d:
-                item = self.items.return_item(item_str)
-                if item:
-                    n_d[item] = d[item_str]
-            return n_d
-
-        def create_items_2(d):
-            n_d = {}
-            for timeframe in d:
-                n_d[timeframe] = {}
-                for item_str in d[timeframe]:
-                    item = self.items.return_item(item_str)
-                    if item:
-                        n_d[timeframe][item] = d[timeframe][item_str]
-            return n_d
+        # remove values of past periods
+        for timeframe, bucket in self.cache_buckets.items():
+            self._cache_store.delete_aggregates(timeframe=timeframe, before=bucket)
 
-        # init cache dicts
-        self._init_cache_dicts()
+        for item_path, item_data in self._cache_store.read_item_cache(self.item_cache_validity_time).items():
+            item = self.items.return_item(item_path)
+            if item is not None:
+                self.item_cache[item] = item_data
 
-        # read pickle and set data
-        raw_data = self._read_pickle()
+        self.logger.info(f"Read {len(rows) - expired} cached values of current periods and {len(self.item_cache)} cached items from aggregate store; {expired} values expired.")
 
-        if not isinstance(raw_data, dict):
-            self.logger.info("Unable to extract db_addon data from pickle file. Start with empty cache.")
-            return
+    def save_cache_data(self):
+        """save all relevant data to survive restart and close the aggregate store; values are also stored on each change"""
 
-        current_values = raw_data.get('current_values')
-        previous_values = raw_data.get('previous_values')
-        item_cache = raw_data.get('item_cache')
-        stop_time = raw_data.get('stop_time')
+        rows = []
+        for timeframe, bucket in self.cache_buckets.items():
+            for database_item, values in self.current_values.get(timeframe, {}).items():
+                for func, value in (values or {}).items():
+                    rows.append((database_item.property.path, timeframe, bucket, func, value))
+            for database_item, value in self.previous_values.get(timeframe, {}).items():
+                if value is not None:
+                    rows.append((database_item.property.path, timeframe, bucket, 'previous', value))
 
-        if not stop_time or (int(time.time()) - stop_time) > self.pickle_data_validity_time:
-            self.logger.info("Data for db_addon read from pickle are expired. Start with empty cache.")
-            return
+        self._cache_store.write_aggregates(rows)
+        for item, item_data in self.item_cache.items():
+            self._cache_store.write_item_cache(item.property.path, item_data)
+        self._cache_store.close()
 
-        if isinstance(current_values, dict):
-            self.current_values = create_items_2(current_values)
-        if isinstance(previous_values, dict):
-            self.previous_values = create_items_2(previous_values)
-        if isinstance(item_cache, dict):
-            self.item_cache = create_items_1(item_cache)
+    def _store_current_value(self, timeframe: str, database_item: Item, func: str, value) -> None:
+        """put min / max value of current period of database item to cache dict and aggregate store"""
 
-    def save_cache_data(self):
-        """save all relevant data to survive restart, transform items in item_str"""
-
-        def clean_items_1(d):
-            n_d = {}
-            for item in d:
-                n_d[item.property.path] = d[item]
-            return n_d
-
-        def clean_items_2(d):
-            n_d = {}
-            for timeframe in d:
-                n_d[timeframe] = {}
-                for item in d[timeframe]:
-                    n_d[timeframe][item.property.path] = d[timeframe][item]
-            return n_d
-
-        self._save_pickle({'current_values': clean_items_2(self.current_values),
-                           'previous_values': clean_items_2(self.previous_values),
-                           'item_cache': clean_items_1(self.item_cache),
-                           'stop_time': int(time.time())})
+        self._store_current_values(timeframe, database_item, {func: value})
+
+    def _store_current_values(self, timeframe: str, database_item: Item, values: dict) -> None:
+        """put values of current period of database item to cache dict and aggregate store"""
+
+        self.current_values[timeframe].setdefault(database_item, {}).update(values)
+        self._cache_store.write_aggregates([(database_item.property.path, timeframe, self.cache_buckets[timeframe], func, value) for func, value in values.items()])
+
+    def _store_previous_value(self, timeframe: str, database_item: Item, value) -> None:
+        """put value at end of last period of database item to cache dict and aggregate store"""
+
+        self.previous_values[timeframe][database_item] = value
+        self._cache_store.write_aggregates([(database_item.property.path, timeframe, self.cache_buckets[timeframe], 'previous', value)])
+
+    def _reset_cache_timeframe(self, timeframe: str) -> None:
+        """reset cache dicts of given timeframe at start of a new period"""
+
+        self.current_values[timeframe] = {}
+        self.previous_values[timeframe] = {}
+        self.cache_buckets[timeframe] = self._get_start_end_as_timestamp(timeframe, 0, 0)[0]
+        self._cache_store.delete_aggregates(timeframe=timeframe)
+
+    def _store_item_cache(self, item: Item, key: str, value) -> None:
+        """put item related data to item cache dict and aggregate store"""
+
+        if item not in self.item_cache:
+            self.item_cache[item] = {}
+        self.item_cache[item][key] = value
+        self._cache_store.write_item_cache(item.property.path, self.item_cache[item])
 
     #########################################
     #           Item Handling
@@ -867,16 +895,14 @@ class DatabaseAddOn(SmartPlugin):
             # stündlich zu berechnende Items hinzufügen
             _todo_items.update(set(self._ondemand_hourly_items()))
             # cache dict leeren
-            self.current_values[HOUR] = {}
-            self.previous_values[HOUR] = {}
+            self._reset_cache_timeframe(HOUR)
 
             # wenn aktuelle Stunde == 0, werden auch die täglichen Items berechnet
             if self.shtime.now().hour == 0:
                 # item zur Aufgabeliste hinzufügen
                 _todo_items.update(set(self._ondemand_daily_items()))
                 # cache dict leeren
-                self.current_values[DAY] = {}
-                self.previous_values[DAY] = {}
+                self._reset_cache_timeframe(DAY)
                 self.value_list_raw_data = {}
                 # reset Item-Wert alle onchange
                 _reset_items.update(set(self._onchange_daily_items()))
@@ -886,8 +912,7 @@ class DatabaseAddOn(SmartPlugin):
                     # item zur Aufgabeliste hinzufügen
                     _todo_items.update(set(self._ondemand_weekly_items()))
                     # cache dict leeren
-                    self.current_values[WEEK] = {}
-                    self.previous_values[WEEK] = {}
+                    self._reset_cache_timeframe(WEEK)
                     # reset Item-Wert alle onchange
                     _reset_items.update(set(self._onchange_weekly_items()))
 
@@ -896,8 +921,7 @@ class DatabaseAddOn(SmartPlugin):
                     # item zur Aufgabeliste hinzufügen
                     _todo_items.update(set(self._ondemand_monthly_items()))
                     # cache dict leeren
-                    self.current_values[MONTH] = {}
-                    self.previous_values[MONTH] = {}
+                    self._reset_cache_timeframe(MONTH)
                     # reset Item-Wert alle onchange
                     _reset_items.update(set(self._onchange_monthly_items()))
 
@@ -906,8 +930,7 @@ class DatabaseAddOn(SmartPlugin):
                         # item zur Aufgabeliste hinzufügen
                         _todo_items.update(set(self._ondemand_yearly_items()))
                         # cache dict leeren
-                        self.current_values[YEAR] = {}
-                        self.previous_values[YEAR] = {}
+                        self._reset_cache_timeframe(YEAR)
                         # reset Item-Wert alle onchange
                         _reset_items.update(set(self._onchange_yearly_items()))
 
@@ -952,29 +975,200 @@ class DatabaseAddOn(SmartPlugin):
         self.logger.info(f"{len(todo_items)} items will be calculated for {option=}.")
         if self.debug_log.execute:
             self.logger.debug(f"Items to be calculated: {todo_items=}")
-        [self.item_queue.put(i) for i in todo_items]
+        # put list of items first, so that the queries of the items are planned and prefetched grouped by database item
+        if len(todo_items) > 1:
+            self._put_queue_entry(todo_items)
+        [self._put_queue_entry(i) for i in todo_items]
         return True
 
-    def work_item_queue(self) -> None:
-        """Handles item queue were all to be executed items were be placed in."""
+    def work_item_queue(self, name: str = 'worker0', db=None) -> None:
+        """
+        Handles item queue were all to be executed items were be placed in.
+
+        Several workers can run in parallel, each with an own database connection. Entries of the same database item are
+        never processed in parallel; they are deferred and processed by the worker of the entry being processed in the
+        order of the queue, so updates of a database item are never processed out of order.
+
+        :param name: name of the worker
+        :param db: database object to be used by the worker
+        """
+
+        self._worker_data.db = db
+        worker = {'db': db, 'thread': threading.current_thread(), 'active': '-', 'busy_time': 0.0, 'start_time': time.time(), 'count': 0}
+        self.workers[name] = worker
 
         while self.alive:
             try:
-                queue_entry = self.item_queue.get(True, 10)
-                self.logger.debug(f"{queue_entry=}")
+                priority, seq, queue_entry, queue_time = self.item_queue.get(True, 10)
+                self.logger.debug(f"{name}: {queue_entry=}")
             except queue.Empty:
-                self.active_queue_item = '-'
+                self._set_active_queue_item(name, '-')
+                if not self._busy_database_items:
+                    self._clear_planned_results()
                 pass
             else:
-                if isinstance(queue_entry, tuple):
-                    item, value = queue_entry
-                    self.logger.info(f"# {self.item_queue.qsize() + 1} item(s) to do. || 'onchange' item={item.property.path} with {value=} will be processed.")
-                    self.active_queue_item = str(item.property.path)
-                    self.handle_onchange(item, value)
-                else:
-                    self.logger.info(f"# {self.item_queue.qsize() + 1} item(s) to do. || 'on-demand' item={queue_entry.property.path} will be processed.")
-                    self.active_queue_item = str(queue_entry.property.path)
-                    self.handle_ondemand(queue_entry)
+                if queue_entry is None:
+                    # wake-up entry put by stop()
+                    continue
+                if not isinstance(queue_entry, list) and not self._wait_for_planner(seq):
+                    self.item_queue.put((priority, seq, queue_entry, queue_time))
+                    continue
+                database_item = self._queue_entry_database_item(queue_entry)
+                with self._queue_lock:
+                    if database_item is not None and database_item in self._busy_database_items:
+                        self._deferred_entries.setdefault(database_item, []).append((priority, seq, queue_entry, queue_time))
+                        continue
+                    if database_item is not None:
+                        self._busy_database_items.add(database_item)
+
+                entry = (priority, seq, queue_entry, queue_time)
+                while entry is not None:
+                    self._process_queue_entry(name, worker, *entry)
+
+                    # continue with the entries deferred meanwhile for the database item (lowest priority and sequence first); release database item, if there are none
+                    with self._queue_lock:
+                        deferred_entries = self._deferred_entries.get(database_item)
+                        if deferred_entries and self.alive:
+                            entry = min(deferred_entries, key=lambda deferred_entry: deferred_entry[:2])
+                            deferred_entries.remove(entry)
+                        else:
+                            entry = None
+                            self._deferred_entries.pop(database_item, None)
+                            self._busy_database_items.discard(database_item)
+
+    def _process_queue_entry(self, name: str, worker: dict, priority: int, seq: int, queue_entry, queue_time: float) -> None:
+        """
+        Process an entry of the item queue and update the statistics of the worker
+
+        :param name: name of the worker
+        :param worker: dict with state and statistics of the worker
+        :param priority: priority of the queue entry
+        :param seq: sequence number of the queue entry
+        :param queue_entry: item, tuple of (item, value, change_time) or list of items
+        :param queue_time: time, the entry has been put to the queue
+        """
+
+        start_time = time.time()
+        try:
+            if isinstance(queue_entry, list):
+                try:
+                    self._plan_queries(queue_entry)
+                finally:
+                    with self._queue_lock:
+                        self._planner_pending.discard(seq)
+                        self._planner_done.notify_all()
+            elif isinstance(queue_entry, tuple):
+                item, value, change_time = queue_entry
+                self.logger.info(f"# {self.queue_backlog() + 1} item(s) to do. || 'onchange' item={item.property.path} with {value=} will be processed by {name}.")
+                self._set_active_queue_item(name, str(item.property.path))
+                self.handle_onchange(item, value, change_time)
+            else:
+                self.logger.info(f"# {self.queue_backlog() + 1} item(s) to do. || 'on-demand' item={queue_entry.property.path} will be processed by {name}.")
+                self._set_active_queue_item(name, str(queue_entry.property.path))
+                self.handle_ondemand(queue_entry)
+        except Exception as e:
+            self.logger.error(f"{name}: Error processing queue entry {queue_entry}: {e}")
+        finally:
+            end_time = time.time()
+            worker['busy_time'] += end_time - start_time
+            worker['count'] += 1
+            if not isinstance(queue_entry, list):
+                item = queue_entry[0] if isinstance(queue_entry, tuple) else queue_entry
+                self.item_latency[str(item.property.path)] = {'wait': round(start_time - queue_time, 3), 'duration': round(end_time - start_time, 3)}
+
+    def _put_queue_entry(self, queue_entry) -> None:
+        """
+        Put entry to item queue with priority
+
+        Priority is
+            - list of items to be planned
+            - onchange items (tuple of item, value)
+            - items by horizon of their timeframe (hour, day, week, month, year)
+            - all other items
+
+        :param queue_entry: item, tuple of (item, value) or list of items
+        """
+
+        if isinstance(queue_entry, list):
+            priority = 0
+        elif isinstance(queue_entry, tuple):
+            priority = 1
+        else:
+            query_params = self.get_item_config(queue_entry).get('query_params') or {}
+            priority = QUEUE_PRIORITY.get(query_params.get('timeframe'), QUEUE_PRIORITY_DEFAULT)
+
+        with self._queue_lock:
+            self.item_queue_seq += 1
+            seq = self.item_queue_seq
+            if isinstance(queue_entry, list):
+                self._planner_pending.add(seq)
+        self.item_queue.put((priority, seq, queue_entry, time.time()))
+
+    def _wait_for_planner(self, seq: int) -> bool:
+        """
+        Wait until the item lists queued before the given queue entry are planned by the query planner
+
+        Items of a planned list must not be calculated before the planner has prefetched their query results.
+
+        :param seq: sequence number of the queue entry
+        :return: True, if the entry can be processed; False, if the plugin has been stopped meanwhile
+        """
+
+        with self._planner_done:
+            while any(pending < seq for pending in self._planner_pending):
+                if not self.alive:
+                    return False
+                self._planner_done.wait(1)
+        return True
+
+    def _stop_workers(self, timeout: float = 15) -> None:
+        """
+        Signal the workers to stop and wait until they have finished their current queue entry
+
+        :param timeout: maximum time in seconds to wait for all workers
+        """
+
+        with self._queue_lock:
+            for _ in self.workers:
+                self.item_queue_seq += 1
+                self.item_queue.put((-1, self.item_queue_seq, None, time.time()))
+            self._planner_done.notify_all()
+        end_time = time.time() + timeout
+        for name, worker in list(self.workers.items()):
+            thread = worker.get('thread')
+            if thread is None or thread is threading.current_thread():
+                continue
+            thread.join(max(0.0, end_time - time.time()))
+            if thread.is_alive():
+                self.logger.warning(f"{name} did not stop within {timeout}s.")
+
+    def _queue_entry_database_item(self, queue_entry) -> Union[Item, None]:
+        """
+        Get database item of a queue entry, to keep the order of processing per database item
+
+        :param queue_entry: item, tuple of (item, value) or list of items
+        :return: database item or None, if the entry does not refer to a database item
+        """
+
+        if isinstance(queue_entry, list):
+            return
+        if isinstance(queue_entry, tuple):
+            return queue_entry[0]
+        database_item = self.get_item_config(queue_entry).get('database_item')
+        return database_item if isinstance(database_item, Item) else None
+
+    def _set_active_queue_item(self, name: str, item_path: str) -> None:
+        """Set item currently processed by worker"""
+
+        self.workers[name]['active'] = item_path
+        active = [worker['active'] for worker in self.workers.values() if worker['active'] != '-']
+        self.active_queue_item = ', '.join(active) if active else '-'
+
+    def worker_utilization(self) -> dict:
+        """Get utilization (in percent) of the workers since their start"""
+
+        now = time.time()
+        return {name: round(100 * worker['busy_time'] / max(now - worker['start_time'], 1), 1) for name, worker in self.workers.items()}
 
     def work_update_item_delay_deque(self):
         """check if entries in update_item_delay_deque are due, if so put it to working queue"""
@@ -982,9 +1176,9 @@ class DatabaseAddOn(SmartPlugin):
         while self.update_item_delay_deque:
             update_time = self.update_item_delay_deque[0][2]
             if update_time <= int(time.time()):
-                [item, value, *_] = self.update_item_delay_deque.popleft()
+                [item, value, _, change_time] = self.update_item_delay_deque.popleft()
                 self.logger.info(f"+ Updated item '{item.property.path}' with value {item()} is now due to be put to queue for processing. {self.item_queue.qsize() + 1} items to do.")
-                self.item_queue.put((item, value))
+                self._put_queue_entry((item, value, change_time))
             else:
                 self.logger.debug(f"Remaining {len(self.update_item_delay_deque)} items in deque are not due, yet.")
                 break
@@ -1084,12 +1278,16 @@ class DatabaseAddOn(SmartPlugin):
         item_config.update({'value': result})
         item(result, self.get_shortname())
 
-    def handle_onchange(self, updated_item: Item, value: float) -> None:
+    def handle_onchange(self, updated_item: Item, value: float, change_time: int = None) -> None:
         """
         Get item and item value for which an update has been detected, fill cache dicts and set item value.
 
+        In streaming mode (plugin parameter 'onchange_streaming') the values are maintained from the updates only; the
+        database is queried once per period to initialize the cache dicts.
+
         :param updated_item: Item which has been updated
         :param value: Value of updated item
+        :param change_time: time of update as timestamp in ms
         """
 
         def handle_minmax():
@@ -1121,23 +1319,26 @@ class DatabaseAddOn(SmartPlugin):
 
             # if value not given
             if init:
+                # in streaming mode, include the updated value, which may not be in the database yet
+                if self.onchange_streaming:
+                    cached_value = min(cached_value, value) if func == 'min' else max(cached_value, value)
                 if self.debug_log.onchange:
                     self.logger.debug(f"initial {func} value for {timeframe=} of item={item.property.path} with will be set to {cached_value}")
-                cache_dict[database_item][func] = cached_value
+                self._store_current_value(timeframe, database_item, func, cached_value)
                 return cached_value
 
             # check value for update of cache dict min
             elif func == 'min' and value < cached_value:
                 if self.debug_log.onchange:
                     self.logger.debug(f"new value={value} lower then current min_value={cached_value} for {timeframe=}. cache_dict will be updated")
-                cache_dict[database_item][func] = value
+                self._store_current_value(timeframe, database_item, func, value)
                 return value
 
             # check value for update of cache dict max
             elif func == 'max' and value > cached_value:
                 if self.debug_log.onchange:
                     self.logger.debug(f"new value={value} higher then current max_value={cached_value} for {timeframe=}. cache_dict will be updated")
-                cache_dict[database_item][func] = value
+                self._store_current_value(timeframe, database_item, func, value)
                 return value
 
             # no impact
@@ -1165,7 +1366,7 @@ class DatabaseAddOn(SmartPlugin):
                     self.logger.info(f"Most recent value for last {timeframe} of item={updated_item.property.path} not available in database. Abort calculation.")
                     return
 
-                cache_dict[database_item] = cached_value
+                self._store_previous_value(timeframe, database_item, cached_value)
                 if self.debug_log.onchange:
                     self.logger.debug(f"Value for Item={updated_item.property.path} at end of last {timeframe} not in cache dict. Value={cached_value} has been added.")
 
@@ -1173,7 +1374,33 @@ class DatabaseAddOn(SmartPlugin):
             _new_value = value - cached_value
             return _new_value if isinstance(_new_value, int) else round(_new_value, 2)
 
+        def handle_mean():
+            cached_values = self.current_values[timeframe].get(database_item) or {}
+            state = {key: cached_values.get(key) for key in ('integral', 'integral_start', 'integral_time', 'integral_value')}
+
+            # get state of time-weighted mean; if not already cached, query database once per period
+            if state['integral_time'] is None:
+                if self.debug_log.onchange:
+                    self.logger.debug(f"State of mean for {timeframe=} of item={updated_item.property.path} not in cache dict. Query database.")
+                state = self._query_mean_state(database_item, timeframe, ignore_value_list)
+                if state is None:
+                    state = {'integral': 0, 'integral_start': change_time, 'integral_time': change_time, 'integral_value': value}
+
+            # add previous value weighted by its age and continue with updated value
+            if change_time > state['integral_time']:
+                state['integral'] += state['integral_value'] * (change_time - state['integral_time'])
+                state['integral_time'] = change_time
+                state['integral_value'] = value
+
+            self._store_current_values(timeframe, database_item, state)
+
+            duration = state['integral_time'] - state['integral_start']
+            return round(state['integral'] / duration if duration > 0 else state['integral_value'], 2)
+
         def handle_tagesmittel():
+            if self.onchange_streaming:
+                return handle_mean()
+
             result = self._prepare_value_list(database_item=database_item, timeframe='day', start=0, end=0, ignore_value_list=ignore_value_list, data_con_func='first_hour')
 
             if isinstance(result, list):
@@ -1182,6 +1409,9 @@ class DatabaseAddOn(SmartPlugin):
         if self.debug_log.onchange:
             self.logger.debug(f"called with updated_item={updated_item.property.path} and value={value}.")
 
+        if change_time is None:
+            change_time = int(time.time() * 1000)
+
         relevant_item_list = set(self.get_item_list('database_item', updated_item)) & set(self.get_item_list('on', 'change'))
 
         if self.debug_log.onchange:
@@ -1204,6 +1434,12 @@ class DatabaseAddOn(SmartPlugin):
                     self.logger.debug(f"non onchange function detected. Skip update.")
                 continue
 
+            # in streaming mode, values are not filtered by database query; ignore them here
+            if self.onchange_streaming and not value_passes_filter(value, ignore_value_list):
+                if self.debug_log.onchange:
+                    self.logger.debug(f"{value=} is ignored due to {ignore_value_list=}. Skip update.")
+                continue
+
             # handle minmax onchange items tagesmitteltemperatur_heute, minmax_heute_avg
             if db_addon_fct in TAGESMITTEL_ATTRIBUTES_ONCHANGE:
                 new_value = handle_tagesmittel()
@@ -1267,7 +1503,7 @@ class DatabaseAddOn(SmartPlugin):
         return self.logger.getEffectiveLevel()
 
     def queue_backlog(self) -> int:
-        return self.item_queue.qsize()
+        return self.item_queue.qsize() + sum(len(entries) for entries in self._deferred_entries.values())
 
     def db_version(self) -> str:
         return self._get_db_version()
@@ -1506,6 +1742,37 @@ class DatabaseAddOn(SmartPlugin):
 
         return self._fetchall(query, params)
 
+    def benchmark_serie(self, item_path: str, func: str = 'verbrauch', timeframe: str = 'day', start: int = 30, runs: int = 3) -> Union[dict, None]:
+        """
+        Compare the calculation of a consumption / meter reading series with one database query against single queries per period
+
+        :param item_path: item str of the database item
+        :param func: series to be calculated ('verbrauch' or 'zaehlerstand')
+        :param timeframe: time increment of the series (hour, day, week, month, year)
+        :param start: number of periods of the series
+        :param runs: number of runs per variant
+
+        :return: dict with average duration in ms per variant and whether the results are identical
+        """
+
+        item = self.items.return_item(item_path)
+        if item is None or func not in ('verbrauch', 'zaehlerstand'):
+            return
+
+        variants = {'query': self._handle_verbrauch_serie, 'loop': self._handle_verbrauch_serie_loop}
+        if func == 'zaehlerstand':
+            variants = {'query': self._handle_zaehlerstand_serie, 'loop': self._handle_zaehlerstand_serie_loop}
+
+        results = {}
+        durations = {}
+        for variant, method in variants.items():
+            _start = time.perf_counter()
+            for _ in range(max(1, runs)):
+                results[variant] = method({'database_item': item, 'timeframe': timeframe, 'start': start})
+            durations[variant] = round((time.perf_counter() - _start) * 1000 / max(1, runs), 1)
+
+        return {'duration_query': durations['query'], 'duration_loop': durations['loop'], 'identical': results['query'] == results['loop']}
+
     ##############################################
     #   Calculation methods / Using Item Object
     ##############################################
@@ -1574,43 +1841,49 @@ class DatabaseAddOn(SmartPlugin):
         return consumption
 
     def _handle_verbrauch_serie(self, query_params: dict) -> list:
-        """Ermittlung einer Serie von Verbräuchen in einem Zeitraum für x Zeiträume"""
+        """Ermittlung einer Serie von Verbräuchen in einem Zeitraum für x Zeiträume mit einer Datenbankabfrage"""
 
-        series = []
         database_item = query_params['database_item']
         timeframe = query_params['timeframe']
         start = query_params['start']
 
+        # same timeframes as _handle_verbrauch for each period: end value per 'last', start value per 'next'
+        queries = []
         for i in range(start, 1, -1):
-            value = self._handle_verbrauch({'database_item': database_item, 'timeframe': timeframe, 'start': i + 1, 'end': i})
+            queries.append(('last', *self._get_start_end_as_timestamp(timeframe, i + 1, i)))
+            queries.append(('next', *self._get_start_end_as_timestamp(timeframe, i + 1, i + 1)))
+
+        values = self._query_item_last_values(database_item, timeframe, queries)
+        if values is None:
+            return self._handle_verbrauch_serie_loop(query_params)
+
+        series = []
+        for i, value_end, value_start in zip(range(start, 1, -1), values[0::2], values[1::2]):
+            if value_end is None or value_end == 0:
+                value = value_end
+            else:
+                value = value_end - (value_start or 0)
+                if isinstance(value, float):
+                    value = int(value) if value.is_integer() else round(value, 2)
             ts_start, ts_end = self._get_start_end_as_timestamp(timeframe, i, i + 1)
             series.append([ts_end, value])
 
         return series
 
-    def _handle_verbrauch_serie_new(self, query_params: dict) -> list:
-        """Ermittlung einer Serie von Verbräuchen in einem Zeitraum für x Zeiträume"""
+    def _handle_verbrauch_serie_loop(self, query_params: dict) -> list:
+        """Ermittlung einer Serie von Verbräuchen in einem Zeitraum für x Zeiträume mit Einzelabfragen je Zeitraum"""
 
-        # ToDo: Test method
-
-        query_params.update({'data_con_func': 'max_day', 'cache': True})
-        raw_data = self._prepare_value_list(**query_params)
-
-        new_dict = {k[0]: k[1:][0] for k in raw_data}
-        consumption_list = []
-        start_ts = min(new_dict)
-        start_val = new_dict[start_ts]
+        series = []
+        database_item = query_params['database_item']
+        timeframe = query_params['timeframe']
+        start = query_params['start']
 
-        for i in range(query_params['start']):
-            end_ts = int(start_ts + 24 * 60 * 60)
-            end_val = new_dict.get(end_ts, None)
-            if not end_val:
-                end_val = start_val
-            consumption_list.append([end_ts, round((end_val - start_val), 2)])
-            start_ts = end_ts
-            start_val = end_val
+        for i in range(start, 1, -1):
+            value = self._handle_verbrauch({'database_item': database_item, 'timeframe': timeframe, 'start': i + 1, 'end': i})
+            ts_start, ts_end = self._get_start_end_as_timestamp(timeframe, i, i + 1)
+            series.append([ts_end, value])
 
-        return consumption_list
+        return series
 
     def _handle_zaehlerstand(self, query_params: dict) -> Union[float, int, None]:
         """
@@ -1642,7 +1915,30 @@ class DatabaseAddOn(SmartPlugin):
         return last_value
 
     def _handle_zaehlerstand_serie(self, query_params: dict) -> list:
-        """Ermittlung einer Serie von Zählerständen zum Ende eines Zeitraumes für x Zeiträume"""
+        """Ermittlung einer Serie von Zählerständen zum Ende eines Zeitraumes für x Zeiträume mit einer Datenbankabfrage"""
+
+        database_item = query_params['database_item']
+        timeframe = query_params['timeframe']
+        start = query_params['start']
+
+        queries = [('next', *self._get_start_end_as_timestamp(timeframe, i, i)) for i in range(start, 1, -1)]
+
+        values = self._query_item_last_values(database_item, timeframe, queries)
+        if values is None:
+            return self._handle_zaehlerstand_serie_loop(query_params)
+
+        series = []
+        for (func, ts_start, ts_end), value in zip(queries, values):
+            if value is None:
+                value = 0
+            if isinstance(value, float):
+                value = int(value) if value.is_integer() else round(value, 2)
+            series.append([ts_start, value])
+
+        return series
+
+    def _handle_zaehlerstand_serie_loop(self, query_params: dict) -> list:
+        """Ermittlung einer Serie von Zählerständen zum Ende eines Zeitraumes für x Zeiträume mit Einzelabfragen je Zeitraum"""
 
         series = []
         database_item = query_params['database_item']
@@ -1656,29 +1952,30 @@ class DatabaseAddOn(SmartPlugin):
 
         return series
 
-    def _handle_zaehlerstand_serie_new(self, query_params: dict) -> list:
-        """Ermittlung einer Serie von Zählerständen zum Ende eines Zeitraumes für x Zeiträume"""
+    def _query_mean_state(self, database_item: Item, timeframe: str, ignore_value_list: list = None) -> Union[dict, None]:
+        """
+        Ermittlung des Zustandes für das zeitgewichtete Mittel der aktuellen Periode als Ausgangspunkt für die Fortschreibung aus den Item-Updates
 
-        # ToDo: Test method
+        Der Wert vor Beginn der Periode gilt ab Periodenbeginn, jeder weitere Wert bis zum nächsten Eintrag.
 
-        query_params.update({'data_con_func': 'max_day', 'cache': True})
-        raw_data = self._prepare_value_list(**query_params)
+        :return: dict with integral of values over time in ms, start, time and value of last entry
+        """
 
-        new_dict = {k[0]: k[1:][0] for k in raw_data}
-        zaehler_list = []
-        start_ts = min(new_dict)
-        start_val = new_dict[start_ts]
+        period_start = self._get_start_end_as_timestamp(timeframe, 0, 0)[0]
+        query_params = {'database_item': database_item, 'timeframe': timeframe, 'start': 0, 'end': 0, 'ignore_value_list': ignore_value_list, 'use_oldest_entry': True}
 
-        for i in range(query_params['start']):
-            end_ts = int(start_ts + 24 * 60 * 60)
-            end_val = new_dict.get(end_ts, None)
-            if not end_val:
-                end_val = start_val
-            zaehler_list.append([end_ts, round(end_val, 2)])
-            start_ts = end_ts
-            start_val = end_val
+        entries = []
+        previous = self._query_item(func='next', **query_params)
+        if previous[0][0] and previous[0][1] is not None:
+            entries.append([max(previous[0][0], period_start), previous[0][1]])
+        entries.extend(entry for entry in self._query_item(func='raw', **query_params) if entry[0] and entry[1] is not None)
 
-        return zaehler_list
+        if not entries:
+            return
+
+        entries.sort(key=lambda entry: entry[0])
+        integral = sum(value * (next_ts - ts) for (ts, value), (next_ts, _) in zip(entries, entries[1:]))
+        return {'integral': integral, 'integral_start': entries[0][0], 'integral_time': entries[-1][0], 'integral_value': entries[-1][1]}
 
     def _handle_temp_sums(self, func: str, database_item: Item, year: Union[int, str] = None, month: Union[int, str] = None, ignore_value_list: list = None, params: dict = None) -> Union[list, None]:
         """
@@ -2047,6 +2344,15 @@ class DatabaseAddOn(SmartPlugin):
             self.logger.debug(f"raw_data for {_query_params=} read from cache.")
             raw_data = self.value_list_raw_data[str(_query_params)]
 
+        # use vectorized concentration, if numpy is available; result is determined by the last concentration step
+        if NUMPY_ENABLED and _data_con1 and _block1:
+            _data_con, _block = (_data_con2, _block2) if _data_con2 and _block2 else (_data_con1, _block1)
+            result = self._concentrate_value_array(raw_data=raw_data, block=_block, option=_data_con)
+            if result is not None:
+                if self.debug_log.prepare:
+                    self.logger.debug(f"{_data_con=}, {_block=}, {result=}")
+                return result
+
         if _data_con1 and _block1:
             # create nested dict with values
             value_dict = _group_value_by_datetime_block(block=_block1)
@@ -2071,6 +2377,81 @@ class DatabaseAddOn(SmartPlugin):
 
         return result
 
+    def _concentrate_value_array(self, raw_data: list, block: str, option: str) -> Union[list, None]:
+        """
+        Vectorized variant of grouping and concentrating raw data per minute / hour / day (see _prepare_value_list)
+
+        :param raw_data:    database query result in format [[timestamp1, value1], [timestamp2, value2], ...]
+        :param block:       increment of datetime; 'min', 'hour' or 'day'
+        :param option:      concentration option; 'first', 'avg', 'minmax', 'min' or 'max'
+        :return:            list of list in format of database query result or None, if raw data can not be handled vectorized
+        """
+
+        if option not in ('first', 'avg', 'minmax', 'min', 'max'):
+            return []
+
+        try:
+            timestamps = np.array([entry[0] for entry in raw_data])
+            values = np.array([entry[1] for entry in raw_data], dtype=np.float64)
+        except (TypeError, ValueError, IndexError):
+            return
+
+        if timestamps.ndim != 1 or timestamps.dtype.kind not in 'iu' or np.isnan(values).any():
+            return
+
+        if not len(timestamps):
+            return []
+
+        # timestamps in seconds; timestamps with more than 10 digits are given in ms
+        timestamps = timestamps.astype(np.int64)
+        timestamps = np.where(timestamps >= 10 ** 10, timestamps // 1000, timestamps)
+
+        # local time in seconds with utc offset determined per hour
+        hours, hour_index = np.unique(timestamps // 3600, return_inverse=True)
+        offsets = np.array([int(self._timestamp_to_datetime(int(hour) * 3600).utcoffset().total_seconds()) for hour in hours], dtype=np.int64)
+        local = timestamps + offsets[hour_index.reshape(-1)]
+
+        # bucket keys as local time in seconds, truncated per block
+        increment = {'hour': 3600, 'day': 86400}.get(block, 60)
+        keys = local - local % increment
+
+        order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[order]
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(sorted_keys)) + 1))
+        ends = np.append(starts[1:], len(sorted_keys))
+
+        def _bucket_timestamp(ts) -> int:
+            # like _group_value_by_datetime_block: the first row of the bucket defines the timestamp (incl. fold at DST change)
+            if len(str(ts)) > 10:
+                ts = ts / 1000
+            dt = self._timestamp_to_datetime(ts).replace(second=0, microsecond=0, tzinfo=None)
+            if block == 'hour':
+                dt = dt.replace(minute=0)
+            if block == 'day':
+                dt = dt.replace(minute=0, hour=0)
+            return self._datetime_to_timestamp(dt)
+
+        _timestamps = [_bucket_timestamp(raw_data[i][0]) for i in order[starts].tolist()]
+
+        if option == 'first':
+            raw_values = [raw_data[i][1] for i in order[starts].tolist()]
+            return [[_timestamp, value] for _timestamp, value in zip(_timestamps, raw_values)]
+
+        if option == 'avg':
+            # summing up sequentially per bucket to get the same float result as summing up in python
+            value_list = [raw_data[i][1] for i in order.tolist()]
+            return [[_timestamp, round(sum(value_list[start:end]) / (end - start), 2)] for _timestamp, start, end in zip(_timestamps, starts.tolist(), ends.tolist())]
+
+        # rows of min / max value per bucket; lexsort is stable, so the first of equal values is taken like min() / max() do
+        mins = [raw_data[i][1] for i in np.lexsort((values, keys))[starts].tolist()]
+        maxs = [raw_data[i][1] for i in np.lexsort((-values, keys))[starts].tolist()]
+
+        if option == 'minmax':
+            return [[_timestamp, min_val, max_val] for _timestamp, min_val, max_val in zip(_timestamps, mins, maxs)]
+        if option == 'min':
+            return [[_timestamp, min_val] for _timestamp, min_val in zip(_timestamps, mins)]
+        return [[_timestamp, max_val] for _timestamp, max_val in zip(_timestamps, maxs)]
+
     ####################
     #   Support stuff
     ####################
@@ -2161,9 +2542,7 @@ class DatabaseAddOn(SmartPlugin):
             oldest_log = self._read_log_oldest(item_id)
 
             if isinstance(oldest_log, int):
-                if item not in self.item_cache:
-                    self.item_cache[item] = {}
-                self.item_cache[item]['oldest_log'] = oldest_log
+                self._store_item_cache(item, 'oldest_log', oldest_log)
 
         if self.debug_log.prepare:
             self.logger.debug(f"_get_oldest_log for item={item.property.path} = {oldest_log}")
@@ -2195,9 +2574,7 @@ class DatabaseAddOn(SmartPlugin):
                 oldest_entry = self._read_log_timestamp(item_id, oldest_log)
                 i += 1
                 if isinstance(oldest_entry, list) and isinstance(oldest_entry[0], tuple) and len(oldest_entry[0]) >= 4:
-                    if item not in self.item_cache:
-                        self.item_cache[item] = {}
-                    self.item_cache[item]['oldest_entry'] = oldest_entry
+                    self._store_item_cache(item, 'oldest_entry', oldest_entry)
                     _oldest_value = oldest_entry[0][4]
                     validity = True
                 elif i == 10:
@@ -2223,9 +2600,7 @@ class DatabaseAddOn(SmartPlugin):
             row = self._read_item_table(item_path=str(item.property.path))
             if row and len(row) > 0:
                 _item_id = int(row[0])
-                if item not in self.item_cache:
-                    self.item_cache[item] = {}
-                self.item_cache[item]['id'] = _item_id
+                self._store_item_cache(item, 'id', _item_id)
 
         return _item_id
 
@@ -2346,15 +2721,80 @@ class DatabaseAddOn(SmartPlugin):
 
         return result
 
-    def _init_cache_dicts(self) -> None:
+    def _query_item_last_values(self, database_item: Item, timeframe: str, queries: list) -> Union[list, None]:
+        """
+        Get the results of several 'last' / 'next' queries of an item with one database query
+
+        The checks of start and end are the same as in _query_item, so each value is identical to _query_item(func, ...)[0][1].
+
+        :param database_item: item object for which the query should be done
+        :param timeframe: time increment used for definition of the start / end timestamps
+        :param queries: list of tuples (func, ts_start, ts_end) with func being 'last' or 'next'
+        :return: list of values (None for errors, 0 for no-data in DB) or None, if the database query failed
+        """
+
+        if self.debug_log.prepare:
+            self.logger.debug(f"  called with item={database_item.property.path}, {timeframe=}, {queries=}")
+
+        if timeframe not in ALLOWED_QUERY_TIMEFRAMES:
+            self.logger.error(f"Requested {timeframe=} for item={database_item.property.path} not defined; Need to be 'year' or 'month' or 'week' or 'day' or 'hour''. Query cancelled.")
+            return [None] * len(queries)
+
+        oldest_log = self._get_oldest_log(database_item)
+        item_id = self._get_itemid(database_item)
+        if oldest_log is None or not item_id:
+            return [None] * len(queries)
+
+        # check start / end as done by _query_item and define timestamp, up to which the last entry is needed
+        checked_queries = []
+        for func, ts_start, ts_end in queries:
+            if ts_start is None:
+                ts_start = oldest_log
+            if ts_end is None or ts_start > ts_end or ts_end < oldest_log:
+                checked_queries.append(None)
+                continue
+            if ts_start < oldest_log:
+                if not self.use_oldest_entry:
+                    checked_queries.append(None)
+                    continue
+                ts_start = oldest_log
+            checked_queries.append((func, ts_start, ts_start if func == 'next' else ts_end))
+
+        timestamps = {query[2] for query in checked_queries if query}
+        last_entries = self._read_log_last_entries(item_id, timestamps) if timestamps else {}
+        if last_entries is None:
+            return
+
+        values = []
+        for query in checked_queries:
+            if query is None:
+                values.append(None)
+                continue
+            func, ts_start, ts_until = query
+            time, value = last_entries.get(ts_until, (None, None))
+            if time is None or value is None or (func == 'last' and time < ts_start):
+                values.append(0)
+            else:
+                values.append(round(value, 2) if isinstance(value, float) else value)
+
+        if self.debug_log.prepare:
+            self.logger.debug(f"  values for item={database_item.property.path}: {values}")
+
+        return values
+
+    def _init_cache_dicts(self, clear_store: bool = True) -> None:
         """
         init all cache dicts
+
+        :param clear_store: also remove all values from aggregate store
         """
 
         self.logger.info(f"All cache_dicts will be initiated.")
 
         self.item_cache = {}
 
+        self.cache_buckets = {timeframe: self._get_start_end_as_timestamp(timeframe, 0, 0)[0] for timeframe in (HOUR, DAY, WEEK, MONTH, YEAR)}
+
         self.current_values = {
             HOUR: {},
             DAY: {},
@@ -2373,6 +2813,10 @@ class DatabaseAddOn(SmartPlugin):
 
         self.value_list_raw_data = {}
 
+        if clear_store:
+            self._cache_store.delete_aggregates()
+            self._cache_store.delete_item_cache()
+
     def _clean_item_cache(self, item: Union[str, Item]) -> bool:
         """set cached values for item to None"""
 
@@ -2395,6 +2839,7 @@ class DatabaseAddOn(SmartPlugin):
                     if cached_item == database_item:
                         self.current_values[timeframe][cached_item] = {}
 
+            self._cache_store.delete_aggregates(database_item=database_item.property.path)
             return True
         return False
 
@@ -2405,6 +2850,8 @@ class DatabaseAddOn(SmartPlugin):
 
         self.logger.info(f"Working queue will be cleared. Calculation run will end.")
         self.item_queue.queue.clear()
+        with self._queue_lock:
+            self._deferred_entries = {}
 
     def _get_start_end_as_timestamp(self, timeframe: str, start: Union[int, str, None], end: Union[int, str, None]) -> tuple:
         """
@@ -2483,6 +2930,186 @@ class DatabaseAddOn(SmartPlugin):
         else:
             return False
 
+    ##############################
+    #   Query planner
+    ##############################
+
+    def _plan_queries(self, items: list) -> None:
+        """
+        Group the queries of the given on-demand items by database item and prefetch them
+
+        For each database item one query is done, which aggregates the log entries in buckets between the start and end
+        timestamps of all planned queries. The results of the single queries are derived from the buckets and used by
+        _query_log_timestamp instead of querying the database.
+
+        :param items: list of items, which will be calculated
+        """
+
+        groups = {}
+        for item in items:
+            if not isinstance(item, Item):
+                continue
+            for func, database_item, timeframe, start, end, ignore_value_list in self._planned_queries(item):
+                ts_start, ts_end = self._get_start_end_as_timestamp(timeframe, start, end)
+                if ts_start is None or ts_end is None or ts_start > ts_end:
+                    continue
+                item_id = self._get_itemid(database_item)
+                if not item_id:
+                    continue
+                ignore_key = tuple(ignore_value_list) if ignore_value_list else ()
+                groups.setdefault((item_id, ignore_key), set()).add((func, ts_start, None if func == 'next' else ts_end))
+
+        planned = 0
+        for (item_id, ignore_key), queries in groups.items():
+            if len(queries) < 2:
+                continue
+            results = self._query_planned_group(item_id, queries, list(ignore_key))
+            if results is None:
+                continue
+            with self._planner_lock:
+                self.planned_results.setdefault(item_id, {}).update(results)
+            self.planner_stats['groups'] += 1
+            planned += len(results)
+
+        self.planner_stats['queries'] += planned
+        self.logger.info(f"Query planner prefetched {planned} query results for {len(groups)} database item(s).")
+
+    def _planned_queries(self, item: Item) -> list:
+        """
+        Get the queries, which handle_ondemand will do for the given item
+
+        :param item: item, which will be calculated
+        :return: list of tuples (func, database_item, timeframe, start, end, ignore_value_list)
+        """
+
+        item_config = self.get_item_config(item)
+        db_addon_fct = item_config.get('db_addon_fct')
+        database_item = item_config.get('database_item')
+        query_params = item_config.get('query_params')
+        if not isinstance(database_item, Item) or not query_params:
+            return []
+
+        timeframe = query_params.get('timeframe')
+        start = query_params.get('start')
+        end = query_params.get('end')
+        ignore_value_list = query_params.get('ignore_value_list')
+
+        queries = []
+        if db_addon_fct in ALL_VERBRAUCH_ATTRIBUTES and 'timedelta' not in query_params:
+            queries = [('last', start, end), ('next', start, start)]
+        elif db_addon_fct in ALL_ZAEHLERSTAND_ATTRIBUTES:
+            queries = [('next', start, end)]
+        elif db_addon_fct in HISTORIE_ATTRIBUTES_TIMEFRAME + HISTORIE_ATTRIBUTES_LAST and query_params.get('func') in ['min', 'max']:
+            queries = [(query_params['func'], start, end)]
+
+        return [(func, database_item, timeframe, _start, _end, ignore_value_list) for func, _start, _end in queries]
+
+    def _query_planned_group(self, item_id: int, queries: set, ignore_value_list: list = None) -> Union[dict, None]:
+        """
+        Query the log entries of a database item in buckets and derive the results of the planned queries
+
+        The bucket boundaries are the start and end timestamps of the planned queries, so the results are identical
+        to the results of the single queries done by _query_log_timestamp.
+
+        :param item_id: database item_id
+        :param queries: set of planned queries as tuples (func, ts_start, ts_end)
+        :param ignore_value_list: list of comparison operators for val_num, which will be applied during query
+        :return: dict of query key -> query result
+        """
+
+        # queries use 'BETWEEN ts_start AND ts_end' or 'time <= ts_start' ('next'), buckets are [boundary, next boundary)
+        boundaries = set()
+        for func, ts_start, ts_end in queries:
+            if func == 'next':
+                boundaries.add(ts_start + 1)
+            else:
+                boundaries.update([ts_start, ts_end + 1])
+        boundaries.add(min(boundaries) - self.planner_lookback)
+        boundaries = sorted(boundaries)
+
+        _bucket = 'CASE ' + ' '.join(f"WHEN time < {boundary} THEN {i} " for i, boundary in enumerate(boundaries[1:], 1)) + 'END'
+        _ignore = ''
+        if ignore_value_list:
+            for entry in ignore_value_list:
+                _ignore = f'{_ignore}AND val_num {entry.strip()} '
+        _where = f'item_id = :item_id AND time >= :ts_start AND time < :ts_end {_ignore}'
+
+        # time of the first min / max entry of a bucket, like the single min / max query returns it
+        _time_of = ("(SELECT MIN(time) FROM log WHERE item_id = :item_id AND time >= agg.time_min AND time <= agg.time_max "
+                    f"AND val_bool = 1 {_ignore}AND val_num = agg.{{}})")
+
+        query = ("SELECT agg.bucket, agg.time_min, agg.time_max, agg.value_min, agg.value_max, log.val_num, "
+                 f"{_time_of.format('value_min')}, {_time_of.format('value_max')} FROM "
+                 f"(SELECT {_bucket} AS bucket, MIN(time) AS time_min, MAX(time) AS time_max, "
+                 "MIN(CASE WHEN val_bool = 1 THEN val_num END) AS value_min, MAX(CASE WHEN val_bool = 1 THEN val_num END) AS value_max "
+                 f"FROM log WHERE {_where}GROUP BY bucket) AS agg "
+                 "JOIN log ON log.item_id = :item_id AND log.time = agg.time_max ORDER BY agg.bucket ASC")
+        params = {'item_id': item_id, 'ts_start': boundaries[0], 'ts_end': boundaries[-1]}
+
+        rows = self._fetchall(query, params)
+        if rows is None:
+            return
+
+        buckets = {row[0]: row[1:] for row in rows}
+        ignore_key = tuple(ignore_value_list) if ignore_value_list else ()
+
+        results = {}
+        for func, ts_start, ts_end in queries:
+            if func == 'next':
+                in_range = [buckets[i] for i in range(1, boundaries.index(ts_start + 1) + 1) if i in buckets]
+            else:
+                in_range = [buckets[i] for i in range(boundaries.index(ts_start) + 1, boundaries.index(ts_end + 1) + 1) if i in buckets]
+
+            if func in ['last', 'next']:
+                if in_range:
+                    result = [(in_range[-1][1], in_range[-1][4])]
+                elif func == 'next':
+                    # last entry is prior to the prefetched timeframe; the single query will be done
+                    continue
+                else:
+                    result = []
+            else:
+                index = 2 if func == 'min' else 3
+                values = [bucket for bucket in in_range if bucket[index] is not None]
+                if values:
+                    value = min(bucket[index] for bucket in values) if func == 'min' else max(bucket[index] for bucket in values)
+                    bucket = next(bucket for bucket in values if bucket[index] == value)
+                    result = [(bucket[index + 3], value)]
+                else:
+                    result = [(None, None)]
+
+            results[(func, ts_start, ts_end, ignore_key)] = result
+
+        return results
+
+    def _get_planned_result(self, func: str, item_id: int, ts_start: int, ts_end: int, ignore_value_list: list = None) -> Union[list, None]:
+        """
+        Get query result prefetched by the query planner
+
+        :return: query result or None, if not planned
+        """
+
+        key = (func, ts_start, None if func == 'next' else ts_end, tuple(ignore_value_list) if ignore_value_list else ())
+        with self._planner_lock:
+            result = self.planned_results.get(item_id, {}).get(key)
+        if result is None:
+            return
+        self.planner_stats['hits'] += 1
+        return list(result)
+
+    def _clear_planned_results(self, item: Item = None) -> None:
+        """
+        Clear query results prefetched by the query planner
+
+        :param item: database item, for which the results should be cleared; all results, if not given
+        """
+
+        with self._planner_lock:
+            if item is None:
+                self.planned_results = {}
+            else:
+                self.planned_results.pop(self.item_cache.get(item, {}).get('id'), None)
+
     #################################
     #   Database Query Preparation
     #################################
@@ -2619,6 +3246,14 @@ class DatabaseAddOn(SmartPlugin):
         if self.debug_log.prepare:
             self.logger.debug(f"{query=}, {params=}")
 
+        # use result prefetched by query planner, if available
+        if not group and not group2:
+            planned_result = self._get_planned_result(func, item_id, ts_start, ts_end, ignore_value_list)
+            if planned_result is not None:
+                if self.debug_log.prepare:
+                    self.logger.debug(f"Result taken from query planner: {planned_result}")
+                return planned_result
+
         # request database and return result
         return self._fetchall(query, params)
 
@@ -2648,6 +3283,33 @@ class DatabaseAddOn(SmartPlugin):
         result = self._fetchall(query, params)
         return None if result is None else result[0][0]
 
+    def _read_log_last_entries(self, item_id: int, timestamps: set) -> Union[dict, None]:
+        """
+        Read the last log record at or before each of the given timestamps for given database ID with one query
+
+        :param item_id: Database ID of item to read the records for
+        :param timestamps: timestamps, for which the last log record should be read
+        :return: dict of timestamp -> (time, val_num) of last log record; (None, None) if there is no record
+        """
+
+        # chunks of timestamps to stay within the limit of compound selects of sqlite
+        timestamps = sorted(timestamps)
+        chunks = [timestamps[i:i + 400] for i in range(0, len(timestamps), 400)]
+
+        result = {}
+        for chunk in chunks:
+            _boundaries = ' UNION ALL '.join(f"SELECT {int(timestamp)} AS ts" for timestamp in chunk)
+            query = ("SELECT boundary.ts, log.time, log.val_num FROM "
+                     f"(SELECT b.ts, (SELECT MAX(time) FROM log WHERE item_id = :item_id AND time <= b.ts) AS time_last FROM ({_boundaries}) AS b) AS boundary "
+                     "LEFT JOIN log ON log.item_id = :item_id AND log.time = boundary.time_last")
+            rows = self._fetchall(query, {'item_id': item_id})
+            if rows is None:
+                return
+            for ts, time, value in rows:
+                result[ts] = (time, value)
+
+        return result
+
     def _read_log_timestamp(self, item_id: int, timestamp: int) -> Union[list, None]:
         """
         Read database log record for given database ID
@@ -2711,6 +3373,15 @@ class DatabaseAddOn(SmartPlugin):
     #   Database specific stuff
     ###############################
 
+    def _get_db(self):
+        """
+        Get database object of the current worker
+
+        :return: database object of the worker; main database object, if not called by a worker
+        """
+
+        return getattr(self._worker_data, 'db', None) or self._db
+
     def _initialize_db(self) -> bool:
         """
         Initializes database connection
@@ -2718,14 +3389,15 @@ class DatabaseAddOn(SmartPlugin):
         :return: Status of initialization
         """
 
+        _db = self._get_db()
         try:
-            if not self._db.connected():
-                # limit connection requests to 20 seconds.
-                time_since_last_connect = time.time() - self.last_connect_time
+            if not _db.connected():
+                # limit connection requests of each database connection to 20 seconds.
+                time_since_last_connect = time.time() - self.last_connect_time.get(_db, 0)
                 if time_since_last_connect > 20:
-                    self.last_connect_time = time.time()
+                    self.last_connect_time[_db] = time.time()
                     self.logger.debug(f"Connect to database.")
-                    self._db.connect()
+                    _db.connect()
                 else:
                     self.logger.warning(f"Database reconnect suppressed since last connection is less then 20sec ago.")
                     return False
@@ -2740,19 +3412,19 @@ class DatabaseAddOn(SmartPlugin):
         if params is None:
             params = {}
 
-        return self._query(self._db.execute, query, params, cur)
+        return self._query(self._get_db().execute, query, params, cur)
 
     def _fetchone(self, query: str, params: dict = None, cur=None) -> list:
         if params is None:
             params = {}
 
-        return self._query(self._db.fetchone, query, params, cur)
+        return self._query(self._get_db().fetchone, query, params, cur)
 
     def _fetchall(self, query: str, params: dict = None, cur=None) -> list:
         if params is None:
             params = {}
 
-        tuples = self._query(self._db.fetchall, query, params, cur)
+        tuples = self._query(self._get_db().fetchall, query, params, cur)
         return None if tuples is None else list(tuples)
 
     def _query(self, fetch, query: str, params: dict = None, cur=None) -> Union[None, list]:
@@ -2767,20 +3439,21 @@ class DatabaseAddOn(SmartPlugin):
         if not self._initialize_db():
             return None
 
+        _db = self._get_db()
         if cur is None:
-            verify_conn = self._db.verify(retry=5)
+            verify_conn = _db.verify(retry=5)
             if verify_conn == 0:
                 self.logger.error("Connection to database NOT recovered.")
                 return None
 
-        if self.lock_db_for_query and not self._db.lock(300):
+        if self.lock_db_for_query and not _db.lock(300):
             self.logger.error("Can't query database due to fail to acquire lock.")
             return None
 
         query_readable = re.sub(r':([a-z_]+)', r'{\1}', query).format(**params)
 
         # do commit to get latest data during fetch
-        self._db.commit()
+        _db.commit()
 
         # fetch data
         try:
@@ -2791,7 +3464,7 @@ class DatabaseAddOn(SmartPlugin):
             pass
 
         if cur is None and self.lock_db_for_query:
-            self._db.release()
+            _db.release()
 
         if self.debug_log.sql:
             self.logger.debug(f"Result of query={query_readable}: {tuples}")
@@ -2868,6 +3541,119 @@ class DebugLogOptions:
             self.prepare = False
 
 
+class AggregateStore:
+    """
+    Persistent store for the cache dicts of the plugin in a sqlite file
+
+    Values are written on each change, so that they survive a crash. Each value belongs to a period, identified by the
+    start of the period as timestamp in ms (bucket). Only the values of the current periods are kept, the values of a
+    period are deleted at its end; the store does not hold aggregates of past periods.
+    """
+
+    def __init__(self, path: str, logger):
+        self.path = path
+        self.logger = logger
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def open(self) -> bool:
+        """open sqlite file and create tables, if not existing"""
+
+        if self._conn:
+            return True
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS aggregates (database_item TEXT NOT NULL, timeframe TEXT NOT NULL, bucket INTEGER NOT NULL, func TEXT NOT NULL, value, PRIMARY KEY (database_item, timeframe, func))")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS item_cache (item TEXT NOT NULL PRIMARY KEY, data TEXT)")
+        except (OSError, sqlite3.Error) as e:
+            self.logger.warning(f"Unable to open aggregate store '{self.path}': {e}")
+            self._conn = None
+            return False
+        self.logger.debug(f"Aggregate store '{self.path}' opened.")
+        return True
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn:
+                self._conn.close()
+                self._conn = None
+
+    def _execute(self, query: str, params=(), many: bool = False) -> Union[list, None]:
+        with self._lock:
+            if not self._conn:
+                return
+            try:
+                if many:
+                    self._conn.execute("BEGIN")
+                    self._conn.executemany(query, params)
+                    self._conn.execute("COMMIT")
+                    return []
+                return self._conn.execute(query, params).fetchall()
+            except sqlite3.Error as e:
+                self.logger.warning(f"Error at aggregate store with {query=}: {e}")
+                if self._conn.in_transaction:
+                    self._conn.execute("ROLLBACK")
+
+    def read_aggregates(self) -> Union[list, None]:
+        """return all stored values as list of (database_item, timeframe, bucket, func, value)"""
+
+        return self._execute("SELECT database_item, timeframe, bucket, func, value FROM aggregates")
+
+    def write_aggregates(self, rows: list) -> None:
+        """write list of (database_item, timeframe, bucket, func, value)"""
+
+        if rows:
+            self._execute("INSERT OR REPLACE INTO aggregates (database_item, timeframe, bucket, func, value) VALUES (?, ?, ?, ?, ?)", rows, many=True)
+
+    def delete_aggregates(self, timeframe: str = None, database_item: str = None, before: int = None) -> None:
+        """delete stored values; all, of given timeframe / database item or of periods before given bucket"""
+
+        _where = []
+        params = []
+        if timeframe is not None:
+            _where.append('timeframe = ?')
+            params.append(timeframe)
+        if database_item is not None:
+            _where.append('database_item = ?')
+            params.append(database_item)
+        if before is not None:
+            _where.append('bucket < ?')
+            params.append(before)
+        self._execute(f"DELETE FROM aggregates{' WHERE ' + ' AND '.join(_where) if _where else ''}", params)
+
+    def read_item_cache(self, max_age: int) -> dict:
+        """return stored item cache as dict of item path -> dict with id, oldest_log and oldest_entry; entries written more than max_age seconds ago are ignored"""
+
+        item_cache = {}
+        min_time = time.time() - max_age
+        for item, data in self._execute("SELECT item, data FROM item_cache") or []:
+            try:
+                data = json.loads(data)
+            except ValueError:
+                continue
+            if data.pop('time', 0) < min_time:
+                continue
+            if 'oldest_entry' in data:
+                data['oldest_entry'] = [tuple(entry) for entry in data['oldest_entry']]
+            item_cache[item] = data
+        return item_cache
+
+    def write_item_cache(self, item: str, data: dict) -> None:
+        """write item cache data of item together with the time of writing"""
+
+        try:
+            data = json.dumps({**data, 'time': int(time.time())})
+        except (TypeError, ValueError):
+            return
+        self._execute("INSERT OR REPLACE INTO item_cache (item, data) VALUES (?, ?)", (item, data))
+
+    def delete_item_cache(self) -> None:
+        self._execute("DELETE FROM item_cache")
+
+
 #######################
 #   Helper functions
 #######################
@@ -2987,6 +3773,18 @@ def to_int_float(arg):
         return to_float(arg)
 
 
+def value_passes_filter(value, ignore_value_list: list = None) -> bool:
+    """Check, if value fulfills all comparisons of ignore_value_list (e.g. ['!= 0', '> -50']), as done in database queries"""
+
+    operators = {'!=': operator.ne, '>=': operator.ge, '<=': operator.le, '>': operator.gt, '<': operator.lt}
+    for entry in ignore_value_list or []:
+        op, _, limit = entry.strip().partition(' ')
+        limit = to_int_float(limit)
+        if op in operators and limit is not None and not operators[op](value, limit):
+            return False
+    return True
+
+
 def timeframe_to_updatecyle(timeframe) -> str:
 
     lookup = {'day': 'daily',
@@ -3002,4 +3800,6 @@ def split_sting_letters_numbers(string) -> list:
 
 
 ALLOWED_QUERY_TIMEFRAMES = ['year', 'month', 'week', 'day', 'hour']
+QUEUE_PRIORITY = {'hour': 2, 'day': 3, 'week': 4, 'month': 5, 'year': 6}
+QUEUE_PRIORITY_DEFAULT = 7
 ALLOWED_MINMAX_FUNCS = ['min', 'max', 'avg']
@@ -0,0 +1,42 @@
+import datetime
+import types
+from zoneinfo import ZoneInfo
+
+
+TZ = ZoneInfo('Europe/Berlin')
+
+
+class Shtime:
+
+    def __init__(self, now=None):
+        self.now_dt = now
+
+    def now(self):
+        return self.now_dt
+
+    def tzinfo(self):
+        return TZ
+
+    def today(self, offset=0):
+        return self.now_dt.date() + datetime.timedelta(days=offset)
+
+    def beginning_of_week(self, offset=0):
+        date = self.now_dt.date()
+        return date - datetime.timedelta(days=date.weekday()) + datetime.timedelta(weeks=offset)
+
+    def beginning_of_month(self, offset=0):
+        return datetime.date(self.now_dt.year, self.now_dt.month, 1)
+
+    def beginning_of_year(self, offset=0):
+        return datetime.date(self.now_dt.year + offset, 1, 1)
+
+
+class Item:
+    """item with a path, which records the values set by the plugin"""
+
+    def __init__(self, path):
+        self.property = types.SimpleNamespace(path=path)
+        self.values = []
+
+    def __call__(self, value=None, caller=None):
+        self.values.append(value)
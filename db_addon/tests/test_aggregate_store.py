@@ -0,0 +1,103 @@
+import datetime
+import logging
+import os
+import tempfile
+import time
+import types
+import unittest
+from unittest import mock
+
+from plugins.db_addon import AggregateStore, DatabaseAddOn
+from plugins.db_addon.tests.base import TZ, Item, Shtime
+
+
+class TestAggregateStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'db_addon', 'db_addon_data.db')
+        self.logger = logging.getLogger(__name__)
+        self.items = {path: Item(path) for path in ('test.a', 'test.b')}
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def plugin(self, now):
+        plugin = DatabaseAddOn.__new__(DatabaseAddOn)
+        plugin.logger = self.logger
+        plugin.shtime = Shtime(now)
+        plugin.items = types.SimpleNamespace(return_item=self.items.get)
+        plugin.item_cache_validity_time = 600
+        plugin._cache_store = AggregateStore(self.path, self.logger)
+        plugin.init_cache_data()
+        return plugin
+
+    def test_reopen_after_close(self):
+        store = AggregateStore(self.path, self.logger)
+        self.assertTrue(store.open())
+        self.assertTrue(store.open())
+        store.write_aggregates([('test.a', 'day', 1000, 'max', 21.5)])
+        store.close()
+
+        # writes to a closed store are ignored
+        store.write_aggregates([('test.a', 'day', 1000, 'min', 3)])
+        self.assertIsNone(store.read_aggregates())
+
+        self.assertTrue(store.open())
+        self.assertEqual([('test.a', 'day', 1000, 'max', 21.5)], store.read_aggregates())
+        store.write_aggregates([('test.a', 'day', 1000, 'min', 3)])
+        store.close()
+
+        store = AggregateStore(self.path, self.logger)
+        self.assertTrue(store.open())
+        self.assertEqual(2, len(store.read_aggregates()))
+        store.close()
+
+    def test_values_survive_without_save(self):
+        now = datetime.datetime(2024, 4, 10, 13, 17, tzinfo=TZ)
+        plugin = self.plugin(now)
+        plugin._store_current_value('year', self.items['test.a'], 'max', 31.5)
+        plugin._store_current_value('day', self.items['test.a'], 'min', -3)
+        plugin._store_previous_value('month', self.items['test.b'], 1234.5)
+
+        # restart after a crash: save_cache_data has not been called
+        plugin = self.plugin(now)
+        self.assertEqual({'max': 31.5}, plugin.current_values['year'][self.items['test.a']])
+        self.assertEqual({'min': -3}, plugin.current_values['day'][self.items['test.a']])
+        self.assertEqual(1234.5, plugin.previous_values['month'][self.items['test.b']])
+
+    def test_values_of_past_periods_expire(self):
+        plugin = self.plugin(datetime.datetime(2024, 4, 10, 23, 50, tzinfo=TZ))
+        plugin._store_current_value('year', self.items['test.a'], 'max', 31.5)
+        plugin._store_current_value('day', self.items['test.a'], 'min', -3)
+        plugin._store_current_value('hour', self.items['test.a'], 'min', -2)
+        plugin.save_cache_data()
+
+        plugin = self.plugin(datetime.datetime(2024, 4, 11, 0, 10, tzinfo=TZ))
+        self.assertEqual({'max': 31.5}, plugin.current_values['year'][self.items['test.a']])
+        self.assertEqual({}, plugin.current_values['day'])
+        self.assertEqual({}, plugin.current_values['hour'])
+        # expired rows are removed from the store
+        self.assertEqual([('test.a', 'year', 'max')], [(row[0], row[1], row[3]) for row in plugin._cache_store.read_aggregates()])
+
+        plugin._reset_cache_timeframe('year')
+        self.assertEqual([], plugin._cache_store.read_aggregates())
+
+    def test_item_cache_validity(self):
+        now = datetime.datetime(2024, 4, 10, 13, 17, tzinfo=TZ)
+        plugin = self.plugin(now)
+        plugin._store_item_cache(self.items['test.a'], 'id', 7)
+        plugin._store_item_cache(self.items['test.a'], 'oldest_entry', [(1, 2, 3, None, 4.5, 1, 0)])
+        plugin.save_cache_data()
+
+        plugin = self.plugin(now)
+        self.assertEqual({'id': 7, 'oldest_entry': [(1, 2, 3, None, 4.5, 1, 0)]}, plugin.item_cache[self.items['test.a']])
+        plugin.save_cache_data()
+
+        with mock.patch('time.time', return_value=time.time() + 601):
+            plugin = self.plugin(now)
+        self.assertEqual({}, plugin.item_cache)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,201 @@
+import datetime
+import logging
+import os
+import queue
+import tempfile
+import threading
+import time
+import types
+import unittest
+
+from plugins.db_addon import AggregateStore, DatabaseAddOn
+from plugins.db_addon.tests.base import TZ, Item, Shtime
+
+
+class TestDatabaseAddOnOnchange(unittest.TestCase):
+
+    HOUR = 3600000
+    NOW = datetime.datetime(2024, 4, 10, 13, 0, tzinfo=TZ)
+    PERIOD_START = int(datetime.datetime(2024, 4, 10, tzinfo=TZ).timestamp()) * 1000
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.logger = logging.getLogger(__name__)
+        self.database_items = [Item('env.temperature'), Item('env.humidity')]
+        self.mean_items = {database_item: Item(f"{database_item.property.path}.mean") for database_item in self.database_items}
+        # (time, value) entries of the database items in the database
+        self.entries = {database_item: [] for database_item in self.database_items}
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def plugin(self, now):
+        item_config = {mean_item: {'db_addon_fct': 'tagesmitteltemperatur_heute', 'database_item': database_item, 'on': 'change',
+                                   'query_params': {'timeframe': 'day', 'ignore_value_list': None}}
+                       for database_item, mean_item in self.mean_items.items()}
+
+        plugin = DatabaseAddOn.__new__(DatabaseAddOn)
+        plugin.logger = self.logger
+        plugin.shtime = Shtime(now)
+        plugin.debug_log = types.SimpleNamespace(onchange=False)
+        plugin.onchange_streaming = True
+        plugin.get_shortname = lambda: 'db_addon'
+        plugin.get_item_config = item_config.get
+        plugin.get_item_list = lambda attr, value: [item for item, config in item_config.items() if config.get(attr) == value]
+        plugin._query_item = lambda func, database_item, timeframe, start=None, end=0, **kwargs: self.query(plugin, func, database_item, timeframe)
+        plugin.current_values = {'day': {}}
+        plugin.previous_values = {'day': {}}
+        plugin.cache_buckets = {'day': self.PERIOD_START}
+        plugin._cache_store = AggregateStore(os.path.join(self.tmpdir.name, f"{id(plugin)}.db"), self.logger)
+        plugin._cache_store.open()
+        self.addCleanup(plugin._cache_store.close)
+        return plugin
+
+    def query(self, plugin, func, database_item, timeframe):
+        """answer queries of _query_mean_state from the entries of the database item, [[0, 0]] for no data"""
+
+        period_start = plugin._get_start_end_as_timestamp(timeframe, 0, 0)[0]
+        now = int(plugin.shtime.now().timestamp()) * 1000
+        entries = sorted(self.entries[database_item])
+        if func == 'next':
+            previous = [entry for entry in entries if entry[0] < period_start]
+            return [list(previous[-1])] if previous else [[0, 0]]
+        if func == 'raw':
+            return [list(entry) for entry in entries if period_start <= entry[0] <= now] or [[0, 0]]
+        raise ValueError(func)
+
+    def start_workers(self, plugin, count):
+        plugin.alive = True
+        plugin.item_queue = queue.PriorityQueue()
+        plugin.item_queue_seq = 0
+        plugin.item_latency = {}
+        plugin.workers = {}
+        plugin.active_queue_item = '-'
+        plugin._worker_data = threading.local()
+        plugin._queue_lock = threading.Lock()
+        plugin._planner_done = threading.Condition(plugin._queue_lock)
+        plugin._planner_pending = set()
+        plugin._busy_database_items = set()
+        plugin._deferred_entries = {}
+        plugin._clear_planned_results = lambda item=None: None
+        threads = [threading.Thread(target=plugin.work_item_queue, args=(f"worker{i}",), daemon=True) for i in range(count)]
+        for thread in threads:
+            thread.start()
+        return threads
+
+    def test_updates_are_processed_in_order_per_database_item(self):
+        temperature, humidity = self.database_items
+        self.entries[temperature] = [(self.PERIOD_START - 2 * self.HOUR, 10)]
+        # the update at 3h is delivered late and arrives after the update at 4h
+        updates = [(temperature, 14, 2), (humidity, 60, 1), (temperature, 20, 4), (temperature, 17, 3), (humidity, 55, 5),
+                   (temperature, 11, 8), (humidity, 52, 6), (temperature, 11, 8), (temperature, 9, 10), (humidity, 70, 9)]
+        updates = [(database_item, value, self.PERIOD_START + hours * self.HOUR) for database_item, value, hours in updates]
+
+        expected = self.plugin(self.NOW)
+        for update in updates:
+            expected.handle_onchange(*update)
+        expected_values = {database_item: mean_item.values for database_item, mean_item in self.mean_items.items()}
+        for mean_item in self.mean_items.values():
+            mean_item.values = []
+
+        plugin = self.plugin(self.NOW)
+        processed = []
+        active = set()
+        overlaps = []
+        done = threading.Event()
+        handle_onchange = plugin.handle_onchange
+
+        def handle_onchange_slowly(updated_item, value, change_time):
+            if updated_item in active:
+                overlaps.append((updated_item, change_time))
+            active.add(updated_item)
+            time.sleep(0.02)
+            handle_onchange(updated_item, value, change_time)
+            processed.append((updated_item, value, change_time))
+            active.discard(updated_item)
+            if len(processed) == len(updates):
+                done.set()
+
+        plugin.handle_onchange = handle_onchange_slowly
+        threads = self.start_workers(plugin, 2)
+        for update in updates:
+            plugin._put_queue_entry(update)
+        self.assertTrue(done.wait(10))
+        plugin.alive = False
+        plugin._stop_workers(5)
+        self.assertFalse(any(thread.is_alive() for thread in threads))
+
+        self.assertEqual([], overlaps)
+        for database_item in self.database_items:
+            self.assertEqual([update for update in updates if update[0] is database_item],
+                             [update for update in processed if update[0] is database_item])
+            self.assertEqual(expected.current_values['day'][database_item], plugin.current_values['day'][database_item])
+            self.assertEqual(expected_values[database_item], self.mean_items[database_item].values)
+
+        # 10 from 0h, 14 from 2h, 20 from 4h (late 17 ignored), 11 from 8h, 9 from 10h
+        self.assertEqual({'integral': (10 * 2 + 14 * 2 + 20 * 4 + 11 * 2) * self.HOUR, 'integral_start': self.PERIOD_START,
+                          'integral_time': self.PERIOD_START + 10 * self.HOUR, 'integral_value': 9},
+                         plugin.current_values['day'][temperature])
+        self.assertEqual([10, 12, 12, 16, 16, 15], self.mean_items[temperature].values)
+
+    def test_mean_state_is_seeded_from_database(self):
+        temperature, humidity = self.database_items
+        self.entries[temperature] = [(self.PERIOD_START - 2 * self.HOUR, 10), (self.PERIOD_START + 2 * self.HOUR, 14), (self.PERIOD_START + 5 * self.HOUR, 20)]
+        plugin = self.plugin(self.NOW)
+
+        # the value before the period counts from the start of the period
+        self.assertEqual({'integral': (10 * 2 + 14 * 3) * self.HOUR, 'integral_start': self.PERIOD_START,
+                          'integral_time': self.PERIOD_START + 5 * self.HOUR, 'integral_value': 20},
+                         plugin._query_mean_state(temperature, 'day'))
+
+        plugin.handle_onchange(temperature, 11, self.PERIOD_START + 8 * self.HOUR)
+        self.assertEqual({'integral': (10 * 2 + 14 * 3 + 20 * 3) * self.HOUR, 'integral_start': self.PERIOD_START,
+                          'integral_time': self.PERIOD_START + 8 * self.HOUR, 'integral_value': 11},
+                         plugin.current_values['day'][temperature])
+        self.assertEqual([15.25], self.mean_items[temperature].values)
+
+        # an update already written to the database is not counted twice
+        self.entries[humidity] = [(self.PERIOD_START + 1 * self.HOUR, 40), (self.PERIOD_START + 3 * self.HOUR, 60)]
+        plugin.handle_onchange(humidity, 60, self.PERIOD_START + 3 * self.HOUR)
+        self.assertEqual([40], self.mean_items[humidity].values)
+
+    def test_mean_state_without_database_entries(self):
+        temperature = self.database_items[0]
+        plugin = self.plugin(self.NOW)
+        self.assertIsNone(plugin._query_mean_state(temperature, 'day'))
+
+        plugin.handle_onchange(temperature, 12, self.PERIOD_START + 6 * self.HOUR)
+        plugin.handle_onchange(temperature, 18, self.PERIOD_START + 9 * self.HOUR)
+        plugin.handle_onchange(temperature, 30, self.PERIOD_START + 10 * self.HOUR)
+        self.assertEqual([12, 12, 13.5], self.mean_items[temperature].values)
+
+    def test_mean_state_after_period_reset(self):
+        temperature = self.database_items[0]
+        self.entries[temperature] = [(self.PERIOD_START - 2 * self.HOUR, 10), (self.PERIOD_START + 2 * self.HOUR, 14)]
+        plugin = self.plugin(self.NOW)
+        plugin.handle_onchange(temperature, 20, self.PERIOD_START + 4 * self.HOUR)
+        self.assertEqual([12], self.mean_items[temperature].values)
+
+        # next day: the state of the last period is dropped and seeded again from the database
+        next_period_start = self.PERIOD_START + 24 * self.HOUR
+        self.entries[temperature] += [(self.PERIOD_START + 4 * self.HOUR, 20), (self.PERIOD_START + 20 * self.HOUR, 11),
+                                      (next_period_start + self.HOUR // 2, 13)]
+        plugin.shtime = Shtime(self.NOW + datetime.timedelta(days=1))
+        plugin._reset_cache_timeframe('day')
+        self.assertEqual({}, plugin.current_values['day'])
+        self.assertEqual(next_period_start, plugin.cache_buckets['day'])
+
+        plugin.handle_onchange(temperature, 17, next_period_start + self.HOUR)
+        self.assertEqual({'integral': (11 * 0.5 + 13 * 0.5) * self.HOUR, 'integral_start': next_period_start,
+                          'integral_time': next_period_start + self.HOUR, 'integral_value': 17},
+                         plugin.current_values['day'][temperature])
+        self.assertEqual([12, 12], self.mean_items[temperature].values)
+
+        # the state is persisted in the aggregate store for the new period only
+        stored = {(path, timeframe, bucket, func): value for path, timeframe, bucket, func, value in plugin._cache_store.read_aggregates()}
+        self.assertEqual(17, stored[('env.temperature', 'day', next_period_start, 'integral_value')])
+        self.assertEqual({next_period_start}, {key[2] for key in stored})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import logging
+import sqlite3
+import threading
+import types
+import unittest
+
+from plugins.db_addon import DatabaseAddOn
+
+
+class TestDatabaseAddOnQueryPlanner(unittest.TestCase):
+
+    HOUR = 3600 * 1000
+    DAY = 24 * HOUR
+    T0 = 1704067200000      # 2024-01-01 00:00 UTC
+
+    IGNORE_VALUE_LISTS = [None, ['!= 0'], ['> 3', '< 40']]
+
+    def setUp(self):
+        self.db = sqlite3.connect(':memory:')
+        self.db.execute("CREATE TABLE log (time BIGINT, item_id INTEGER, duration BIGINT, val_str TEXT, val_num REAL, val_bool BOOLEAN, changed BIGINT)")
+        self.db.execute("CREATE UNIQUE INDEX log_item_id_time ON log (item_id, time)")
+        # item 1: readings every 5 hours over 20 days (with zeros and repeated min/max values), item 2: no recent readings
+        rows = [(self.T0 + i * 5 * self.HOUR + (i % 7) * 60000, 1, (i * 17) % 50 if i % 9 else 0) for i in range(96)]
+        rows += [(self.T0 - 40 * self.DAY + i * self.HOUR, 2, float(i)) for i in range(10)]
+        self.db.executemany("INSERT INTO log (time, item_id, val_num, val_bool) VALUES (?, ?, ?, ?)",
+                            [(t, item_id, value, int(bool(value))) for t, item_id, value in rows])
+
+    def plugin(self):
+        plugin = DatabaseAddOn.__new__(DatabaseAddOn)
+        plugin.logger = logging.getLogger(__name__)
+        plugin.db_driver = 'sqlite3'
+        plugin.debug_log = types.SimpleNamespace(prepare=False)
+        plugin.planner_lookback = self.DAY
+        plugin.planned_results = {}
+        plugin.planner_stats = {'groups': 0, 'queries': 0, 'hits': 0}
+        plugin._planner_lock = threading.Lock()
+        plugin._fetchall = lambda query, params=None: self.db.execute(query, params or {}).fetchall()
+        return plugin
+
+    def queries(self):
+        queries = set()
+        for day in range(0, 22, 3):
+            start = self.T0 + day * self.DAY
+            end = start + 3 * self.DAY - 1
+            queries.update([('last', start, end), ('next', start, None), ('min', start, end), ('max', start, end)])
+        # longer ranges overlapping several buckets
+        queries.update([('min', self.T0, self.T0 + 20 * self.DAY), ('max', self.T0 + self.DAY, self.T0 + 9 * self.DAY)])
+        # 'next' before the first reading and far before the earliest planned timestamp (outside of planner_lookback)
+        queries.update([('next', self.T0 - self.DAY, None), ('next', self.T0 - 30 * self.DAY, None)])
+        return queries
+
+    def test_planned_results_are_identical_to_single_queries(self):
+        for item_id in [1, 2]:
+            for ignore_value_list in self.IGNORE_VALUE_LISTS:
+                with self.subTest(item_id=item_id, ignore_value_list=ignore_value_list):
+                    plugin = self.plugin()
+                    queries = self.queries()
+                    results = plugin._query_planned_group(item_id, queries, ignore_value_list)
+                    plugin.planned_results[item_id] = results
+                    for func, ts_start, ts_end in sorted(queries, key=str):
+                        single = self.plugin()._query_log_timestamp(func, item_id, ts_start, ts_end or ts_start, ignore_value_list=ignore_value_list)
+                        planned = plugin._query_log_timestamp(func, item_id, ts_start, ts_end or ts_start, ignore_value_list=ignore_value_list)
+                        self.assertEqual(single, planned, (func, ts_start, ts_end))
+                    # all planned results have been used instead of querying the database
+                    self.assertEqual(len(results), plugin.planner_stats['hits'])
+                    self.assertGreater(len(results), len(queries) // 2)
+
+    def test_next_outside_of_lookback_is_queried(self):
+        plugin = self.plugin()
+        ts_start = self.T0 + 10 * self.DAY
+        results = plugin._query_planned_group(2, {('next', ts_start, None), ('last', ts_start, ts_start + self.DAY)})
+        # the last reading of item 2 is 50 days before, outside of the prefetched timeframe: not planned
+        self.assertNotIn(('next', ts_start, None, ()), results)
+        plugin.planned_results[2] = results
+        self.assertEqual([(self.T0 - 40 * self.DAY + 9 * self.HOUR, 9.0)], plugin._query_log_timestamp('next', 2, ts_start, ts_start))
+        self.assertEqual(0, plugin.planner_stats['hits'])
+
+
+if __name__ == '__main__':
+    unittest.main()
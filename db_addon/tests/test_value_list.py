@@ -0,0 +1,55 @@
+import datetime
+import logging
+import types
+import unittest
+from unittest import mock
+
+from plugins.db_addon import DatabaseAddOn
+from plugins.db_addon.tests.base import Shtime
+
+
+class TestDatabaseAddOnValueList(unittest.TestCase):
+
+    DATA_CON_FUNCS = ['avg_day', 'avg_hour', 'first_day', 'first_hour', 'minmax_day', 'minmax_hour', 'min_day', 'min_hour',
+                      'max_day', 'max_hour', 'first_hour_avg_day', 'avg_hour_avg_day']
+
+    def plugin(self, raw_data):
+        plugin = DatabaseAddOn.__new__(DatabaseAddOn)
+        plugin.logger = logging.getLogger(__name__)
+        plugin.shtime = Shtime()
+        plugin.debug_log = types.SimpleNamespace(prepare=False)
+        plugin.value_list_raw_data = {}
+        plugin._query_item = lambda **kwargs: raw_data
+        return plugin
+
+    def value_list(self, raw_data, data_con_func, numpy):
+        database_item = types.SimpleNamespace(property=types.SimpleNamespace(path='test.value'))
+        with mock.patch('plugins.db_addon.NUMPY_ENABLED', numpy):
+            return self.plugin(raw_data)._prepare_value_list(database_item, 'day', 10, 0, data_con_func=data_con_func)
+
+    def raw_data(self, start, hours):
+        # readings every 20 minutes in ms, int and float values with duplicates within an hour
+        ts = int(datetime.datetime(*start, tzinfo=datetime.timezone.utc).timestamp())
+        return [[(ts + i * 1200) * 1000, (i * 7) % 13 if i % 2 else float((i * 5) % 11)] for i in range(hours * 3)]
+
+    def test_numpy_and_python_give_identical_results_over_dst_changes(self):
+        for start in [(2024, 3, 30, 12), (2024, 10, 26, 12)]:
+            raw_data = self.raw_data(start, 36)
+            for data_con_func in self.DATA_CON_FUNCS:
+                with self.subTest(start=start, data_con_func=data_con_func):
+                    expected = self.value_list(raw_data, data_con_func, numpy=False)
+                    result = self.value_list(raw_data, data_con_func, numpy=True)
+                    self.assertEqual(expected, result)
+                    self.assertEqual([[type(v) for v in entry] for entry in expected], [[type(v) for v in entry] for entry in result])
+
+    def test_hour_of_dst_fall_back(self):
+        # two readings at 2024-10-27 02:30 CET (second pass of 02:00 - 03:00)
+        raw_data = [[1729992600000, 21], [1729992660000, 20]]
+        for numpy in [False, True]:
+            with self.subTest(numpy=numpy):
+                self.assertEqual([[1729990800, 21]], self.value_list(raw_data, 'max_hour', numpy))
+                self.assertEqual([[1729990800, 20, 21]], self.value_list(raw_data, 'minmax_hour', numpy))
+
+
+if __name__ == '__main__':
+    unittest.main()
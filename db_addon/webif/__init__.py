@@ -120,6 +120,7 @@ class WebInterface(SmartPluginWebIf):
             data['maintenance'] = True if self.plugin.log_level == 10 else False
             data['queue_length'] = self.plugin.queue_backlog()
             data['active_queue_item'] = self.plugin.active_queue_item
+            data['worker_utilization'] = ', '.join(f"{name}: {utilization}%" for name, utilization in self.plugin.worker_utilization().items())
 
             data['debug_log'] = {}
             for debug in ['parse', 'execute', 'ondemand', 'onchange', 'prepare', 'sql']:
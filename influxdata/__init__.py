@@ -20,16 +20,17 @@
 #########################################################################
 
 import logging
-import socket
 import re
+import time
 from lib.model.smartplugin import SmartPlugin
+from plugins.influxdb.writer import UdpLineSender
 
 
 class InfluxData(SmartPlugin):
-    PLUGIN_VERSION = "1.0.0"
+    PLUGIN_VERSION = "1.0.1"
     ALLOW_MULTIINSTANCE = False
 
-    def __init__(self, smarthome, influx_host='localhost', influx_port=8089, influx_keyword='influx'):
+    def __init__(self, smarthome, influx_host='localhost', influx_port=8089, influx_keyword='influx', influx_max_datagram=1400, influx_flush_interval=0.2):
         self.logger = logging.getLogger(__name__)
         self.logger.info('Init InfluxData')
         self._sh = smarthome
@@ -37,6 +38,8 @@ class InfluxData(SmartPlugin):
         self.influx_port = influx_port
         self.influx_keyword = influx_keyword
         self._items = []
+        self._sender = UdpLineSender(influx_host, int(influx_port), max_datagram=int(influx_max_datagram),
+                                     flush_interval=float(influx_flush_interval), name='plugins.influxdata.udp', logger=self.logger)
 
     def cleanstring(self, s):
         s = re.sub(r"[^\w\s]", '', s)
@@ -44,24 +47,17 @@ class InfluxData(SmartPlugin):
         return s
 
     def run(self):
+        self._sender.start()
         self.alive = True
 
     def stop(self):
         self.alive = False
+        self._sender.stop()
 
     def udp(self, data):
-        try:
-            family, type, proto, canonname, sockaddr = socket.getaddrinfo(self.influx_host, self.influx_port)[0]
-            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            sock.sendto(data.encode(), (sockaddr[0], sockaddr[1]))
-            sock.close()
-            del sock
-        except Exception as e:
-            self.logger.warning(
-                "InfluxData: Problem sending data to {}:{}: {}".format(self.influx_host, self.influx_port, e))
-            pass
-        else:
-            self.logger.debug("InfluxData: Sending data to {}:{}: {}".format(self.influx_host, self.influx_port, data))
+        # several lines are sent in one datagram, so the time of the update has to be part of the line
+        self._sender.write("{} {}".format(data, time.time_ns()))
+        self.logger.debug("InfluxData: Sending data to {}:{}: {}".format(self.influx_host, self.influx_port, data))
 
     def parse_item(self, item):
         if self.influx_keyword in item.conf:
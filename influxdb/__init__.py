@@ -20,13 +20,14 @@
 #########################################################################
 
 import logging
-import socket
+import os
 import json
+import time
 from lib.model.smartplugin import SmartPlugin
-import requests
+from .writer import LineProtocolWriter, UdpLineSender
 
 class InfluxDB(SmartPlugin):
-    PLUGIN_VERSION = "1.0.3"
+    PLUGIN_VERSION = "1.0.4"
     ALLOW_MULTIINSTANCE = False
 
     def __init__(self, smarthome):
@@ -36,22 +37,49 @@ class InfluxDB(SmartPlugin):
 
         self.host = self.get_parameter_value('host')
         self.udp_port = self.get_parameter_value('udp_port')
+        self.udp_max_datagram = self.get_parameter_value('udp_max_datagram')
+        self.udp_flush_interval = self.get_parameter_value('udp_flush_interval')
         self.keyword = self.get_parameter_value('keyword')
         self.tags = self.get_parameter_value('tags')
         self.fields = self.get_parameter_value('fields')
         self.value_field = self.get_parameter_value('value_field')
         self.http_port = self.get_parameter_value('http_port')
         self.write_http = self.get_parameter_value('write_http')
+        self.http_batch_size = self.get_parameter_value('http_batch_size')
+        self.http_flush_interval = self.get_parameter_value('http_flush_interval')
+        self.http_queue_size = self.get_parameter_value('http_queue_size')
+        self.http_gzip = self.get_parameter_value('http_gzip')
 
         self.item_config = {}
         self.influxdb = 'smarthome'
 
+        # writer and sender are created here, so updates before run() are queued and sent once they are started
+        self.writer = None
+        self.udp_sender = None
+        if self.write_http:
+            url_string = 'http://{}:{}/write?db={}'.format(self.host, self.http_port, self.influxdb)
+            spill_file = '{}/var/plugin_data/{}/spill.lp'.format(os.getcwd(), self.get_shortname())
+            self.writer = LineProtocolWriter(url_string, batch_size=self.http_batch_size, flush_interval=self.http_flush_interval,
+                                             queue_size=self.http_queue_size, use_gzip=self.http_gzip, spill_file=spill_file,
+                                             name='plugins.' + self.get_fullname() + '.writer', logger=self.logger)
+        else:
+            self.udp_sender = UdpLineSender(self.host, self.udp_port, max_datagram=self.udp_max_datagram, flush_interval=self.udp_flush_interval,
+                                            name='plugins.' + self.get_fullname() + '.udp', logger=self.logger)
+
 
     def run(self):
+        if self.writer is not None:
+            self.writer.start()
+        if self.udp_sender is not None:
+            self.udp_sender.start()
         self.alive = True
 
     def stop(self):
         self.alive = False
+        if self.writer is not None:
+            self.writer.stop()
+        if self.udp_sender is not None:
+            self.udp_sender.stop()
 
     def parse_item(self, item):
         if self.keyword in item.conf or 'influxdb_name' in item.conf or 'influxdb_tags' in item.conf or 'influxdb_fields' in item.conf:
@@ -125,25 +153,12 @@ class InfluxDB(SmartPlugin):
         return None
 
     def send(self, data):
-        try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            sock.sendto(data.encode(), (self.host, self.udp_port))
-            sock.close()
-        except Exception as e:
-            self.logger.error("InfluxDB: failed sending UDP datagram [{}] to {}:{} with error: {}".format(data, self.host, self.udp_port, e))
-        else:
-            self.logger.debug("InfluxDB: sent UDP datagram [{}] to {}:{}".format(data, self.host, self.udp_port))
+        # several lines are sent in one datagram, so the time of the update has to be part of the line
+        self.udp_sender.write('{} {}'.format(data, time.time_ns()))
 
     def sendhttp( self, data ):
-        try:
-            url_string = 'http://{}:{}/write?db={}'.format( self.host, self.http_port, self.influxdb )
-            r = requests.post(url_string, data=data)
-            if( r.status_code != 204 ):
-                self.logger.error( "InfluxDB: request returns http {} [{}]".format(r.status_code, r.text))
-        except Exception as e:
-            self.logger.error("InfluxDB: failed sending HTTP datagram [{}] to {}:{} with error: {}".format(data, self.host, self.http_port, e))
-        else:
-            self.logger.debug("InfluxDB: sent HTTP datagram [{}] to {}:{}".format(data, self.host, self.http_port))
+        # lines are written in batches, so the time of the update has to be part of the line
+        self.writer.write('{} {}'.format(data, time.time_ns()))
 
     def create_line(self, name, tags, fields):
         # https://docs.influxdata.com/influxdb/v1.0/guides/writing_data/
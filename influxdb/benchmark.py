@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# vim: set encoding=utf-8 tabstop=4 softtabstop=4 shiftwidth=4 expandtab
+#########################################################################
+#  This file is part of SmartHomeNG.
+#
+#  SmartHomeNG is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  SmartHomeNG is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with SmartHomeNG. If not, see <http://www.gnu.org/licenses/>.
+#########################################################################
+
+"""
+Benchmark of the batched line protocol writer against one HTTP request per item update
+
+Starts a local stub HTTP server, which accepts line protocol like InfluxDB does, and measures the item updates per
+second, which can be written with both variants.
+
+Usage: python3 plugins/influxdb/benchmark.py [number of updates]
+"""
+
+import gzip
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+try:
+    from .writer import LineProtocolWriter
+except ImportError:
+    from writer import LineProtocolWriter
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    received = 0
+    lock = threading.Lock()
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        with StubHandler.lock:
+            StubHandler.received += body.count(b'\n') or 1
+        self.send_response(204)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def wait_received(count, timeout=60):
+    end = time.monotonic() + timeout
+    while StubHandler.received < count and time.monotonic() < end:
+        time.sleep(0.01)
+
+
+def line(i):
+    return f"root.some_item,caller=KNX,item=root.some_item value={i}.5 {time.time_ns()}"
+
+
+def benchmark_post(url, count):
+    StubHandler.received = 0
+    start = time.perf_counter()
+    for i in range(count):
+        requests.post(url, data=line(i))
+    wait_received(count)
+    return count / (time.perf_counter() - start)
+
+
+def benchmark_writer(url, count, use_gzip):
+    StubHandler.received = 0
+    writer = LineProtocolWriter(url, flush_interval=0.2, queue_size=count, use_gzip=use_gzip)
+    writer.start()
+    start = time.perf_counter()
+    for i in range(count):
+        writer.write(line(i))
+    queued = count / (time.perf_counter() - start)
+    wait_received(count)
+    written = count / (time.perf_counter() - start)
+    writer.stop()
+    return queued, written, writer.stats['requests']
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/write?db=smarthome"
+
+    post_count = min(count, 2000)
+    print(f"requests.post per update:   {benchmark_post(url, post_count):10.0f} updates/s ({post_count} updates)")
+    for use_gzip in (False, True):
+        queued, written, requests_count = benchmark_writer(url, count, use_gzip)
+        print(f"writer (gzip={use_gzip!s:5}):       {written:10.0f} updates/s written, {queued:10.0f} updates/s queued ({count} updates, {requests_count} requests)")
+
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
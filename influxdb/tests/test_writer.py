@@ -0,0 +1,170 @@
+import gzip
+import os
+import socket
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from plugins.influxdb.writer import LineProtocolWriter, UdpLineSender
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """accepts line protocol like InfluxDB does; answers with the status code of the server"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            if server.delay:
+                time.sleep(server.delay)
+            status = server.status
+            if status == 204:
+                server.lines.extend(body.decode().splitlines())
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestLineProtocolWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+        self.server.lock = threading.Lock()
+        self.server.requests = 0
+        self.server.lines = []
+        self.server.status = 204
+        self.server.delay = 0
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/write?db=test"
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.spill_file = os.path.join(self.tmpdir.name, 'spill.jsonl')
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmpdir.cleanup()
+
+    def writer(self, **kwargs):
+        kwargs.setdefault('flush_interval', 0.05)
+        kwargs.setdefault('spill_file', self.spill_file)
+        writer = LineProtocolWriter(self.url, **kwargs)
+        writer.backoff_start = 0.01
+        writer.backoff_max = 0.05
+        return writer
+
+    def wait_lines(self, count, timeout=10):
+        end = time.monotonic() + timeout
+        while len(self.server.lines) < count and time.monotonic() < end:
+            time.sleep(0.01)
+        return len(self.server.lines)
+
+    def test_write_in_batches(self):
+        writer = self.writer(batch_size=100, flush_interval=0.5)
+        writer.start()
+        for i in range(1000):
+            writer.write(f"m value={i}")
+        self.assertEqual(1000, self.wait_lines(1000))
+        writer.stop()
+        self.assertEqual([f"m value={i}" for i in range(1000)], self.server.lines)
+        self.assertLessEqual(self.server.requests, 20)
+        self.assertEqual(1000, writer.stats['lines'])
+
+    def test_write_before_start(self):
+        writer = self.writer()
+        writer.write("m value=1")
+        writer.write("m value=2")
+        writer.start()
+        self.assertEqual(2, self.wait_lines(2))
+        writer.stop()
+        self.assertEqual(["m value=1", "m value=2"], self.server.lines)
+
+    def test_flush_interval_zero_blocks_on_empty_queue(self):
+        writer = self.writer(flush_interval=0)
+        writer.start()
+        start = time.process_time()
+        time.sleep(0.5)
+        self.assertLess(time.process_time() - start, 0.2)
+        writer.write("m value=1")
+        self.assertEqual(1, self.wait_lines(1))
+        writer.stop()
+
+    def test_spill_replayed_under_steady_traffic(self):
+        writer = self.writer(batch_size=10, use_gzip=False)
+        writer.max_retries = 0
+        self.server.status = 503
+        writer.start()
+        for i in range(20):
+            writer.write(f"spilled value={i}")
+        end = time.monotonic() + 10
+        while writer.stats['spilled'] < 20 and time.monotonic() < end:
+            time.sleep(0.01)
+        self.assertEqual(20, writer.stats['spilled'])
+
+        # server is reachable again, new lines are written continuously
+        self.server.status = 204
+        i = 0
+        end = time.monotonic() + 10
+        while time.monotonic() < end and len([line for line in self.server.lines if line.startswith('spilled')]) < 20:
+            writer.write(f"live value={i}")
+            i += 1
+            time.sleep(0.005)
+        writer.stop()
+        spilled = [line for line in self.server.lines if line.startswith('spilled')]
+        self.assertEqual([f"spilled value={i}" for i in range(20)], spilled)
+        self.assertFalse(os.path.exists(self.spill_file))
+        self.assertFalse(os.path.exists(self.spill_file + '.replay'))
+
+    def test_stop_while_request_is_pending(self):
+        writer = self.writer()
+        writer.timeout = 2
+        self.server.delay = 0.5
+        writer.start()
+        writer.write("m value=1")
+        time.sleep(0.2)
+        writer.stop(timeout=0.1)
+        end = time.monotonic() + 5
+        while writer._thread is not None and writer._thread.is_alive() and time.monotonic() < end:
+            time.sleep(0.01)
+        self.assertEqual(["m value=1"], self.server.lines)
+        self.assertEqual(0, writer.stats['errors'])
+
+        # restart after the pending request is done
+        self.server.delay = 0
+        writer.start()
+        writer.write("m value=2")
+        self.assertEqual(2, self.wait_lines(2))
+        writer.stop()
+        self.assertEqual(["m value=1", "m value=2"], self.server.lines)
+
+
+class TestUdpLineSender(unittest.TestCase):
+
+    def setUp(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.settimeout(5)
+
+    def tearDown(self):
+        self.sock.close()
+
+    def test_write_before_start(self):
+        sender = UdpLineSender('127.0.0.1', self.sock.getsockname()[1], flush_interval=0.05)
+        sender.write("m value=1")
+        sender.write("m value=2")
+        sender.start()
+        self.assertEqual(b"m value=1\nm value=2", self.sock.recv(65535))
+        sender.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,461 @@
+#!/usr/bin/env python3
+# vim: set encoding=utf-8 tabstop=4 softtabstop=4 shiftwidth=4 expandtab
+#########################################################################
+#  This file is part of SmartHomeNG.
+#
+#  SmartHomeNG is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  SmartHomeNG is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with SmartHomeNG. If not, see <http://www.gnu.org/licenses/>.
+#########################################################################
+
+"""
+Batched writers for the InfluxDB line protocol
+
+LineProtocolWriter is used by the influxdb and influxdb2 plugins. Lines are put to a bounded queue and written by a
+background thread in batches via a persistent requests.Session. If the server is not reachable, batches are retried
+with backoff and lines, which do not fit into the queue anymore, are spilled to a file, which is written to the server
+again, as soon as it is reachable. Spilled lines are written batch by batch between the batches of new lines.
+
+UdpLineSender is used by the influxdata and influxdb plugins for writing via UDP. It packs as many lines as fit into
+one datagram and sends them through one connected socket.
+"""
+
+import gzip
+import json
+import logging
+import os
+import queue
+import socket
+import threading
+import time
+
+import requests
+
+
+class LineProtocolWriter:
+    """
+    Background writer for lines in InfluxDB line protocol
+
+    :param url: url to write to, e.g. 'http://localhost:8086/write?db=smarthome'
+    :param headers: additional http headers, e.g. for authorization
+    :param batch_size: max number of lines per request
+    :param batch_bytes: max size of the (uncompressed) request body in bytes
+    :param flush_interval: max time in seconds a line is waiting to be sent
+    :param queue_size: max number of lines waiting in memory; further lines are spilled to file
+    :param use_gzip: send request body gzip compressed
+    :param spill_file: file to spill lines to, if the queue is full; lines are dropped, if not given
+    :param name: name of the writer thread
+    :param logger: logger to use
+    """
+
+    max_retries = 3             # retries of a batch before it is spilled to file
+    backoff_start = 0.5         # first backoff time in seconds
+    backoff_max = 60            # max backoff time in seconds
+    timeout = 10                # timeout of http requests in seconds
+    idle_wait = 1.0             # max time in seconds the thread blocks on an empty queue (to check for stop and spilled lines)
+
+    def __init__(self, url, headers=None, batch_size=5000, batch_bytes=1000000, flush_interval=1.0, queue_size=100000, use_gzip=True, spill_file=None, name='LineProtocolWriter', logger=None):
+        self.url = url
+        self.headers = dict(headers or {})
+        self.batch_size = max(1, batch_size)
+        self.batch_bytes = batch_bytes
+        self.flush_interval = flush_interval
+        self.use_gzip = use_gzip
+        self.spill_file = spill_file
+        self.name = name
+        self.logger = logger or logging.getLogger(__name__)
+
+        self.headers['Content-Type'] = 'text/plain; charset=utf-8'
+        if self.use_gzip:
+            self.headers['Content-Encoding'] = 'gzip'
+
+        self._queue = queue.Queue(maxsize=max(1, queue_size))
+        self._session = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._spill_lock = threading.Lock()
+        self._replay_pos = 0
+        self._backoff = 0
+
+        self.stats = {'lines': 0, 'requests': 0, 'errors': 0, 'spilled': 0, 'dropped': 0}
+
+    def start(self):
+        """start writer thread"""
+
+        if self._thread is not None and self._thread.is_alive():
+            if not self._stop.is_set():
+                return
+            # thread of a previous stop is still finishing its last request
+            self._thread.join()
+        self._stop.clear()
+        self._session = requests.Session()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        """
+        stop writer thread after writing the queued lines; lines, which could not be written, are spilled to file
+
+        If the thread does not finish within timeout (e.g. while waiting for a slow server), it is left running until
+        its current request is done; it spills its batch, if the request fails, and closes the session itself.
+        """
+
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            if not self._thread.is_alive():
+                self._thread = None
+        # spill what is still queued
+        lines = self._get_queued_lines()
+        if lines:
+            self._spill(lines)
+        if self._thread is None:
+            self._compact_replay()
+
+    def write(self, line, url=None):
+        """
+        queue a line to be written; does not block
+
+        :param line: line in line protocol
+        :param url: url to write the line to, if different to the default url of the writer (e.g. other bucket)
+        """
+
+        try:
+            self._queue.put_nowait((url or self.url, line))
+        except queue.Full:
+            self._spill([(url or self.url, line)])
+
+    @property
+    def queue_length(self):
+        return self._queue.qsize()
+
+    def _run(self):
+        try:
+            while not self._stop.is_set() or not self._queue.empty():
+                batch = self._collect_batch()
+                if batch and not self._write_batch(batch):
+                    self._spill(batch)
+                    self._wait_backoff()
+                    continue
+                # write one batch of spilled lines after each batch of new lines, so they are written under steady traffic, too
+                if self._has_spill() and not self._stop.is_set():
+                    if not self._replay_spill():
+                        self._wait_backoff()
+        finally:
+            self._session.close()
+
+    def _collect_batch(self):
+        """collect lines until batch_size, batch_bytes or flush_interval (counted from the first line) is reached"""
+
+        batch = []
+        size = 0
+        deadline = None
+        while len(batch) < self.batch_size and size < self.batch_bytes:
+            try:
+                if self._stop.is_set():
+                    entry = self._queue.get_nowait()
+                elif not batch:
+                    # block until the first line arrives; wake up regularly to check for stop and spilled lines
+                    entry = self._queue.get(timeout=self.idle_wait)
+                else:
+                    timeout = deadline - time.monotonic()
+                    entry = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if deadline is None:
+                deadline = time.monotonic() + self.flush_interval
+            batch.append(entry)
+            size += len(entry[1]) + 1
+        return batch
+
+    def _write_batch(self, batch):
+        """write batch with retries; returns False, if the batch could not be written"""
+
+        by_url = {}
+        for url, line in batch:
+            by_url.setdefault(url, []).append(line)
+
+        for url, lines in by_url.items():
+            if not self._post(url, lines):
+                # keep order: all lines of the batch, which are not written yet, are treated as failed
+                written = set()
+                for written_url in by_url:
+                    if written_url == url:
+                        break
+                    written.add(written_url)
+                batch[:] = [entry for entry in batch if entry[0] not in written]
+                return False
+        return True
+
+    def _post(self, url, lines):
+        body = ('\n'.join(lines) + '\n').encode()
+        if self.use_gzip:
+            body = gzip.compress(body, compresslevel=5)
+
+        delay = self.backoff_start
+        for attempt in range(self.max_retries + 1):
+            try:
+                r = self._session.post(url, data=body, headers=self.headers, timeout=self.timeout)
+            except requests.RequestException as e:
+                self.logger.warning(f"{self.name}: Failed writing {len(lines)} line(s) to {url}: {e}")
+            else:
+                self.stats['requests'] += 1
+                if r.status_code in (200, 204):
+                    self.stats['lines'] += len(lines)
+                    self._backoff = 0
+                    return True
+                if 400 <= r.status_code < 500 and r.status_code not in (408, 429):
+                    # data is not accepted by the server, retrying would not help
+                    self.stats['errors'] += 1
+                    self.stats['dropped'] += len(lines)
+                    self.logger.error(f"{self.name}: Request returns http {r.status_code} [{r.text}], {len(lines)} line(s) dropped")
+                    return True
+                self.logger.warning(f"{self.name}: Request returns http {r.status_code} [{r.text}]")
+            self.stats['errors'] += 1
+            if attempt < self.max_retries and not self._stop.wait(delay):
+                delay *= 2
+            elif self._stop.is_set():
+                break
+        return False
+
+    def _wait_backoff(self):
+        self._backoff = min(self.backoff_max, max(self.backoff_start, self._backoff * 2))
+        self._stop.wait(self._backoff)
+
+    def _get_queued_lines(self):
+        lines = []
+        while True:
+            try:
+                lines.append(self._queue.get_nowait())
+            except queue.Empty:
+                return lines
+
+    def _has_spill(self):
+        return bool(self.spill_file) and (os.path.isfile(self.spill_file) or os.path.isfile(self.spill_file + '.replay'))
+
+    def _spill(self, entries):
+        """append lines to spill file; lines are dropped, if no spill file is configured"""
+
+        if not self.spill_file:
+            self.stats['dropped'] += len(entries)
+            self.logger.warning(f"{self.name}: {len(entries)} line(s) dropped")
+            return
+        try:
+            with self._spill_lock:
+                os.makedirs(os.path.dirname(self.spill_file), exist_ok=True)
+                with open(self.spill_file, 'a', encoding='utf-8') as f:
+                    f.writelines(json.dumps(entry) + '\n' for entry in entries)
+        except OSError as e:
+            self.stats['dropped'] += len(entries)
+            self.logger.error(f"{self.name}: Unable to spill {len(entries)} line(s) to '{self.spill_file}': {e}")
+        else:
+            self.stats['spilled'] += len(entries)
+
+    def _replay_spill(self):
+        """
+        write the next batch of spilled lines to the server; returns False, if they could not be written
+
+        The spill file is renamed to a replay file, which is read batch by batch from the position behind the last
+        written line. Lines spilled meanwhile are appended to a new spill file, which is replayed after the replay file.
+        """
+
+        replay_file = self.spill_file + '.replay'
+        with self._spill_lock:
+            if not os.path.isfile(replay_file):
+                if not os.path.isfile(self.spill_file):
+                    return True
+                os.replace(self.spill_file, replay_file)
+                self._replay_pos = 0
+                self.logger.info(f"{self.name}: Writing spilled lines from '{replay_file}'")
+
+        entries = []
+        positions = []      # position in the replay file behind each entry
+        pos = self._replay_pos
+        with open(replay_file, 'rb') as f:
+            f.seek(pos)
+            while len(entries) < self.batch_size:
+                row = f.readline()
+                if not row:
+                    break
+                pos = f.tell()
+                try:
+                    url, line = json.loads(row)
+                except ValueError:
+                    continue
+                entries.append((url, line))
+                positions.append(pos)
+            done = not f.readline()
+
+        batch = list(entries)
+        if batch and not self._write_batch(batch):
+            # _write_batch leaves the lines, which are not written, in the batch; skip the written lines, if they are
+            # the first lines of the batch (otherwise the whole batch is written again)
+            written = len(entries) - len(batch)
+            if written and entries[written:] == batch:
+                self._replay_pos = positions[written - 1]
+            return False
+
+        if done:
+            os.remove(replay_file)
+            self._replay_pos = 0
+        else:
+            self._replay_pos = pos
+        return True
+
+    def _compact_replay(self):
+        """remove the already written lines from the replay file, so they are not written again after a restart"""
+
+        replay_file = self.spill_file + '.replay' if self.spill_file else None
+        if not self._replay_pos or not replay_file or not os.path.isfile(replay_file):
+            return
+        try:
+            with open(replay_file, 'rb') as f:
+                f.seek(self._replay_pos)
+                rest = f.read()
+            with open(replay_file, 'wb') as f:
+                f.write(rest)
+        except OSError as e:
+            self.logger.error(f"{self.name}: Unable to compact '{replay_file}': {e}")
+        else:
+            self._replay_pos = 0
+
+
+class UdpLineSender:
+    """
+    Sender for lines in InfluxDB line protocol via UDP
+
+    Lines are collected and sent together in one datagram, as soon as the next line would exceed max_datagram bytes
+    or the oldest line is waiting for flush_interval seconds. The host is resolved once, when the socket is opened.
+
+    :param host: host of the InfluxDB UDP listener
+    :param port: port of the InfluxDB UDP listener
+    :param max_datagram: max size of a datagram in bytes (payload, should fit into the MTU of the network)
+    :param flush_interval: max time in seconds a line is waiting to be sent
+    :param name: name of the flush thread
+    :param logger: logger to use
+    """
+
+    max_udp_payload = 65507     # lines larger than this can not be sent at all
+
+    def __init__(self, host, port, max_datagram=1400, flush_interval=0.2, name='UdpLineSender', logger=None):
+        self.host = host
+        self.port = port
+        self.max_datagram = max(1, max_datagram)
+        self.flush_interval = flush_interval
+        self.name = name
+        self.logger = logger or logging.getLogger(__name__)
+
+        self._sock = None
+        self._buffer = []
+        self._buffer_size = 0
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+        self.stats = {'lines': 0, 'datagrams': 0, 'dropped': 0, 'oversized': 0}
+
+    def start(self):
+        """open socket and start flush thread"""
+
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        with self._lock:
+            self._open()
+        if self.flush_interval:
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """send buffered lines, stop flush thread and close socket"""
+
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        with self._lock:
+            self._flush()
+            self._close()
+
+    def write(self, line):
+        """
+        add a line to the current datagram; the datagram is sent, if the line does not fit into it anymore
+
+        :param line: line in line protocol
+        """
+
+        data = line.encode()
+        with self._lock:
+            if len(data) > self.max_datagram:
+                # does not fit into a datagram together with other lines, send it on its own
+                self.stats['oversized'] += 1
+                if len(data) > self.max_udp_payload:
+                    self.stats['dropped'] += 1
+                    self.logger.warning(f"{self.name}: Line with {len(data)} bytes is too large for UDP, dropped: {line[:100]}")
+                    return
+                self._flush()
+                self._send([data])
+                return
+            if self._buffer_size + len(data) > self.max_datagram:
+                self._flush()
+            self._buffer.append(data)
+            self._buffer_size += len(data) + 1
+            if not self.flush_interval:
+                self._flush()
+
+    def flush(self):
+        """send buffered lines"""
+
+        with self._lock:
+            self._flush()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def _flush(self):
+        if self._buffer:
+            lines = self._buffer
+            self._buffer = []
+            self._buffer_size = 0
+            self._send(lines)
+
+    def _send(self, lines):
+        if self._sock is None and not self._open():
+            self.stats['dropped'] += len(lines)
+            return
+        try:
+            self._sock.send(b'\n'.join(lines))
+        except OSError as e:
+            self.stats['dropped'] += len(lines)
+            self.logger.warning(f"{self.name}: Failed sending {len(lines)} line(s) to {self.host}:{self.port}: {e}")
+            # resolve host again with the next datagram
+            self._close()
+        else:
+            self.stats['lines'] += len(lines)
+            self.stats['datagrams'] += 1
+
+    def _open(self):
+        try:
+            family, type, proto, canonname, sockaddr = socket.getaddrinfo(self.host, self.port, type=socket.SOCK_DGRAM)[0]
+            self._sock = socket.socket(family, socket.SOCK_DGRAM)
+            self._sock.connect(sockaddr)
+        except OSError as e:
+            self.logger.warning(f"{self.name}: Unable to open UDP socket to {self.host}:{self.port}: {e}")
+            self._close()
+            return False
+        return True
+
+    def _close(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
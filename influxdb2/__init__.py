@@ -25,12 +25,14 @@
 #
 #########################################################################
 import ast
+import os
 
 import requests
 import json
 
 from lib.model.smartplugin import SmartPlugin
 from lib.item import Items
+from plugins.influxdb.writer import LineProtocolWriter
 
 from .webif import WebInterface
 
@@ -49,7 +51,7 @@ class InfluxDB2(SmartPlugin):
     are already available!
     """
 
-    PLUGIN_VERSION = '0.1.0'    # (must match the version specified in plugin.yaml), use '1.0.0' for your initial plugin Release
+    PLUGIN_VERSION = '0.1.2'    # (must match the version specified in plugin.yaml), use '1.0.0' for your initial plugin Release
 
     def __init__(self, sh):
         """
@@ -82,6 +84,13 @@ class InfluxDB2(SmartPlugin):
 
         self.str_value_field = self.get_parameter_value('str_value_field')
 
+        self.batch_size = self.get_parameter_value('batch_size')
+        self.flush_interval = self.get_parameter_value('flush_interval')
+        self.queue_size = self.get_parameter_value('queue_size')
+        self.use_gzip = self.get_parameter_value('use_gzip')
+        self.write_timestamp = self.get_parameter_value('write_timestamp')
+        self.writer = None
+
         # cycle time in seconds, only needed, if hardware/interface needs to be
         # polled for value changes by adding a scheduler entry in the run method of this plugin
         # (maybe you want to make it a plugin parameter?)
@@ -112,6 +121,13 @@ class InfluxDB2(SmartPlugin):
         # setup scheduler for device poll loop   (disable the following line, if you don't need to poll the device. Rember to comment the self_cycle statement in __init__ as well)
         self.scheduler_add('poll_device', self.poll_device, cycle=self._cycle)
 
+        # background writer for batched writing of item values
+        spill_file = f"{os.getcwd()}/var/plugin_data/{self.get_shortname()}/spill.lp"
+        self.writer = LineProtocolWriter(self._write_url(self.bucket), headers={'Authorization': 'Token ' + self.api_token},
+                                         batch_size=self.batch_size, flush_interval=self.flush_interval, queue_size=self.queue_size,
+                                         use_gzip=self.use_gzip, spill_file=spill_file, name=f"plugins.{self.get_fullname()}.writer", logger=self.logger)
+        self.writer.start()
+
         self.alive = True
         # if you need to create child threads, do not make them daemon = True!
         # They will not shutdown properly. (It's a python bug)
@@ -123,6 +139,8 @@ class InfluxDB2(SmartPlugin):
         self.logger.debug("Stop method called")
         self.scheduler_remove('poll_device')
         self.alive = False
+        if self.writer is not None:
+            self.writer.stop()
 
     def parse_item(self, item):
         """
@@ -178,6 +196,11 @@ class InfluxDB2(SmartPlugin):
                 except Exception as e:
                     self.logger.error(f"parse_item: Item {item.property.path} has invalid data in 'influxdb2_tags' attribute: {tags_json}, ast.literal_eval failed with: {e}")
 
+            # precompile the static parts of the line and the write url, they do not change between updates
+            config_data['numeric'] = item.type() in ['num', 'bool']
+            config_data['line_template'] = self.compile_line_template(item.property.path, config_data)
+            config_data['url'] = self._write_url(config_data['bucket'])
+
             # store plugin specific configuration information for this item
             self.add_pluginitem(item.property.path, config_data, device_command=None)
 
@@ -221,29 +244,18 @@ class InfluxDB2(SmartPlugin):
 
             config_data = self.get_pluginitem_configdata(item.property.path)
 
-            tags = {}
-            tags['caller'] = caller.replace(' ', '\ ')
-            if source is not None:
-                tags['source'] = source.replace(' ', '\ ')
-            if dest is not None:
-                tags['dest'] = dest.replace(' ', '\ ')
-            tags['item'] = item.property.path
-
-            tags.update(self.tags)                 # add global tag definitions to actual tags
-            if config_data.get('tags', None) is not None:
-                tags.update(config_data['tags'])   # add item specific tag definitions to actual tags
-
-            fields = {}
-            if item.type() in ['num', 'bool']:
-                fields[self.value_field] = float(item())
+            if config_data['numeric']:
+                value = float(item())
+                dynamic_tags = {'caller': caller, 'source': source, 'dest': dest}
             else:
-                fields[self.value_field] = 0
-                tags[self.str_value_field] = str(item())
-            #fields[self.str_value_field] = '"'+str(item())+'"'
+                value = 0
+                dynamic_tags = {'caller': caller, 'source': source, 'dest': dest, self.str_value_field: str(item())}
 
-            #line = self.create_line(name, tags, fields)
-            line = self.create_line(config_data['name'], tags, fields)
-            self.influx_writedata(config_data['bucket'], line)
+            line = self.create_line(config_data['line_template'], dynamic_tags, value)
+            if self.write_timestamp:
+                # lines are written in batches, so the time of the update has to be part of the line
+                line += f" {int(item.last_update().timestamp() * 1000000) * 1000}"
+            self.influx_writedata(config_data['bucket'], line, config_data['url'])
 
 
     def poll_device(self):
@@ -393,31 +405,68 @@ class InfluxDB2(SmartPlugin):
         return str
 
 
-    def create_line(self, name, tags, fields):
+    def escape_tag(self, value):
+        """
+        Escape a tag key or tag value for the line protocol
+        """
+        return str(value).replace(',', '\\,').replace('=', '\\=').replace(' ', '\\ ')
+
+
+    def compile_line_template(self, item_path, config_data):
+        """
+        Precompile the static parts (measurement name and static tags) of the lines of an item
+
+        Tags have to be sorted by key. The template is a list of (static_text, dynamic_tag_key) tuples, where
+        static_text contains the (escaped) static tags, which are sorted before dynamic_tag_key. The last tuple
+        has the static tags after the last dynamic tag and None as key.
+
+        :param item_path: path of the item
+        :param config_data: plugin specific configuration of the item
+
+        :return: line template
+        :rtype: list
+        """
+        static_tags = {'item': item_path}
+        static_tags.update(self.tags)                       # add global tag definitions
+        if config_data.get('tags', None) is not None:
+            static_tags.update(config_data['tags'])         # add item specific tag definitions
+
+        # caller, source and dest are overwritten by static tags, the string value overwrites static tags
+        dynamic_keys = {'caller', 'source', 'dest'} - static_tags.keys()
+        if not config_data['numeric']:
+            static_tags.pop(self.str_value_field, None)
+            dynamic_keys.add(self.str_value_field)
+
+        template = []
+        static_text = self.replace_unwanted_chars(config_data['name']).replace(',', '\\,')
+        for key in sorted(static_tags.keys() | dynamic_keys):
+            if key in dynamic_keys:
+                template.append((static_text, key))
+                static_text = ''
+            else:
+                static_text += f",{self.escape_tag(key)}={self.escape_tag(static_tags[key])}"
+        template.append((static_text, None))
+        return template
+
 
-        # build name and tags
-        name = self.replace_unwanted_chars(name)
-        kvs = [name]
-        for tag_key in sorted(tags.keys()):
-            k = tag_key
-            v = tags[tag_key]
-            # escape '=' in tag values
-            if v is not None:
-                v = v.replace("=", "\=")
-                v = v.replace(" ", "\ ")
-            kvs.append(f"{k}={v}")
-        line_tags = ','.join(kvs)
+    def create_line(self, line_template, dynamic_tags, value):
+        """
+        Create a line in line protocol from the precompiled template of an item
 
-        # build fields (which include the actual value)
-        kvs = []
-        for field_key in sorted(fields.keys()):
-            kvs.append("{k}={v}".format(k=field_key, v=fields[field_key]))
-        lineproto_fields = ','.join(kvs)
-        #if tags['item'].startswith('test') or name.startswith('Spann'):
-        #    self.logger.warning(f"create_line: {name} -> line_fields -> {lineproto_fields}")
-        #    self.logger.warning(f"create_line: {name} -> line_tags   -> {line_tags}")
+        :param line_template: template created by compile_line_template()
+        :param dynamic_tags: dict with the tags, which change with every update (caller, source, dest, string value)
+        :param value: value for the value field
 
-        return line_tags + ' ' + lineproto_fields
+        :return: line without timestamp
+        :rtype: str
+        """
+        parts = []
+        for static_text, key in line_template:
+            parts.append(static_text)
+            if key is not None and dynamic_tags.get(key) is not None:
+                parts.append(f",{key}={self.escape_tag(dynamic_tags[key])}")
+        parts.append(f" {self.value_field}={value}")
+        return ''.join(parts)
 
 
     def _url_base(self):
@@ -430,18 +479,24 @@ class InfluxDB2(SmartPlugin):
         return f"http://{self.host}:{self.http_port}"
 
 
-    def influx_writedata(self, bucket, data):
-        try:
-            url_string = self._url_base() + f"/api/v2/write?bucket={bucket}&org={self.org}"
-            r = requests.post(url_string, data=data, headers={'Authorization': 'Token '+self.api_token})
-            if(r.status_code != 204):
-                self.logger.error(f"Request returns http {r.status_code} [{r.text}]")
-        except Exception as e:
-            self.logger.error(f"Failed sending HTTP datagram [{data}] to {url_string} with error: {e}")
-        else:
-            #self.logger.debug(f"senthttp to {url_string} - Datagram [{data}] ")
-            #self.logger.debug(f"- r.text = {r.status_code} [{r.text}] ")
-            pass
+    def _write_url(self, bucket):
+        """
+        Build url for writing to the given bucket
+
+        :return: url string
+        :rtype: str
+        """
+        return self._url_base() + f"/api/v2/write?bucket={bucket}&org={self.org}"
+
+
+    def influx_writedata(self, bucket, data, url=None):
+        """
+        Queue data in line protocol to be written to the given bucket by the background writer
+        """
+        if self.writer is None:
+            self.logger.error(f"Writer not started, dropping datagram [{data}]")
+            return
+        self.writer.write(data, url or self._write_url(bucket))
 
 
     def gethttp(self, endpoint, data=None, auth=False):
@@ -33,6 +33,8 @@ from lib.item import Items
 import datetime
 import functools
 import os
+import threading
+import time
 
 try:
     import rrdtool
@@ -40,6 +42,12 @@ try:
 except:
     REQUIRED_PACKAGE_IMPORTED = False
 
+try:
+    import numpy as np
+    NUMPY_ENABLED = True
+except ImportError:
+    NUMPY_ENABLED = False
+
 
 
 class RRD(SmartPlugin):
@@ -50,7 +58,7 @@ class RRD(SmartPlugin):
     Documentation can be found at `<https://pythonhosted.org/rrdtool/>`_
     """
 
-    PLUGIN_VERSION = '1.6.2'
+    PLUGIN_VERSION = '1.6.3'
 
     def __init__(self, sh):
         """
@@ -79,6 +87,17 @@ class RRD(SmartPlugin):
 
         self._rrds = {}
         self.step = self.get_parameter_value('step')
+        self.rrdcached = self.get_parameter_value('rrdcached')
+        self.write_cycles = self.get_parameter_value('write_cycles')
+
+        # write-back journal: values per rrd file, which are not written yet
+        self._journal = {}
+        self._journal_last = {}
+        self._journal_lock = threading.Lock()
+
+        # fetched series data, valid until the next step of the rrd
+        self._series_cache = {}
+        self._series_cache_lock = threading.Lock()
 
         # Initialization code goes here
         if not REQUIRED_PACKAGE_IMPORTED:
@@ -110,6 +129,7 @@ class RRD(SmartPlugin):
         self.logger.debug("Stop method called")
         self.scheduler_remove('RRDtool')
         self.alive = False
+        self._flush()
 
     def parse_item(self, item):
         """
@@ -162,21 +182,76 @@ class RRD(SmartPlugin):
                 item.set(last, 'RRDtool')
 
     def _update_cycle(self):
+        timestamp = int(time.time())
         for itempath in self._rrds:
             rrd = self._rrds[itempath]
             if rrd['type'] == 'GAUGE':
-                value = 'N:' + str(float(rrd['item']()))
+                value = str(float(rrd['item']()))
             else:  # 'COUNTER'
-                value = 'N:' + str(int(rrd['step'] * rrd['item']()))
-            try:
-                rrdtool.update(
-                    rrd['rrdb'],
-                    value
-                )
-            except Exception as e:
-                self.logger.warning("RRD: error updating {}: {}".format(itempath, e))
+                value = str(int(rrd['step'] * rrd['item']()))
+
+            if self.rrdcached:
+                # rrdcached collects the updates and writes them in batches
+                self._update(itempath, rrd['rrdb'], ['N:' + value])
                 continue
 
+            with self._journal_lock:
+                if self._journal_last.get(rrd['rrdb'], 0) >= timestamp:
+                    # rrdtool rejects updates, which are not newer than the last one
+                    continue
+                self._journal_last[rrd['rrdb']] = timestamp
+                journal = self._journal.setdefault(rrd['rrdb'], [])
+                journal.append((timestamp, value))
+                if len(journal) < self.write_cycles:
+                    continue
+                self._journal[rrd['rrdb']] = []
+            self._update(itempath, rrd['rrdb'], ['{}:{}'.format(ts, v) for ts, v in journal])
+
+    def _update(self, itempath, rrdb, values):
+        """
+        Write values to a rrd file, several values are written with one call
+
+        :param itempath: path of the item (for logging)
+        :param rrdb: rrd file
+        :param values: list of values in rrdtool format 'timestamp:value'
+        """
+        args = [rrdb] + values
+        if self.rrdcached:
+            args = ['--daemon', self.rrdcached] + args
+        try:
+            rrdtool.update(*args)
+        except Exception as e:
+            self.logger.warning("RRD: error updating {}: {}".format(itempath, e))
+
+    def _flush(self, item=None):
+        """
+        Write the journaled values of an item or, if no item is given, of all items to the rrd files
+
+        Has to be called before reading a rrd file. If rrdcached is used, rrdtool.fetch() flushes the daemon.
+
+        :param item: path of the item
+        """
+        if item is None:
+            with self._journal_lock:
+                journals = self._journal
+                self._journal = {}
+        else:
+            rrdb = self._rrds[item]['rrdb']
+            with self._journal_lock:
+                journals = {rrdb: self._journal.pop(rrdb, [])}
+
+        for rrdb, journal in journals.items():
+            if journal:
+                self._update(item or rrdb, rrdb, ['{}:{}'.format(ts, v) for ts, v in journal])
+
+    def _fetch(self, query):
+        """
+        Fetch data from a rrd file, via rrdcached if configured
+        """
+        if self.rrdcached:
+            query = ['--daemon', self.rrdcached] + query
+        return rrdtool.fetch(*query)
+
 
     def parse_logic(self, logic):
         # no logics are supported
@@ -227,32 +302,103 @@ class RRD(SmartPlugin):
                 query.extend(['--end', "now-{}".format(end)])
         if step is not None:
             query.extend(['--resolution', step])
-        # run query
-        try:
-            meta, name, data = rrdtool.fetch(*query)
-        except Exception as e:
-            self.logger.warning("error reading {0} data: {1}".format(item, e))
-            return None
+
+        # run query, if the result is not cached since the last step of the rrd
+        now = time.time()
+        cache_key = tuple(query)
+        with self._series_cache_lock:
+            cached = self._series_cache.get(cache_key)
+        if cached is not None and cached[0] > now:
+            meta, data = cached[1], cached[2]
+        else:
+            self._flush(item)
+            try:
+                meta, name, data = self._fetch(query)
+            except Exception as e:
+                self.logger.warning("error reading {0} data: {1}".format(item, e))
+                return None
+            self._cache_series(cache_key, meta, data, (now // rrd['step'] + 1) * rrd['step'], now)
 
         # postprocess values
         if sid is None:
             sid = "{}|{}|{}|{}|{}".format(item,func,start,end,count)
         reply = {'cmd': 'series', 'series': None, 'sid': sid}
         istart, iend, istep = meta
-        mstart = istart * 1000
-        mstep = istep * 1000
-        # old way could have null values which need to be suppressed as visu could not handle null properly
-        # tuples = [(mstart + i * mstep, v) for i, v in enumerate(data)]
-        tuples = []
-        for i, v in enumerate(data):
-            if v[0] is not None:
-                tuples.append((mstart + i * mstep, v[0]))
-        reply['series'] = sorted(tuples)
+        try:
+            count = int(count)
+        except (TypeError, ValueError):
+            count = None
+        # null values are suppressed as visu could not handle null properly, data is already sorted by time
+        tuples = self._downsample(istart * 1000, istep * 1000, data, func, count)
+        reply['series'] = tuples
         reply['params'] = {'update': True, 'item': item, 'func': func, 'start': str(iend), 'end': str(iend + istep), 'step': str(istep), 'sid': sid}
         reply['update'] = self.get_sh().now() + datetime.timedelta(seconds=istep)
-        self.logger.warning("Returning series for {} from {} to {} with {} values".format(sid, iend, iend+istep, len(tuples) ))
+        self.logger.debug("Returning series for {} from {} to {} with {} values".format(sid, iend, iend+istep, len(tuples) ))
         return reply
 
+    def _cache_series(self, cache_key, meta, data, expires, now):
+        """
+        Store fetched data for a series query until it expires, remove expired entries
+
+        Series are requested from several threads (e.g. visu clients), so the cache is only accessed with the lock held.
+        """
+        if NUMPY_ENABLED:
+            # convert once, None becomes nan
+            data = np.array(data, dtype=float).reshape(len(data), -1)[:, 0] if len(data) else np.empty(0)
+        with self._series_cache_lock:
+            for key in [key for key, entry in self._series_cache.items() if entry[0] <= now]:
+                del self._series_cache[key]
+            self._series_cache[cache_key] = (expires, meta, data)
+
+    def _downsample(self, mstart, mstep, data, func, count):
+        """
+        Build a series of (timestamp in ms, value) tuples without null values from fetched data
+
+        If there are more rows than count, consecutive rows are consolidated to blocks, so that the
+        series has at most count values. The consolidation uses the function of the series (min, max or average)
+        and the timestamp of the first row of a block.
+
+        :param mstart: timestamp of the first row in ms
+        :param mstep: time between two rows in ms
+        :param data: fetched rows as list of tuples or, if numpy is installed, as array
+        :param func: consolidation function of the series
+        :param count: max number of values or None
+
+        :return: list of tuples
+        """
+        rows = len(data)
+        block = -(-rows // count) if count and count > 0 and rows > count else 1
+
+        if NUMPY_ENABLED:
+            values = np.asarray(data, dtype=float)
+            if not isinstance(data, np.ndarray):
+                values = values.reshape(rows, -1)[:, 0] if rows else np.empty(0)
+            pad = -rows % block
+            if pad:
+                values = np.concatenate([values, np.full(pad, np.nan)])
+            values = values.reshape(-1, block)
+            valid = ~np.isnan(values)
+            if func == 'max':
+                result = np.where(valid, values, -np.inf).max(axis=1)
+            elif func == 'min':
+                result = np.where(valid, values, np.inf).min(axis=1)
+            else:
+                counts = valid.sum(axis=1)
+                result = np.where(valid, values, 0).sum(axis=1) / np.maximum(counts, 1)
+            keep = valid.any(axis=1)
+            timestamps = mstart + np.arange(len(values), dtype=np.int64)[keep] * (block * mstep)
+            return list(zip(timestamps.tolist(), result[keep].tolist()))
+
+        if block == 1:
+            return [(mstart + i * mstep, v[0]) for i, v in enumerate(data) if v[0] is not None]
+        consolidate = {'max': max, 'min': min}.get(func, lambda block_values: sum(block_values) / len(block_values))
+        tuples = []
+        for i in range(0, rows, block):
+            block_values = [v[0] for v in data[i:i + block] if v[0] is not None]
+            if block_values:
+                tuples.append((mstart + i * mstep, consolidate(block_values)))
+        return tuples
+
     def _single(self, func, start='1d', end='now', item=None):
         """
         Reads a single value from rrd.
@@ -302,8 +448,9 @@ class RRD(SmartPlugin):
                 query.extend(['--end', "now-{}".format(end)])
 
         # execute query
+        self._flush(item)
         try:
-            meta, name, data = rrdtool.fetch(*query)
+            meta, name, data = self._fetch(query)
         except Exception as e:
             self.logger.warning("error reading {0} data: {1}".format(item, e))
             return None
@@ -33,10 +33,17 @@ import struct
 import ssl
 import struct
 import threading
+import time
 import socket
 
 import collections
 
+try:
+    import orjson
+    ORJSON_ENABLED = True
+except ImportError:
+    ORJSON_ENABLED = False
+
 import lib.connection
 from lib.item import Items
 from lib.logic import Logics
@@ -52,7 +59,7 @@ class WebSocket(SmartPlugin):
     the update functions for the items
     """
 
-    PLUGIN_VERSION = "1.5.3"
+    PLUGIN_VERSION = "1.5.4"
 
 
     def __init__(self, sh, *args, **kwargs):
@@ -83,6 +90,8 @@ class WebSocket(SmartPlugin):
         self.acl = self.get_parameter_value('acl')
         self.wsproto = self.get_parameter_value('wsproto')
         self.querydef = self.get_parameter_value('querydef')
+        self.send_interval = self.get_parameter_value('send_interval')
+        self.send_queue_limit = self.get_parameter_value('send_queue_limit')
 
         if self.acl in ('true', 'yes'):
             self.acl = 'rw'
@@ -104,7 +113,7 @@ class WebSocket(SmartPlugin):
                 self._init_complete = False
                 return
 
-        self.websocket = _websocket(self.get_sh(), self, self.ip, self.port, self.tls, self.wsproto, self.querydef)
+        self.websocket = _websocket(self.get_sh(), self, self.ip, self.port, self.tls, self.wsproto, self.querydef, self.send_interval, self.send_queue_limit)
 
         self.init_webinterface()
 
@@ -117,6 +126,7 @@ class WebSocket(SmartPlugin):
         """
         self.logger.debug("run {}".format(__name__))
         self.alive = True
+        self.websocket.start_sender()
         self.scheduler_add('series', self.websocket._update_series, cycle=10, prio=5)
         self.logger.debug("running {}".format(__name__))
 
@@ -233,6 +243,8 @@ class WebSocket(SmartPlugin):
             infos['hostname'] = client.hostname
             infos['browser'] = client.browser
             infos['browserversion'] = client.browserversion
+            infos['coalesced'] = client.send_stats['coalesced']
+            infos['deferred'] = client.send_stats['deferred']
 
             yield infos
         return
@@ -300,6 +312,8 @@ class WebInterface(SmartPluginWebIf):
             client['hostname'] = clientinfo.get('hostname', '')
             client['browser'] = clientinfo.get('browser', '')
             client['browserversion'] = clientinfo.get('browserversion', '')
+            client['coalesced'] = clientinfo.get('coalesced', 0)
+            client['deferred'] = clientinfo.get('deferred', 0)
             clients.append(client)
 
         plgitems = []
@@ -329,7 +343,7 @@ class _websocket(lib.connection.Server):
     Websocket specific class of the Plugin. Handles the websocket connections
     """
 
-    def __init__(self, sh, plugin, ip, port, tls, wsproto, querydef ):
+    def __init__(self, sh, plugin, ip, port, tls, wsproto, querydef, send_interval=0, send_queue_limit=100):
         lib.connection.Server.__init__(self, ip, port)
         self.logger = logging.getLogger(__name__)
         self._sh = sh
@@ -342,6 +356,20 @@ class _websocket(lib.connection.Server):
         self.visu_items = {}
         self.visu_logics = {}
 
+        # reverse index of monitored items: item path -> {client: [(monitored path, property name or None), ...]}
+        # the inner dicts are replaced on change (copy on write), so they can be iterated without lock
+        self._subscriptions = {}
+        self._subscriptions_lock = threading.Lock()
+
+        # item updates are collected per client and sent every send_interval seconds (0: sent immediately)
+        self.send_interval = send_interval
+        self.send_queue_limit = send_queue_limit
+        self._dirty_clients = set()
+        self._dirty_lock = threading.Lock()
+        self._flush_trigger = threading.Event()
+        self._sender = None
+        self._sender_stop = False
+
         self.tls_crt = '/usr/local/smarthome/etc/home.crt'
         self.tls_key = '/usr/local/smarthome/etc/home.key'
         self.tls_ca = '/usr/local/smarthome/etc/ca.crt'
@@ -374,6 +402,11 @@ class _websocket(lib.connection.Server):
         self.clients.append(client)
 
     def stop(self):
+        if self._sender is not None:
+            self._sender_stop = True
+            self._flush_trigger.set()
+            self._sender.join()
+            self._sender = None
         for client in self.clients:
             try:
                 client.close()
@@ -381,27 +414,128 @@ class _websocket(lib.connection.Server):
                 pass
         self.close()
 
+    def start_sender(self):
+        """
+        Start the thread, which sends the collected item updates of the clients
+        """
+        if not self.send_interval or self._sender is not None:
+            return
+        self._sender_stop = False
+        self._sender = threading.Thread(target=self._send_loop, name='plugins.visu_websocket.sender', daemon=True)
+        self._sender.start()
+
+    def schedule_flush(self, client):
+        """
+        Mark a client to have item updates waiting to be sent
+        """
+        with self._dirty_lock:
+            self._dirty_clients.add(client)
+        self._flush_trigger.set()
+
+    def _send_loop(self):
+        while not self._sender_stop:
+            self._flush_trigger.wait()
+            if self._sender_stop:
+                break
+            # collect further updates within the send interval, updates of the same item are coalesced
+            time.sleep(self.send_interval)
+            self._flush_trigger.clear()
+            with self._dirty_lock:
+                clients = self._dirty_clients
+                self._dirty_clients = set()
+            for client in clients:
+                try:
+                    client.flush_items()
+                except Exception as e:
+                    self.logger.warning("_websocket / _send_loop: cannot send to client {0}, error {1}".format(client.addr, e))
+
     def update_item(self, item_name, item_value, source):
         """
-        Dispatch the new value of an item to all connected clients
+        Dispatch the new value of an item to the clients, which monitor the item or one of its properties
         """
-        for client in list(self.clients):
+        subscribers = self._subscriptions.get(item_name)
+        if not subscribers:
+            return
+        broadcast_clients = []
+        for client, candidates in subscribers.items():
+            if not self.send_interval and len(candidates) == 1 and candidates[0][1] is None and client.addr != source:
+                # client monitors just the item itself, all those clients get the same frame
+                broadcast_clients.append(client)
+                continue
             try:
-                client.update_item(item_name, item_value, source)
+                client.update_item(item_name, item_value, source, candidates)
             except:
                 pass
+        if broadcast_clients:
+            self.broadcast({'cmd': 'item', 'items': [[item_name, item_value]]}, broadcast_clients)
 
-    def remove_client(self, client):
-        self.clients.remove(client)
+    def broadcast(self, data, clients):
+        """
+        Send the same data to several clients
 
+        The data is serialized once and the websocket frame is built once per protocol, all clients
+        are sent the same bytes object.
 
-    def _send_event(self, event, data):
-        for client in list(self.clients):
+        :param data: data to send (dict)
+        :param clients: list of websockethandler instances
+        """
+        payload = None
+        frames = {}
+        for client in clients:
+            encode_frame = client.encode_frame
+            if encode_frame is None:
+                # handshake not finished yet
+                continue
+            frame = frames.get(encode_frame)
+            if frame is None:
+                if payload is None:
+                    payload = json_dumps(data)
+                frame = frames[encode_frame] = encode_frame(payload)
             try:
-                client.send_event(event, data)
+                client.send(frame)
             except:
                 pass
 
+    def set_monitored_items(self, client, old_paths, new_paths):
+        """
+        Update the reverse index of monitored items for a client
+
+        :param client: websockethandler of the client
+        :param old_paths: paths (item or item.property.<name>) the client monitored until now
+        :param new_paths: paths the client monitors from now on
+        """
+        new_candidates = {}
+        for path in new_paths:
+            item_name, _, prop = path.partition('.property.')
+            new_candidates.setdefault(item_name, []).append((path, prop or None))
+
+        with self._subscriptions_lock:
+            for item_name in {path.partition('.property.')[0] for path in old_paths} - new_candidates.keys():
+                subscribers = dict(self._subscriptions.get(item_name, {}))
+                subscribers.pop(client, None)
+                if subscribers:
+                    self._subscriptions[item_name] = subscribers
+                else:
+                    self._subscriptions.pop(item_name, None)
+            for item_name, candidates in new_candidates.items():
+                subscribers = dict(self._subscriptions.get(item_name, {}))
+                subscribers[client] = candidates
+                self._subscriptions[item_name] = subscribers
+
+    def remove_client(self, client):
+        self.clients.remove(client)
+        self.set_monitored_items(client, client.monitor['item'], [])
+        with self._dirty_lock:
+            self._dirty_clients.discard(client)
+
+
+    def _send_event(self, event, data):
+        clients = [client for client in list(self.clients) if client.monitors_event(event, data)]
+        if clients:
+            data = data.copy()  # don't change the orignal data dict
+            data['cmd'] = event
+            self.broadcast(data, clients)
+
     def _update_series(self):
         for client in list(self.clients):
             try:
@@ -411,21 +545,16 @@ class _websocket(lib.connection.Server):
                 pass
 
     def dialog(self, header, content):
-        for client in list(self.clients):
-            try:
-                client.json_send({'cmd': 'dialog', 'header': header, 'content': content})
-            except:
-                pass
+        self.broadcast({'cmd': 'dialog', 'header': header, 'content': content}, list(self.clients))
 
     def url(self, url, clientip=''):
+        clients = []
         for client in list(self.clients):
             ip, _, port = client.addr.partition(':')
             if (clientip == '') or (clientip == ip):
                 self.logger.debug("VISU: Websocket send url to ip={}, port={}".format(str(ip),str(port)))
-                try:
-                    client.json_send({'cmd': 'url', 'url': url})
-                except:
-                    pass
+                clients.append(client)
+        self.broadcast({'cmd': 'url', 'url': url}, clients)
 
 
 #########################################################################
@@ -443,6 +572,7 @@ class websockethandler(lib.connection.Stream):
         self.shtime = dispatcher.shtime
         self._dp = dispatcher
         self.found_terminator = self.parse_header
+        self.encode_frame = None    # set by the handshake to the frame encoder of the protocol
         self.addr = addr
         self.header = {}
         self.monitor = {'item': [], 'rrd': [], 'log': []}
@@ -463,17 +593,29 @@ class websockethandler(lib.connection.Stream):
         self.browser = ''
         self.browserversion = ''
 
+        # item updates waiting to be sent (item path -> value), if the dispatcher has a send interval
+        self._pending_items = {}
+        self._pending_lock = threading.Lock()
+        self.send_stats = {'coalesced': 0, 'deferred': 0}
+        self._deferred_logged = 0   # time of the last log message about a slow client
+
         # get access to the logics api
         from lib.logic import Logics
         self.logics = Logics.get_instance()
         return
 
 
-    def send_event(self, event, data):
-        data = data.copy()  # don't filter the orignal data dict
+    def monitors_event(self, event, data):
+        """
+        Returns True, if the client monitors the event (e.g. a log)
+        """
         if event not in self.monitor:
-            return
-        if data[self.monitor_id[event]] in self.monitor[event]:
+            return False
+        return data[self.monitor_id[event]] in self.monitor[event]
+
+    def send_event(self, event, data):
+        if self.monitors_event(event, data):
+            data = data.copy()  # don't filter the orignal data dict
             data['cmd'] = event
 #            self.logger.warning("VISU: send_event send to {0}: {1}".format(self.addr, data))
             self.json_send(data)
@@ -489,40 +631,84 @@ class websockethandler(lib.connection.Stream):
         except:
             pass
 
-    def update_item(self, item_name, item_value, source):
+    def update_item(self, item_name, item_value, source, candidates):
         """
         send JSON data with new value of an item
+
+        :param candidates: monitored paths of the item as list of (path, property name or None), from the
+                           reverse index of the dispatcher
         """
         items = []
-        for candidate in self.monitor['item']:
+        for candidate, prop_name in candidates:
             try:
-                #self.logger.debug("Send update to Client {0} for candidate {1} and item_name {2}?".format(self.addr, candidate, item_name))
-                path_parts = candidate.split('.property.')
-                if path_parts[0] != item_name:
-                    continue
-
-                if len(path_parts) == 1 and self.addr != source:
-                    self.logger.debug("Send update to Client {0} for item {1}".format(self.addr, path_parts[0]))
-                    items.append([path_parts[0], item_value])
+                if prop_name is None:
+                    if self.addr != source:
+                        self.logger.debug("Send update to Client {0} for item {1}".format(self.addr, item_name))
+                        items.append([item_name, item_value])
                     continue
 
-                if len(path_parts) == 2:
-                    self.logger.debug("Send update to Client {0} for item {1} with property {2}".format(self.addr, path_parts[0], path_parts[1]))
-                    prop = self.items[path_parts[0]]['item'].property
-                    prop_attr = getattr(prop,path_parts[1])
-                    items.append([candidate, prop_attr])
-                    continue
-
-                if self.addr == source:
-                    continue
-
-                self.logger.warning("Could not send update to Client {0}: something is wrong with item path {1}, value={2}, source={3}".format(self.addr, item_name, item_value, source))
+                self.logger.debug("Send update to Client {0} for item {1} with property {2}".format(self.addr, item_name, prop_name))
+                prop = self.items[item_name]['item'].property
+                prop_attr = getattr(prop, prop_name)
+                items.append([candidate, prop_attr])
             except:
                 pass
 
         if len(items): # only send an update if item/value pairs found to be send
-            data = {'cmd': 'item', 'items': items}
-            self.json_send(data)
+            if self._dp.send_interval:
+                self.queue_items(items)
+            else:
+                data = {'cmd': 'item', 'items': items}
+                self.json_send(data)
+
+    def queue_items(self, items):
+        """
+        Queue item updates to be sent by the dispatcher's sender thread
+
+        An update of an item, which is still waiting to be sent, replaces the waiting value, so at most one update
+        per monitored item is waiting.
+
+        :param items: list of [path, value]
+        """
+        with self._pending_lock:
+            for path, value in items:
+                if path in self._pending_items:
+                    self.send_stats['coalesced'] += 1
+                self._pending_items[path] = value
+        self._dp.schedule_flush(self)
+
+    def flush_items(self):
+        """
+        Send all queued item updates in one frame
+
+        If send_queue_limit frames are still waiting in the outbound buffer of the connection, the client is not
+        fast enough: the updates are kept (and further updates coalesced) until the buffer is drained.
+        """
+        backlog = self.send_backlog()
+        with self._pending_lock:
+            if not self._pending_items:
+                return
+            if backlog >= self._dp.send_queue_limit:
+                self.send_stats['deferred'] += 1
+                deferred = True
+            else:
+                items = [[path, value] for path, value in self._pending_items.items()]
+                self._pending_items = {}
+                deferred = False
+        if deferred:
+            now = time.time()
+            if now - self._deferred_logged >= 60:
+                self._deferred_logged = now
+                self.logger.info("Client {0} is not fast enough ({1} frames waiting), item updates are deferred and coalesced ({2} times until now)".format(self.addr, backlog, self.send_stats['deferred']))
+            self._dp.schedule_flush(self)
+            return
+        self.json_send({'cmd': 'item', 'items': items})
+
+    def send_backlog(self):
+        """
+        Returns the number of frames in the outbound buffer of the connection, which are not sent yet
+        """
+        return len(getattr(self, 'outbuffer', ()))
 
     def update_series(self):
 #        now = self._sh.now()
@@ -612,6 +798,7 @@ class websockethandler(lib.connection.Stream):
             self.json_send({'cmd': 'item', 'items': items})
             # monitored items will also contain those with .property. which is not right, we need to strip .property
             ### old: self.monitor['item'] = data['items']
+            self._dp.set_monitored_items(self, self.monitor['item'], newmonitor_items)
             self.monitor['item'] = newmonitor_items
             self.logger.debug("Client {0} new monitored items are {1}".format(self.addr, newmonitor_items))
 
@@ -855,6 +1042,7 @@ class websockethandler(lib.connection.Stream):
         self.terminator = 8
         self.found_terminator = self.rfc6455_parse
         self.json_send = self.rfc6455_send
+        self.encode_frame = rfc6455_frame
         key = self.header[b'Sec-WebSocket-Key'] + b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
         key = base64.b64encode(hashlib.sha1(key).digest()).decode()
         self.send('HTTP/1.1 101 Switching Protocols\r\n'.encode())
@@ -905,33 +1093,13 @@ class websockethandler(lib.connection.Stream):
         self.terminator = 8
 
     def rfc6455_send(self, data):
-        data = json.dumps(data, cls=JSONEncoder, separators=(',', ':'))
         #self.logger.info("rfc6455_send: Sending {}".format(data))
-        header = bytearray(2)
-        header[0] = self.set_bit(header[0], 0)  # opcode text
-        header[0] = self.set_bit(header[0], 7)  # final
-        length = len(data)
-        if length < 126:
-            header[1] = length
-        elif length < ((1 << 16) - 1):
-            header[1] = 126
-            header += bytearray(length.to_bytes(2, byteorder='big'))
-        elif length < ((1 << 64) - 1):
-            header[1] = 127
-            header += bytearray(length.to_bytes(8, byteorder='big'))
-        else:
-            self.logger.warning("data to big: {0}".format(data))
-            return
-        self.send(header + data.encode())
+        self.send(rfc6455_frame(json_dumps(data)))
 
     def hixie76_send(self, data):
-        data = json.dumps(data, cls=JSONEncoder, separators=(',', ':'))
-        self.logger.info("hixie76_send: Sending {}".format(data))
-        packet = bytearray()
-        packet.append(0x00)
-        packet.extend(data.encode())
-        packet.append(0xff)
-        self.send(packet)
+        data = json_dumps(data)
+        self.logger.info("hixie76_send: Sending {}".format(data.decode()))
+        self.send(hixie76_frame(data))
 
     def hixie76_parse(self, data):
         self.logger.info("hixie76_parse: Received {}".format(data.decode().lstrip('\x00')))
@@ -960,11 +1128,54 @@ class websockethandler(lib.connection.Stream):
         self.send(key.digest())
         self.found_terminator = self.hixie76_parse
         self.json_send = self.hixie76_send
+        self.encode_frame = hixie76_frame
         self.terminator = b"\xff"
 
 
 #########################################################################
 
+def rfc6455_frame(payload):
+    """
+    Build a rfc6455 (final, text) frame for the encoded payload
+    """
+    length = len(payload)
+    if length < 126:
+        header = bytes((0x81, length))
+    elif length < (1 << 16):
+        header = struct.pack('!BBH', 0x81, 126, length)
+    else:
+        header = struct.pack('!BBQ', 0x81, 127, length)
+    return header + payload
+
+
+def hixie76_frame(payload):
+    """
+    Build a hixie76 frame for the encoded payload
+    """
+    return b'\x00' + payload + b'\xff'
+
+
+def _orjson_default(obj):
+    # types, which are not supported by orjson, are converted like in JSONEncoder
+    if isinstance(obj, datetime.timedelta):
+        return int(obj.total_seconds())
+    elif isinstance(obj, decimal.Decimal):
+        return float(obj)
+    raise TypeError
+
+
+def json_dumps(data):
+    """
+    Serialize data to utf-8 encoded JSON, using orjson if it is installed
+    """
+    if ORJSON_ENABLED:
+        try:
+            return orjson.dumps(data, default=_orjson_default)
+        except TypeError:
+            pass
+    return json.dumps(data, cls=JSONEncoder, separators=(',', ':')).encode()
+
+
 class JSONEncoder(json.JSONEncoder):
 
     def default(self, obj):